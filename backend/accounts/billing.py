@@ -0,0 +1,152 @@
+import datetime
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.models import Account, Payment
+from accounts.schedule_cache import invalidate_schedules
+from classes.counters import mark_enrollment_changed
+from classes.models import ClassInstance
+
+logger = logging.getLogger(__name__)
+
+
+class BillingConflict(Exception):
+    """Raised when some of the payments in a chunk have already been processed (e.g. by another billing run)."""
+
+    def __init__(self, account_ids):
+        super().__init__(account_ids)
+        self.account_ids = account_ids
+
+
+def get_total(subscription):
+    # Charge includes 13% HST
+    return round(float(subscription.charge) * 1.13 * 100) / 100
+
+
+def get_due_accounts(now):
+    """Accounts whose next payment is due (i.e. in the past and not yet completed).
+    """
+    return Account.objects.filter(Q(next_payment__completed=False) & Q(next_payment__date__lt=now))
+
+
+def bill_accounts(accounts, now, limit):
+    """Renews or expires (up to `limit` of) the due `accounts`, in one transaction. Returns the number of
+    (completed transactions, expired subscriptions), or None if no accounts were due.
+    """
+    with transaction.atomic():
+        accounts = list(
+            accounts.select_for_update(skip_locked=True, of=("self",))
+            .select_related("next_payment", "subscription")
+            .order_by("pk")[:limit]
+        )
+        if not accounts:
+            return None
+        renewing = [account for account in accounts if not account.next_payment.cancelled]
+        expiring = [account for account in accounts if account.next_payment.cancelled]
+        renew_accounts(renewing, now)
+        expire_accounts(expiring)
+    return len(renewing), len(expiring)
+
+
+def process_due_payments(now=None, chunk_size=500, max_retries=3):
+    """Renews (or expires, if cancelled) the subscriptions of all accounts with a payment due.
+
+    Accounts are processed in chunks, each in its own transaction. Payments are claimed with a conditional
+    update before anything else is written, so that concurrent runs never process the same payment twice.
+    A chunk that still conflicts after `max_retries` retries (e.g. because two accounts share a payment) is
+    processed one account at a time instead, and the accounts that conflict are skipped (and logged).
+    Returns the number of (completed transactions, expired subscriptions).
+    """
+    now = now or timezone.now()
+    completed = 0
+    expired = 0
+    retries = 0
+    skipped = set()
+    while True:
+        due = get_due_accounts(now).exclude(pk__in=skipped)
+        try:
+            processed = bill_accounts(due, now, chunk_size)
+        except BillingConflict as conflict:
+            if retries < max_retries:
+                retries += 1
+                logger.info("Billing chunk conflicted with a concurrent run, retrying.")
+                continue
+            retries = 0
+            for account_id in conflict.account_ids:
+                try:
+                    processed = bill_accounts(due.filter(pk=account_id), now, 1)
+                except BillingConflict:
+                    processed = None
+                if processed is None:
+                    # Its payment was processed with another account's (or by a concurrent run)
+                    logger.warning("Skipping account %s, whose payment was already processed.", account_id)
+                    skipped.add(account_id)
+                    continue
+                completed += processed[0]
+                expired += processed[1]
+            continue
+        if processed is None:
+            break
+        retries = 0
+        completed += processed[0]
+        expired += processed[1]
+    return completed, expired
+
+
+def renew_accounts(accounts, now):
+    """Completes the due payments of `accounts`, and creates their next future payments.
+    """
+    if not accounts:
+        return
+    claimed = Payment.objects.filter(
+        pk__in=[account.next_payment_id for account in accounts], completed=False
+    ).update(completed=True)
+    if claimed != len(accounts):
+        raise BillingConflict([account.pk for account in accounts])
+
+    payments = [
+        Payment(amount=get_total(account.subscription),
+                # Use the same payment info as the last payment
+                payment_info=account.next_payment.payment_info,
+                # Next payment date depends on current subscription billing cycle
+                date=now + datetime.timedelta(days=(30 if account.subscription.billing_cycle == "MONTHLY" else 365)),
+                completed=False,
+                account=account)
+        for account in accounts
+    ]
+    if connection.features.can_return_rows_from_bulk_insert:
+        Payment.objects.bulk_create(payments)
+    else:
+        # We need the primary keys of the new payments
+        for payment in payments:
+            payment.save()
+    for account, payment in zip(accounts, payments):
+        account.next_payment = payment
+    Account.objects.bulk_update(accounts, ["next_payment"])
+
+
+def expire_accounts(accounts):
+    """Removes the (cancelled) subscriptions of `accounts`, along with their enrollments.
+    """
+    if not accounts:
+        return
+    account_ids = [account.pk for account in accounts]
+    claimed = Account.objects.filter(
+        pk__in=account_ids, next_payment__in=[account.next_payment_id for account in accounts]
+    ).update(subscription=None, next_payment=None)
+    if claimed != len(accounts):
+        raise BillingConflict(account_ids)
+    # Without a subscription, user cannot be enrolled in classes
+    mark_enrollment_changed(Account.classes.through.objects.filter(account_id__in=account_ids).values_list("class_id", flat=True))
+    mark_enrollment_changed(ClassInstance.objects.filter(
+        pk__in=Account.enrolled_instances.through.objects.filter(account_id__in=account_ids).values("classinstance_id")
+    ).values_list("parent_id", flat=True))
+    Account.enrolled_instances.through.objects.filter(account_id__in=account_ids).delete()
+    # (Like unenrolling from each class does)
+    Account.dropped_instances.through.objects.filter(account_id__in=account_ids).delete()
+    Account.classes.through.objects.filter(account_id__in=account_ids).delete()
+    # Deleting the through rows directly doesn't send `m2m_changed`
+    invalidate_schedules(account_ids)
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.billing import process_due_payments
+
+
+class Command(BaseCommand):
+    help = "Makes subscription transactions that are due, and expires cancelled subscriptions " \
+           "(intended to be run periodically, e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="Number of accounts to process per transaction.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        completed, expired = process_due_payments(chunk_size=options["chunk_size"])
+        elapsed = time.perf_counter() - start
+        self.stdout.write("{} transaction(s) completed.".format(completed))
+        self.stdout.write("{} subscription(s) expired.".format(expired))
+        self.stdout.write("Processed {} account(s) in {:.2f}s ({:.1f} accounts/s).".format(
+            completed + expired, elapsed, (completed + expired) / elapsed if elapsed else 0
+        ))
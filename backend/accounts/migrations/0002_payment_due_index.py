@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-17 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('completed', False)), fields=['date'], name='accounts_payment_due_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-17 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_payment_due_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='avatar_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -45,6 +45,8 @@ class Account(AbstractBaseUser, PermissionsMixin):
     first_name = models.CharField(max_length=255, blank=True)
     last_name = models.CharField(max_length=255, blank=True)
     avatar = models.ImageField(upload_to="avatars/", blank=True)
+    # Resized copies of `avatar`, generated in the background (see `utils.images`)
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     phone_num = models.CharField("Phone number", max_length=15, blank=True, validators=[validate_phone_number])
     subscription = models.ForeignKey("Subscription", on_delete=models.SET_NULL, null=True, blank=True)
     next_payment = models.ForeignKey("Payment", related_name="+", on_delete=models.SET_NULL, null=True, blank=True)
@@ -103,5 +105,11 @@ class Payment(models.Model):
     cancelled = models.BooleanField(default=False)
     account = models.ForeignKey("Account", related_name="payments", on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Used by the billing job to find payments that are due
+            models.Index(fields=["date"], condition=models.Q(completed=False), name="accounts_payment_due_idx"),
+        ]
+
     def __str__(self):
         return "${} - {} - {}".format(self.amount, self.account, self.date)
@@ -0,0 +1,114 @@
+import datetime
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from accounts.models import Account
+
+STATS = ("hits", "misses")
+
+
+def get_cache():
+    return caches[settings.SCHEDULE_CACHE["ALIAS"]]
+
+
+def version_key(user_id):
+    return "schedule:version:{}".format(user_id)
+
+
+def stats_key(name):
+    return "schedule:stats:{}".format(name)
+
+
+def get_version(cache, user_id):
+    """Returns the current version of the user's cached schedule.
+
+    Invalidating a schedule deletes its version, so that the next request starts a new one. Entries cached
+    under an old version (including by a request that was building its schedule during invalidation)
+    are never read again.
+    """
+    version = cache.get(version_key(user_id))
+    if version is None:
+        version = uuid.uuid4().hex
+        # Use add(), so that concurrent requests agree on the new version
+        if not cache.add(version_key(user_id), version, timeout=None):
+            version = cache.get(version_key(user_id), version)
+    return version
+
+
+def record(name):
+    cache = get_cache()
+    cache.add(stats_key(name), 0, timeout=None)
+    try:
+        cache.incr(stats_key(name))
+    except ValueError:
+        # Evicted since it was added
+        cache.add(stats_key(name), 1, timeout=None)
+
+
+def get_stats():
+    cache = get_cache()
+    values = cache.get_many([stats_key(name) for name in STATS])
+    return {name: values.get(stats_key(name), 0) for name in STATS}
+
+
+def timetable_key(cache, user, days):
+    return "schedule:{}:{}:{}:{}".format(user.pk, get_version(cache, user.pk), datetime.date.today().isoformat(),
+                                         days)
+
+
+def get_timetable(user, days, build):
+    """Returns the instances of `user` within `days` of today, building them with `build()` on a cache miss.
+
+    The timetable isn't filtered by the time of day, so a cached timetable can be split into the user's
+    history, ongoing and future instances at any time (see `instance_date_filter`). Timetables are cached
+    per day, so they roll over at midnight.
+    """
+    cache = get_cache()
+    key = timetable_key(cache, user, days)
+    timetable = cache.get(key)
+    if timetable is None:
+        record("misses")
+        timetable = build()
+        cache.set(key, timetable, timeout=settings.SCHEDULE_CACHE["TIMEOUT"])
+    else:
+        record("hits")
+    return timetable
+
+
+async def aget_timetable(user, days, build):
+    """Like `get_timetable`, for async views (`build()` is awaited).
+    """
+    cache = get_cache()
+    key = await sync_to_async(timetable_key)(cache, user, days)
+    timetable = await cache.aget(key)
+    if timetable is None:
+        await sync_to_async(record)("misses")
+        timetable = await build()
+        await cache.aset(key, timetable, timeout=settings.SCHEDULE_CACHE["TIMEOUT"])
+    else:
+        await sync_to_async(record)("hits")
+    return timetable
+
+
+def invalidate_schedules(user_ids):
+    """Invalidates the cached schedules of the given users, once the current transaction commits.
+    """
+    keys = [version_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+def invalidate_class_schedules(class_id):
+    """Invalidates the cached schedules of all users enrolled in the class (or any of its instances).
+    """
+    # Look up the users through the enrollment tables (filtering accounts on an OR of the two joins would
+    # scan every account)
+    invalidate_schedules(set(
+        Account.classes.through.objects.filter(class_id=class_id).values_list("account_id", flat=True)
+        .union(Account.enrolled_instances.through.objects.filter(classinstance__parent_id=class_id)
+               .values_list("account_id", flat=True))
+    ))
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 
+from utils.images import variant_urls
 from .models import Account, Subscription, PaymentInfo, Payment
 
 
@@ -19,12 +20,16 @@ class AccountSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     new_password = serializers.CharField(required=False)
     card_num = serializers.SerializerMethodField()
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Account
-        fields = ["id", "email", "password", "first_name", "last_name", "avatar",
+        fields = ["id", "email", "password", "first_name", "last_name", "avatar", "avatar_variants",
                   "phone_num", "new_password", "card_num"]
 
+    def get_avatar_variants(self, instance):
+        return variant_urls(instance.avatar, instance.avatar_variants)
+
     def get_card_num(self, instance):
         try:
             PaymentInfo.objects.get(account=instance)
@@ -0,0 +1,75 @@
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from accounts.models import Account
+from accounts.schedule_cache import invalidate_schedules, invalidate_class_schedules
+from classes.counters import mark_enrollment_changed
+from classes.models import Class, ClassInstance
+from utils.images import register_variants
+
+
+@receiver(m2m_changed, sender=Account.classes.through)
+@receiver(m2m_changed, sender=Account.enrolled_instances.through)
+@receiver(m2m_changed, sender=Account.dropped_instances.through)
+def enrollment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidates the schedules of users that have enrolled in or dropped a class or instance.
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_schedules([instance.pk])
+    elif action in ("post_add", "post_remove"):
+        invalidate_schedules(pk_set)
+    elif action == "pre_clear":
+        # The users are about to be removed, so we have to look them up now
+        invalidate_schedules(
+            sender.objects.filter(**{"{}_id".format(instance._meta.model_name): instance.pk})
+            .values_list("account_id", flat=True)
+        )
+
+
+@receiver(m2m_changed, sender=Account.classes.through)
+def class_enrollment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Records which classes' enrollment counters have to be checked by the next incremental reconciliation.
+    """
+    if action in ("post_add", "post_remove") and pk_set:
+        mark_enrollment_changed([instance.pk] if reverse else pk_set)
+    elif action == "pre_clear":
+        mark_enrollment_changed([instance.pk] if reverse else
+                                sender.objects.filter(account_id=instance.pk).values_list("class_id", flat=True))
+
+
+@receiver(m2m_changed, sender=Account.enrolled_instances.through)
+@receiver(m2m_changed, sender=Account.dropped_instances.through)
+def instance_enrollment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("post_add", "post_remove") and pk_set:
+        mark_enrollment_changed([instance.parent_id] if reverse else
+                                ClassInstance.objects.filter(pk__in=pk_set).values_list("parent_id", flat=True))
+    elif action == "pre_clear":
+        mark_enrollment_changed([instance.parent_id] if reverse else ClassInstance.objects.filter(
+            pk__in=sender.objects.filter(account_id=instance.pk).values("classinstance_id")
+        ).values_list("parent_id", flat=True))
+
+
+# Fields that aren't shown in schedules, so saving only these doesn't invalidate them
+UNSCHEDULED_FIELDS = {"enrolled", "capacity", "description", "occurrences_start", "occurrences_end"}
+
+
+def affects_schedules(update_fields):
+    return update_fields is None or not UNSCHEDULED_FIELDS.issuperset(update_fields)
+
+
+@receiver(post_save, sender=Class)
+@receiver(pre_delete, sender=Class)
+def class_changed(sender, instance, update_fields=None, **kwargs):
+    if affects_schedules(update_fields):
+        invalidate_class_schedules(instance.pk)
+
+
+@receiver(post_save, sender=ClassInstance)
+@receiver(pre_delete, sender=ClassInstance)
+def instance_changed(sender, instance, update_fields=None, **kwargs):
+    if affects_schedules(update_fields):
+        invalidate_class_schedules(instance.parent_id)
+
+
+register_variants(Account, "avatar", "avatar_variants")
@@ -1 +1,229 @@
-# Create your tests here.
+import datetime
+
+import recurrence
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.utils import timezone
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from accounts.billing import process_due_payments
+from accounts.models import Account, Payment, Subscription
+from accounts.schedule_cache import get_cache, get_stats
+from classes.counters import Drift, reconcile_counters
+from classes.models import Class, ClassInstance
+from studios.models import Studio
+from studios.tests import frozen_clock
+
+
+class ListScheduleTests(TestCase):
+    def setUp(self):
+        self.today = datetime.date.today()
+        clock = frozen_clock(datetime.datetime.combine(self.today, datetime.time(12)))
+        clock.__enter__()
+        self.addCleanup(clock.close)
+        self.studio = Studio.objects.create(name="Studio", address="1 King St W", lat=43.6487, long=-79.3817,
+                                            postal_code="M5H 1A1", phone_num="4165550100")
+        self.user = Account.objects.create_user(email="member@email.com", password="123")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.classes = []
+        for i in range(3):
+            class_obj = Class.objects.create(
+                name="Class {}".format(i), studio=self.studio, coach="Coach", capacity=10,
+                start_time=datetime.time(23, 58), end_time=datetime.time(23, 59),
+                schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)])
+            )
+            self.user.classes.add(class_obj)
+            self.classes.append(class_obj)
+        get_cache().clear()
+
+    def drop(self, class_obj, days):
+        with self.captureOnCommitCallbacks(execute=True):
+            for day in range(days):
+                instance = ClassInstance.objects.create(
+                    date=self.today + datetime.timedelta(days=day + 1),
+                    start_time=class_obj.start_time, end_time=class_obj.end_time, special=False, parent=class_obj
+                )
+                self.user.dropped_instances.add(instance)
+
+    def get_schedule(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/accounts/schedule/", {"range": 14, "limit": 100})
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_dropped_instances_are_excluded(self):
+        self.drop(self.classes[0], 2)
+        data, _ = self.get_schedule()
+        dropped_dates = {self.today + datetime.timedelta(days=day + 1) for day in range(2)}
+        for item in data["results"]:
+            if item["class_id"] == self.classes[0].id:
+                self.assertNotIn(item["date"], dropped_dates)
+        self.assertEqual(data["count"], 3 * 15 - 2)
+
+    def test_query_count_does_not_grow_with_dropped_instances(self):
+        self.drop(self.classes[0], 1)
+        _, baseline = self.get_schedule()
+        for class_obj in self.classes[1:]:
+            self.drop(class_obj, 10)
+        _, num_queries = self.get_schedule()
+        self.assertEqual(num_queries, baseline)
+
+    def test_schedule_is_cached(self):
+        data, baseline = self.get_schedule()
+        cached, num_queries = self.get_schedule()
+        self.assertEqual(cached, data)
+        self.assertLess(num_queries, baseline)
+        self.assertEqual(get_stats(), {"hits": 1, "misses": 1})
+
+        # The history and ongoing lists are split from the same cached timetable
+        response = self.client.get("/accounts/history/", {"range": 14})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_stats(), {"hits": 2, "misses": 1})
+
+    def test_cache_is_invalidated(self):
+        self.get_schedule()
+        # Dropping an instance
+        self.drop(self.classes[0], 1)
+        data, _ = self.get_schedule()
+        self.assertEqual(data["count"], 3 * 15 - 1)
+        # Dropping a class
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.classes.remove(self.classes[1])
+        data, _ = self.get_schedule()
+        self.assertEqual(data["count"], 2 * 15 - 1)
+        # Rescheduling a class
+        with self.captureOnCommitCallbacks(execute=True):
+            self.classes[2].start_time = datetime.time(23, 57)
+            self.classes[2].save()
+        data, _ = self.get_schedule()
+        self.assertIn(datetime.time(23, 57), {item["start_time"] for item in data["results"]})
+        self.assertEqual(get_stats()["hits"], 0)
+
+    def test_ongoing_rolls_over(self):
+        instance = ClassInstance.objects.create(
+            date=self.today, start_time=datetime.time(12, 1), end_time=datetime.time(23, 50), special=True,
+            parent=self.classes[0]
+        )
+        response = self.client.get("/accounts/ongoing/")
+        self.assertEqual(response.data["count"], 0)
+        # The cached timetable is filtered again once the instance starts
+        with frozen_clock(datetime.datetime.combine(self.today, datetime.time(12, 2))):
+            response = self.client.get("/accounts/ongoing/")
+        self.assertEqual([item["start_time"] for item in response.data["results"]], [instance.start_time])
+        self.assertEqual(get_stats(), {"hits": 1, "misses": 1})
+
+
+    def test_async_views(self):
+        self.drop(self.classes[0], 2)
+        ClassInstance.objects.create(date=self.today - datetime.timedelta(days=1),
+                                     start_time=datetime.time(10), end_time=datetime.time(11),
+                                     special=True, parent=self.classes[1])
+        token = RefreshToken.for_user(self.user).access_token
+
+        async def get(path, params, **headers):
+            return await self.async_client.get(path, params, **headers)
+
+        for path, params in (("schedule/", {"range": 14, "limit": 100}), ("schedule/", {"limit": 5, "page": 3}),
+                             ("history/", {"range": 14}), ("ongoing/", {})):
+            expected = self.client.get("/accounts/" + path, params)
+            response = async_to_sync(get)("/async/accounts/" + path, params, authorization="Bearer {}".format(token))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content.replace(b"/async/", b"/"), expected.content)
+        response = async_to_sync(get)("/async/accounts/schedule/", {})
+        self.assertEqual(response.status_code, 401)
+
+
+class BillingTests(TestCase):
+    def setUp(self):
+        self.subscription = Subscription.objects.create(billing_cycle="MONTHLY", charge=10)
+        self.studio = Studio.objects.create(name="Studio", address="1 King St W", lat=43.6487, long=-79.3817,
+                                            postal_code="M5H 1A1", phone_num="4165550100")
+        self.class_obj = Class.objects.create(
+            name="Class", studio=self.studio, coach="Coach", capacity=10,
+            start_time=datetime.time(10), end_time=datetime.time(11),
+            schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)])
+        )
+
+    def create_account(self, email, days_until_payment, cancelled=False):
+        account = Account.objects.create_user(email=email, password="123", subscription=self.subscription)
+        account.next_payment = Payment.objects.create(
+            amount=11.3, payment_info="4111111111111111", cancelled=cancelled, account=account,
+            date=timezone.now() + datetime.timedelta(days=days_until_payment)
+        )
+        account.save()
+        account.classes.add(self.class_obj)
+        return account
+
+    def test_due_payments(self):
+        renewing = self.create_account("renewing@email.com", -1)
+        expiring = self.create_account("expiring@email.com", -1, cancelled=True)
+        current = self.create_account("current@email.com", 1)
+        due_payment = renewing.next_payment
+
+        self.assertEqual(process_due_payments(chunk_size=1), (1, 1))
+
+        renewing.refresh_from_db()
+        due_payment.refresh_from_db()
+        self.assertTrue(due_payment.completed)
+        self.assertNotEqual(renewing.next_payment, due_payment)
+        self.assertFalse(renewing.next_payment.completed)
+        self.assertGreater(renewing.next_payment.date, timezone.now() + datetime.timedelta(days=29))
+
+        expiring.refresh_from_db()
+        self.assertIsNone(expiring.subscription)
+        self.assertIsNone(expiring.next_payment)
+        self.assertFalse(expiring.classes.exists())
+
+        current_payment = current.next_payment
+        current.refresh_from_db()
+        self.assertEqual(current.next_payment, current_payment)
+
+        # Running again should have nothing left to do
+        self.assertEqual(process_due_payments(), (0, 0))
+        self.assertEqual(renewing.payments.count(), 2)
+
+    def test_shared_payments(self):
+        first = self.create_account("first@email.com", -1)
+        second = self.create_account("second@email.com", -1)
+        other = self.create_account("other@email.com", -1)
+        shared_payment = first.next_payment
+        second.next_payment = shared_payment
+        second.save()
+
+        # The payment is only made once, and the other accounts are still billed
+        with self.assertLogs("accounts.billing", level="WARNING") as logs:
+            self.assertEqual(process_due_payments(), (2, 0))
+        self.assertIn("Skipping account {}".format(second.pk), logs.output[0])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        other.refresh_from_db()
+        self.assertNotEqual(first.next_payment, shared_payment)
+        self.assertEqual(second.next_payment, shared_payment)
+        self.assertFalse(other.next_payment.completed)
+        self.assertEqual(process_due_payments(), (0, 0))
+
+    def test_expired_accounts_are_reconciled(self):
+        expiring = self.create_account("expiring@email.com", -1, cancelled=True)
+        self.create_account("current@email.com", 1)
+        instance = ClassInstance.objects.create(date=datetime.date.today() + datetime.timedelta(days=1),
+                                                start_time=datetime.time(10), end_time=datetime.time(11),
+                                                special=False, parent=self.class_obj)
+        expiring.dropped_instances.add(instance)
+        # A drop left behind by a user who is no longer enrolled in the class
+        Account.objects.create_user(email="former@email.com", password="123").dropped_instances.add(instance)
+        with self.assertLogs("classes.counters", level="WARNING"):
+            reconcile_counters()
+        instance.refresh_from_db()
+        self.assertEqual(instance.enrolled, 1)
+
+        process_due_payments()
+        self.assertFalse(expiring.dropped_instances.exists())
+        with self.assertLogs("classes.counters", level="WARNING"):
+            drift = reconcile_counters()
+        self.assertEqual(drift, [Drift("class", self.class_obj.pk, 2, 1)])
+        instance.refresh_from_db()
+        self.assertEqual(instance.enrolled, 1)
@@ -2,7 +2,7 @@ from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView
 
 from .views import CreateAccount, AccountRetrieveUpdate, SubscriptionView, ListPayments, ListSchedule, ListHistory, \
-    ListOngoing
+    ListOngoing, ScheduleCacheStats, AsyncListSchedule, AsyncListHistory, AsyncListOngoing
 
 app_name = "accounts"
 
@@ -15,4 +15,12 @@ urlpatterns = [
     path("schedule/", ListSchedule.as_view(), name="schedule"),
     path("history/", ListHistory.as_view(), name="history"),
     path("ongoing/", ListOngoing.as_view(), name="ongoing"),
+    path("schedule/cache/", ScheduleCacheStats.as_view(), name="schedule_cache"),
+]
+
+# Async variants (see tfc/urls.py)
+async_urlpatterns = [
+    path("schedule/", AsyncListSchedule.as_view(), name="schedule"),
+    path("history/", AsyncListHistory.as_view(), name="history"),
+    path("ongoing/", AsyncListOngoing.as_view(), name="ongoing"),
 ]
@@ -1,13 +1,19 @@
+import asyncio
 import datetime
+import heapq
 
 from django.db.models import ObjectDoesNotExist
 from rest_framework import generics, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from utils.async_views import AsyncRetrieveAPIView
 from utils.pagination import LimitPageNumberPagination
-from utils.instance_helpers import get_all_instances, get_exact_instances, ClassInstancePaginator
+from utils.instance_helpers import get_exact_instances, get_dropped_exceptions, iter_class_instances, \
+    instance_date_filter, instance_key, history_key, ClassInstancePaginator, aget_dropped_exceptions, \
+    aget_exact_instances, aiter_class_instances
 from .models import Account, Subscription, PaymentInfo, Payment
+from .schedule_cache import aget_timetable, get_stats, get_timetable
 from .serializers import AccountSerializer, ChangePasswordSerializer, SubscriptionSerializer, PaymentInfoSerializer, \
     PaymentSerializer
 
@@ -216,82 +222,99 @@ class ListPayments(generics.ListAPIView):
         return self.request.user.payments.order_by("-date")
 
 
+def build_timetable(request):
+    """Builds all of the user's instances within `range` days of today (see `get_timetable`).
+    """
+    # Get instances for classes that user has enrolled in
+    class_instances = iter_class_instances(request.user.classes.select_related("studio"), request,
+                                           get_dropped_exceptions(request.user), when=None)
+    # Get specific instances that user has enrolled in
+    enrolled_instances = request.user.enrolled_instances.all()
+    exact_instances = get_exact_instances(enrolled_instances, request, when=None)
+    return list(heapq.merge(class_instances, exact_instances, key=instance_key))
+
+
+def get_instances(request, when):
+    days = int(request.query_params.get("range", 14))
+    timetable = get_timetable(request.user, days, lambda: build_timetable(request))
+    return filter(instance_date_filter(days, when), timetable)
+
+
 class ListSchedule(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
 
     def retrieve(self, request, **kwargs):
-        all_instances = []
-        # Get instances for classes that user has enrolled in
-        enrolled_classes = request.user.classes.all()
-        dropped_instances = request.user.dropped_instances.all()
-
-        for class_obj in enrolled_classes:
-            special_exceptions = dropped_instances.filter(parent=class_obj, special=True)
-            nonspecial_exceptions = dropped_instances.filter(parent=class_obj, special=False)
-            all_instances.extend(
-                get_all_instances(class_obj.studio, class_obj, request,
-                                  special_exceptions, nonspecial_exceptions, when=1)
-            )
-
-        # Get specific instances that user has enrolled in
-        enrolled_instances = request.user.enrolled_instances.all()
-        all_instances.extend(get_exact_instances(enrolled_instances, request, when=1))
-
-        # Paginate and return
-        data = sorted(all_instances, key=lambda i: (i["date"], i["start_time"]))
         paginator = ClassInstancePaginator(request)
-        return paginator.paginate_list(data)
+        return paginator.paginate(get_instances(request, when=1))
 
 
 class ListHistory(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
 
     def retrieve(self, request, **kwargs):
-        all_instances = []
-        # Get instances for classes that user has enrolled in
-        enrolled_classes = request.user.classes.all()
-        dropped_instances = request.user.dropped_instances.all()
-
-        for class_obj in enrolled_classes:
-            special_exceptions = dropped_instances.filter(parent=class_obj, special=True)
-            nonspecial_exceptions = dropped_instances.filter(parent=class_obj, special=False)
-            all_instances.extend(
-                get_all_instances(class_obj.studio, class_obj, request,
-                                  special_exceptions, nonspecial_exceptions, when=-1)
-            )
-
-        # Get specific instances that user has enrolled in
-        enrolled_instances = request.user.enrolled_instances.all()
-        all_instances.extend(get_exact_instances(enrolled_instances, request, when=-1))
-
-        # Paginate and return
-        data = sorted(all_instances, key=lambda i: (i["date"], i["end_time"]), reverse=True)
-        paginator = ClassInstancePaginator(request)
-        return paginator.paginate_list(data)
+        data = sorted(get_instances(request, when=-1), key=history_key, reverse=True)
+        paginator = ClassInstancePaginator(request, key=history_key, reverse=True)
+        return paginator.paginate(data)
 
 
 class ListOngoing(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
 
     def retrieve(self, request, **kwargs):
-        all_instances = []
-        # Get instances for classes that user has enrolled in
-        enrolled_classes = request.user.classes.all()
-        dropped_instances = request.user.dropped_instances.all()
-
-        for class_obj in enrolled_classes:
-            special_exceptions = dropped_instances.filter(parent=class_obj, special=True)
-            nonspecial_exceptions = dropped_instances.filter(parent=class_obj, special=False)
-            all_instances.extend(
-                get_all_instances(class_obj.studio, class_obj, request,
-                                  special_exceptions, nonspecial_exceptions, when=0)
-            )
-
-        # Get specific instances that user has enrolled in
-        enrolled_instances = request.user.enrolled_instances.all()
-        all_instances.extend(get_exact_instances(enrolled_instances, request, when=0))
-
-        # Paginate and return
-        data = sorted(all_instances, key=lambda i: (i["date"], i["start_time"]))
         paginator = ClassInstancePaginator(request)
-        return paginator.paginate_list(data)
+        return paginator.paginate(get_instances(request, when=0))
+
+
+async def abuild_timetable(request):
+    """Like `build_timetable`, for async views (the user's classes and instances are loaded concurrently).
+    """
+    classes = [class_obj async for class_obj in request.user.classes.select_related("studio")]
+    exceptions = await aget_dropped_exceptions(request.user)
+    class_instances, exact_instances = await asyncio.gather(
+        aiter_class_instances(classes, request, exceptions, when=None),
+        aget_exact_instances(request.user.enrolled_instances.all(), request, when=None),
+    )
+    return list(heapq.merge(class_instances, exact_instances, key=instance_key))
+
+
+async def aget_instances(request, when):
+    days = int(request.query_params.get("range", 14))
+    timetable = await aget_timetable(request.user, days, lambda: abuild_timetable(request))
+    return filter(instance_date_filter(days, when), timetable)
+
+
+class ScheduleCacheStats(generics.RetrieveAPIView):
+    """View for the hit and miss counts of the schedule cache.
+    """
+    permission_classes = [IsAdminUser]
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(get_stats())
+
+
+# Async variants of the schedule views, for ASGI servers (served under /async/, next to the sync views)
+
+
+class AsyncListSchedule(AsyncRetrieveAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def retrieve(self, request, **kwargs):
+        paginator = ClassInstancePaginator(request)
+        return paginator.paginate(await aget_instances(request, when=1))
+
+
+class AsyncListHistory(AsyncRetrieveAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def retrieve(self, request, **kwargs):
+        data = sorted(await aget_instances(request, when=-1), key=history_key, reverse=True)
+        paginator = ClassInstancePaginator(request, key=history_key, reverse=True)
+        return paginator.paginate(data)
+
+
+class AsyncListOngoing(AsyncRetrieveAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def retrieve(self, request, **kwargs):
+        paginator = ClassInstancePaginator(request)
+        return paginator.paginate(await aget_instances(request, when=0))
@@ -0,0 +1,224 @@
+import datetime
+import random
+from collections import defaultdict
+
+import recurrence
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Account, Payment, Subscription
+from classes.counters import class_enrolled, instance_enrolled
+from classes.models import Class, ClassInstance, Keyword, Occurrence
+from studios.models import Amenity, Studio
+from studios.search import index_studios
+from utils.geo import grid_cell
+
+# Accounts are generated with this email domain and password (e.g. for logging in during load tests)
+EMAIL_DOMAIN = "bench.example.com"
+PASSWORD = "benchmark"
+
+# Rough extent of the City of Toronto
+LAT_RANGE = (43.59, 43.84)
+LONG_RANGE = (-79.62, -79.15)
+# Studios are clustered around these neighbourhoods, with (lat, long, weight)
+NEIGHBOURHOODS = {
+    "Downtown": (43.6487, -79.3817, 8),
+    "Yorkville": (43.6709, -79.3933, 3),
+    "Liberty Village": (43.6383, -79.4208, 3),
+    "Leslieville": (43.6626, -79.3300, 2),
+    "The Annex": (43.6703, -79.4072, 2),
+    "Midtown": (43.7064, -79.3986, 3),
+    "North York": (43.7615, -79.4111, 3),
+    "Scarborough": (43.7764, -79.2318, 2),
+    "Etobicoke": (43.6435, -79.5650, 2),
+    "The Junction": (43.6655, -79.4683, 1),
+}
+STUDIO_KINDS = ["Yoga", "Fitness", "Cycle", "Boxing Club", "Pilates", "Athletic Club", "Movement", "Barre"]
+CLASS_NAMES = ["Yoga", "Spin", "HIIT", "Pilates", "Boxing", "Barre", "Zumba", "Kickboxing", "Meditation", "Stretch",
+               "Bootcamp", "Dance Cardio", "Rowing", "TRX", "Strength", "Mobility"]
+CLASS_LEVELS = ["", "Beginner ", "Advanced ", "Express ", "Hot ", "Power ", "Gentle ", "Morning "]
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Priya", "Wei", "Fatima", "Diego", "Amara", "Liam", "Noor", "Kenji",
+               "Sofia", "Olu", "Chloe", "Mateo"]
+LAST_NAMES = ["Singh", "Chen", "Nguyen", "Smith", "Ali", "Martin", "Brown", "Garcia", "Kim", "Wilson", "Patel",
+              "Tremblay", "Roy", "Okafor"]
+AMENITIES = ["Showers", "Lockers", "Towels", "Sauna", "Parking", "Water fountain", "Mat rental", "Childcare"]
+KEYWORDS = ["cardio", "strength", "flexibility", "mindfulness", "endurance", "low impact", "high intensity",
+            "balance", "core", "recovery"]
+# Weekdays (0 is Monday) that classes usually recur on
+WEEKDAY_PATTERNS = [[0, 2, 4], [1, 3], [5], [6], [0], [2], [4], [0, 1, 2, 3, 4], [5, 6]]
+
+
+def random_location(rng):
+    names = list(NEIGHBOURHOODS)
+    lat, long, _ = NEIGHBOURHOODS[rng.choices(names, weights=[NEIGHBOURHOODS[n][2] for n in names])[0]]
+    # Spread around the neighbourhood (~3km), within the city
+    lat = min(max(rng.gauss(lat, 0.025), LAT_RANGE[0]), LAT_RANGE[1])
+    long = min(max(rng.gauss(long, 0.035), LONG_RANGE[0]), LONG_RANGE[1])
+    return round(lat, 6), round(long, 6)
+
+
+def random_schedule(rng):
+    kind = rng.random()
+    if kind < 0.1:
+        return recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)])
+    days = rng.choice(WEEKDAY_PATTERNS)
+    if kind < 0.2:
+        # Every other week
+        return recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.WEEKLY, interval=2, byday=days)])
+    return recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.WEEKLY, byday=days)])
+
+
+def random_times(rng):
+    # Starting on the quarter hour, from 6:00 to 20:45
+    start = 6 * 60 + 15 * rng.randrange(0, 60)
+    end = start + rng.choice([30, 45, 60, 60, 75, 90])
+    return datetime.time(start // 60, start % 60), datetime.time(end // 60, end % 60)
+
+
+def generate_dataset(studios=2000, classes_per_studio=20, accounts=200000, seed=0, batch_size=5000, log=None):
+    """Generates a reproducible (for a given `seed`) synthetic dataset of studios across Toronto, their classes
+    (with recurring schedules, special instances, amenities and keywords) and accounts (with subscriptions,
+    payments, enrollments and dropped instances).
+
+    Everything is inserted in bulk, and the derived data that signals and `save()` normally maintain (search
+    index, materialized occurrences and enrollment counters) is then built in bulk too.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    today = datetime.date.today()
+
+    with transaction.atomic():
+        log("Creating {} studios...".format(studios))
+        studio_objs = []
+        for i in range(studios):
+            neighbourhood = rng.choice(list(NEIGHBOURHOODS))
+            lat, long = random_location(rng)
+            studio_objs.append(Studio(
+                name="{} {} {}".format(neighbourhood, rng.choice(STUDIO_KINDS), i + 1),
+                address="{} {} St".format(rng.randrange(1, 3000), rng.choice(LAST_NAMES)),
+                lat=lat, long=long, grid_cell=grid_cell(lat, long),
+                postal_code="M{}{} {}{}{}".format(rng.randrange(1, 10), rng.choice("ABCEGHJKLMNPRSTVWXYZ"),
+                                                  rng.randrange(10), rng.choice("ABCEGHJKLMNPRSTVWXYZ"),
+                                                  rng.randrange(10)),
+                phone_num="416555{:04d}".format(i % 10000),
+            ))
+        studio_objs = Studio.objects.bulk_create(studio_objs, batch_size=batch_size)
+        Amenity.objects.bulk_create([
+            Amenity(type=amenity, quantity=rng.randrange(1, 30), studio=studio)
+            for studio in studio_objs for amenity in rng.sample(AMENITIES, rng.randrange(1, 5))
+        ], batch_size=batch_size)
+
+        log("Creating {} classes...".format(studios * classes_per_studio))
+        class_objs = []
+        for studio in studio_objs:
+            for _ in range(max(1, round(rng.gauss(classes_per_studio, classes_per_studio / 4)))):
+                start_time, end_time = random_times(rng)
+                schedule = random_schedule(rng)
+                class_objs.append(Class(
+                    name="{}{}".format(rng.choice(CLASS_LEVELS), rng.choice(CLASS_NAMES)), studio=studio,
+                    coach="{} {}".format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)),
+                    capacity=rng.randrange(10, 41), start_time=start_time, end_time=end_time, schedule=schedule,
+                    schedule_text=[rule.to_text() for rule in schedule.rrules],
+                    # Classes have been running for (at least) the whole past occurrence window
+                    created=today - datetime.timedelta(days=settings.OCCURRENCE_WINDOW_PAST_DAYS),
+                ))
+        class_objs = Class.objects.bulk_create(class_objs, batch_size=batch_size)
+        Keyword.objects.bulk_create([
+            Keyword(name=keyword, related_class=class_obj)
+            for class_obj in class_objs for keyword in rng.sample(KEYWORDS, rng.randrange(0, 4))
+        ], batch_size=batch_size)
+        # Some classes have extra (special) instances in the next few weeks
+        specials = ClassInstance.objects.bulk_create([
+            ClassInstance(date=today + datetime.timedelta(days=rng.randrange(1, 21)), special=True,
+                          start_time=class_obj.start_time, end_time=class_obj.end_time, parent=class_obj)
+            for class_obj in class_objs if rng.random() < 0.05 for _ in range(rng.randrange(1, 4))
+        ], batch_size=batch_size)
+
+        log("Materializing occurrences...")
+        start = today - datetime.timedelta(days=settings.OCCURRENCE_WINDOW_PAST_DAYS)
+        end = today + datetime.timedelta(days=settings.OCCURRENCE_WINDOW_FUTURE_DAYS)
+        occurrences = []
+        for class_obj in class_objs:
+            occurrences.extend(Occurrence(date=date, start_time=class_obj.start_time, end_time=class_obj.end_time,
+                                          parent=class_obj)
+                               for date in class_obj.get_occurrence_dates(start, end))
+            if len(occurrences) >= batch_size:
+                Occurrence.objects.bulk_create(occurrences, batch_size=batch_size)
+                occurrences = []
+        Occurrence.objects.bulk_create(occurrences, batch_size=batch_size)
+        Class.objects.filter(pk__in=[class_obj.pk for class_obj in class_objs]) \
+            .update(occurrences_start=start, occurrences_end=end)
+
+        log("Creating {} accounts...".format(accounts))
+        plans = [Subscription.objects.create(billing_cycle="MONTHLY", charge=29.99),
+                 Subscription.objects.create(billing_cycle="YEARLY", charge=299.99)]
+        password = make_password(PASSWORD)
+        first_id = Account.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+        account_objs = Account.objects.bulk_create([
+            Account(email="user{}@{}".format(i, EMAIL_DOMAIN), password=password,
+                    first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                    subscription=rng.choice(plans) if rng.random() < 0.8 else None)
+            for i in range(accounts)
+        ], batch_size=batch_size)
+        if account_objs and account_objs[0].pk is None:
+            # The backend can't return the primary keys of bulk inserts
+            account_objs = list(Account.objects.filter(pk__gt=first_id).order_by("pk"))
+        subscribed = [account for account in account_objs if account.subscription_id is not None]
+
+        log("Creating payments...")
+        now = timezone.now()
+        payments = Payment.objects.bulk_create([
+            # About a tenth of the subscriptions are due (so that there is something to bill), and some of
+            # those have been cancelled
+            Payment(amount=account.subscription.charge, payment_info="4111111111111111", account=account,
+                    date=now + datetime.timedelta(days=rng.uniform(-3, 27)), cancelled=rng.random() < 0.05)
+            for account in subscribed
+        ], batch_size=batch_size)
+        for account, payment in zip(subscribed, payments):
+            account.next_payment = payment
+        Account.objects.bulk_update(subscribed, ["next_payment"], batch_size=batch_size)
+
+        log("Enrolling accounts...")
+        enrolled = defaultdict(int)
+        specials_by_class = defaultdict(list)
+        for instance in specials:
+            specials_by_class[instance.parent_id].append(instance)
+        class_enrollments, instance_enrollments, drops = [], [], []
+        for account in subscribed:
+            classes = rng.sample(class_objs, min(len(class_objs), rng.choice([0, 1, 1, 2, 2, 3, 5])))
+            for class_obj in classes:
+                # Leave some room in every class
+                if enrolled[class_obj.pk] < class_obj.capacity - 2:
+                    enrolled[class_obj.pk] += 1
+                    class_enrollments.append(Account.classes.through(account_id=account.pk,
+                                                                     class_id=class_obj.pk))
+                    for instance in specials_by_class[class_obj.pk]:
+                        if rng.random() < 0.2:
+                            drops.append(Account.dropped_instances.through(account_id=account.pk,
+                                                                           classinstance_id=instance.pk))
+            if specials and rng.random() < 0.1:
+                instance = rng.choice(specials)
+                if instance.parent not in classes:
+                    instance_enrollments.append(Account.enrolled_instances.through(account_id=account.pk,
+                                                                                   classinstance_id=instance.pk))
+        Account.classes.through.objects.bulk_create(class_enrollments, batch_size=batch_size)
+        Account.enrolled_instances.through.objects.bulk_create(instance_enrollments, batch_size=batch_size)
+        Account.dropped_instances.through.objects.bulk_create(drops, batch_size=batch_size)
+
+        log("Building the search index and enrollment counters...")
+        studio_ids = [studio.pk for studio in studio_objs]
+        for i in range(0, len(studio_ids), 100):
+            index_studios(studio_ids[i:i + 100])
+        Class.objects.filter(studio_id__in=studio_ids).update(enrolled=class_enrolled())
+        ClassInstance.objects.filter(parent__studio_id__in=studio_ids).update(enrolled=instance_enrolled())
+
+    return {
+        "studios": len(studio_objs),
+        "classes": len(class_objs),
+        "special_instances": len(specials),
+        "accounts": len(account_objs),
+        "enrollments": len(class_enrollments) + len(instance_enrollments),
+        "drops": len(drops),
+    }
@@ -0,0 +1,382 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.signals import got_request_exception
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.models import Count, F, Q
+
+from accounts.models import Account
+from classes.counters import instance_enrolled
+from classes.models import ClassInstance, Occurrence
+from utils.database import describe_database
+from .dataset import EMAIL_DOMAIN, PASSWORD
+from .runner import client_host, percentile
+
+# Weights of the operations of each virtual user (before its first request, a user always logs in)
+DEFAULT_MIX = {"login": 1, "schedule": 3, "studio_schedule": 3, "enroll": 6}
+
+# Errors that mean a request gave up waiting for a lock (SQLite, then PostgreSQL)
+LOCK_ERRORS = ["database is locked", "database table is locked", "deadlock detected",
+               "could not serialize access", "lock timeout"]
+
+# Environment of each database profile (see `utils.database`) compared by `compare_databases`. "sqlite-default"
+# is how Django configures SQLite out of the box; "postgresql" uses the URL given to the command.
+DATABASE_PROFILES = {
+    "sqlite-default": {"SQLITE_JOURNAL_MODE": "delete", "SQLITE_TRANSACTION_MODE": "DEFERRED",
+                       "SQLITE_BUSY_TIMEOUT": "5", "DATABASE_CONN_MAX_AGE": "0"},
+    "sqlite": {},
+    "postgresql": {},
+}
+
+# An enrollment target: a non-special instance (by class and date, through `HandleNonSpecial`), or a special
+# instance (by id, through `InstanceDetails`)
+Target = namedtuple("Target", ["studio_id", "class_id", "date", "instance_id"])
+
+
+class HttpTransport:
+    """Sends requests over HTTP (to `base_url`), from a pool of threads.
+    """
+
+    def __init__(self, base_url, concurrency, host=None, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.host = host
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load-test")
+
+    def send(self, method, path, params=None, data=None, token=None):
+        headers = {"Content-Type": "application/json"}
+        if self.host:
+            headers["Host"] = self.host
+        if token:
+            headers["Authorization"] = "Bearer " + token
+        request = urllib.request.Request(
+            self.base_url + path + ("?" + urlencode(params) if params else ""), method=method, headers=headers,
+            data=json.dumps(data).encode() if data is not None else None,
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except urllib.error.URLError as e:
+            # e.g. a timeout while connecting
+            raise e.reason if isinstance(e.reason, OSError) else ConnectionError(e.reason)
+
+    async def request(self, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: self.send(*args, **kwargs))
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class AsgiTransport:
+    """Sends requests straight to the ASGI application (`tfc.asgi`), in this process (sync views are run in
+    threads by the ASGI handler, as they would be under an ASGI server).
+    """
+
+    def __init__(self, host=None, timeout=30):
+        from tfc.asgi import application
+        self.application = application
+        self.host = host or client_host()
+        self.timeout = timeout
+
+    async def request(self, method, path, params=None, data=None, token=None):
+        body = json.dumps(data).encode() if data is not None else b""
+        headers = [(b"host", self.host.encode()), (b"content-type", b"application/json"),
+                   (b"content-length", str(len(body)).encode())]
+        if token:
+            headers.append((b"authorization", "Bearer {}".format(token).encode()))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+            "path": path, "raw_path": path.encode(), "query_string": urlencode(params or {}).encode(),
+            "root_path": "", "headers": headers, "client": ("127.0.0.1", 0), "server": (self.host, 80),
+        }
+        messages = asyncio.Queue()
+        messages.put_nowait({"type": "http.request", "body": body, "more_body": False})
+        response = {"status": None, "body": []}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+
+        await asyncio.wait_for(self.application(scope, messages.get, send), self.timeout)
+        return response["status"], b"".join(response["body"])
+
+    def close(self):
+        pass
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LoadTestServer(ThreadedWSGIServer):
+    # Connections queued before being accepted (so that bursts of requests aren't refused)
+    request_queue_size = 128
+
+
+@contextmanager
+def serve():
+    """Serves the WSGI application (like `runserver`, with a thread per request) on a free local port,
+    and yields its URL.
+    """
+    server = LoadTestServer(("127.0.0.1", 0), QuietRequestHandler, allow_reuse_address=False)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, name="load-test-server", daemon=True)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:{}".format(server.server_port)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@contextmanager
+def record_exceptions():
+    """Counts the exceptions raised by views (of this process) in the block, by the type and message of
+    their original cause (e.g. the database error behind an error while handling it).
+
+    They are counted instead of being logged (by `django.request`) in the block.
+    """
+    exceptions = Counter()
+
+    def exception_raised(sender, **kwargs):
+        error = sys.exc_info()[1]
+        if error is None:
+            return
+        while error.__context__ is not None:
+            error = error.__context__
+        message = str(error).splitlines()
+        exceptions["{}: {}".format(type(error).__name__, message[0] if message else "")] += 1
+
+    request_logger = logging.getLogger("django.request")
+    disabled = request_logger.disabled
+    request_logger.disabled = True
+    got_request_exception.connect(exception_raised, weak=False, dispatch_uid="benchmarks.loadtest")
+    try:
+        yield exceptions
+    finally:
+        got_request_exception.disconnect(dispatch_uid="benchmarks.loadtest")
+        request_logger.disabled = disabled
+
+
+def hot_targets(num_classes=1, dates=3, seed=0):
+    """Picks the classes whose next few sessions everyone is trying to get into.
+
+    Returns the targets (the next `dates` non-special instances and any special instances of each class
+    in the next two weeks), and the ids of the classes.
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    window = (today + datetime.timedelta(days=1), today + datetime.timedelta(days=14))
+    upcoming = defaultdict(list)
+    for studio_id, class_id, date in Occurrence.objects.filter(date__range=window) \
+            .order_by("parent_id", "date").values_list("parent__studio_id", "parent_id", "date"):
+        upcoming[(studio_id, class_id)].append(date)
+    if not upcoming:
+        raise ValueError("No classes are scheduled in the next two weeks (see `python manage.py generate_dataset`).")
+    classes = rng.sample(sorted(upcoming), min(num_classes, len(upcoming)))
+    targets = [Target(studio_id, class_id, date, None)
+               for studio_id, class_id in classes for date in upcoming[(studio_id, class_id)][:dates]]
+    targets += [
+        Target(studio_id, class_id, None, pk)
+        for pk, studio_id, class_id in ClassInstance.objects.filter(
+            parent_id__in=[class_id for _, class_id in classes], special=True, cancelled=False, date__range=window
+        ).values_list("pk", "parent__studio_id", "parent_id")
+    ]
+    return targets, [class_id for _, class_id in classes]
+
+
+def check_invariants(class_ids):
+    """Checks that no instance of the given classes is over capacity (by its counter or by its enrollments), that
+    the counters match the enrollments, and that each class has at most one active non-special instance per date.
+    Returns a description of each violation.
+    """
+    instances = ClassInstance.objects.filter(parent_id__in=class_ids, cancelled=False) \
+        .annotate(actual=instance_enrolled())
+    violations = [
+        "Instance {} is over capacity ({} enrolled by its counter, {} by enrollments, capacity {}).".format(*row)
+        for row in instances.filter(Q(enrolled__gt=F("parent__capacity")) | Q(actual__gt=F("parent__capacity")))
+        .values_list("pk", "enrolled", "actual", "parent__capacity")
+    ]
+    violations += [
+        "Instance {} has an enrollment counter of {}, but {} enrollments.".format(*row)
+        for row in instances.exclude(enrolled=F("actual")).values_list("pk", "enrolled", "actual")
+    ]
+    violations += [
+        "Class {} has {} active non-special instances on {}.".format(class_id, count, date)
+        for class_id, date, count in ClassInstance.objects
+        .filter(parent_id__in=class_ids, special=False, cancelled=False)
+        .values("parent_id", "date").annotate(count=Count("*")).filter(count__gt=1)
+        .values_list("parent_id", "date", "count")
+    ]
+    return violations
+
+
+def classify(op, status, body):
+    """The outcome of a request: "ok", "full" (a class at capacity, which is expected), "lock" (a lock wait
+    error or timeout), "server_error" or "client_error".
+    """
+    if 200 <= status < 300:
+        return "ok"
+    if op == "enroll" and status == 403 and b"capacity" in body:
+        return "full"
+    if status >= 500:
+        # Only shown in the error page if DEBUG is on
+        text = body.decode(errors="replace")
+        return "lock" if any(error in text for error in LOCK_ERRORS) else "server_error"
+    return "client_error"
+
+
+class LoadTest:
+    """Simulates `users` (subscribed accounts with the benchmark password) hammering a few popular classes:
+    each user logs in (for a JWT), then repeatedly picks an operation (see `DEFAULT_MIX`): logging in again,
+    reading their schedule, reading a hot studio's schedule, or toggling their enrollment in a hot instance.
+    """
+
+    def __init__(self, transport, users=100, mix=None, classes=1, dates=3, seed=0):
+        self.transport = transport
+        self.mix = mix or DEFAULT_MIX
+        self.seed = seed
+        self.emails = list(Account.objects.filter(email__endswith="@" + EMAIL_DOMAIN, subscription__isnull=False)
+                           .order_by("pk").values_list("email", flat=True)[:users])
+        if not self.emails:
+            raise ValueError("The database has no subscribed benchmark accounts "
+                             "(see `python manage.py generate_dataset`).")
+        self.targets, self.class_ids = hot_targets(classes, dates, seed)
+        self.studio_ids = sorted({target.studio_id for target in self.targets})
+        # (Operation, latency, outcome) of each request
+        self.results = []
+
+    async def request(self, op, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, body = await self.transport.request(method, path, **kwargs)
+            outcome = classify(op, status, body)
+        except TimeoutError:
+            status, body, outcome = None, b"", "timeout"
+        except OSError:
+            status, body, outcome = None, b"", "connection_error"
+        self.results.append((op, time.perf_counter() - start, outcome))
+        return status, body
+
+    async def login(self, email):
+        status, body = await self.request("login", "POST", "/accounts/login/",
+                                          data={"email": email, "password": PASSWORD})
+        return json.loads(body)["access"] if status == 200 else None
+
+    async def user(self, i, deadline, requests):
+        rng = random.Random("{}:{}".format(self.seed, i))
+        email = self.emails[i % len(self.emails)]
+        token = None
+        made = 0
+        while time.monotonic() < deadline and (requests is None or made < requests):
+            made += 1
+            op = rng.choices(list(self.mix), weights=list(self.mix.values()))[0] if token else "login"
+            if op == "login":
+                token = await self.login(email)
+            elif op == "schedule":
+                await self.request(op, "GET", "/accounts/schedule/", token=token)
+            elif op == "studio_schedule":
+                await self.request(op, "GET", "/studios/{}/schedule".format(rng.choice(self.studio_ids)))
+            else:
+                target = rng.choice(self.targets)
+                if target.instance_id is None:
+                    path = "/studios/{}/classes/{}/ns/{}/".format(target.studio_id, target.class_id,
+                                                                  target.date.isoformat())
+                else:
+                    path = "/studios/{}/classes/{}/{}/".format(target.studio_id, target.class_id,
+                                                               target.instance_id)
+                await self.request(op, "PATCH", path, token=token)
+
+    async def run_users(self, concurrency, duration, requests):
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(self.user(i, deadline, requests) for i in range(concurrency)))
+
+    def run(self, concurrency=10, duration=30, requests=None):
+        """Runs `concurrency` users at once, for `duration` seconds (or `requests` requests per user),
+        and returns a report (see `report()`).
+        """
+        self.results = []
+        with record_exceptions() as exceptions:
+            start = time.perf_counter()
+            asyncio.run(self.run_users(concurrency, duration, requests))
+            elapsed = time.perf_counter() - start
+        return self.report(elapsed, exceptions)
+
+    def report(self, elapsed, exceptions):
+        operations = {}
+        by_op = defaultdict(list)
+        for op, latency, outcome in self.results:
+            by_op[op].append((latency, outcome))
+        for op, results in by_op.items():
+            latencies = [latency for latency, _ in results]
+            operations[op] = {
+                "requests": len(results),
+                "outcomes": dict(Counter(outcome for _, outcome in results)),
+                "p50": percentile(latencies, 50) * 1000,
+                "p95": percentile(latencies, 95) * 1000,
+                "p99": percentile(latencies, 99) * 1000,
+                "max": max(latencies) * 1000,
+            }
+        # Enrollment changes that were committed
+        writes = sum(1 for op, _, outcome in self.results if op == "enroll" and outcome == "ok")
+        return {
+            "database": describe_database(connection),
+            "duration": elapsed,
+            "requests": len(self.results),
+            "throughput": len(self.results) / elapsed if elapsed else 0.0,
+            "writes": writes,
+            "write_throughput": writes / elapsed if elapsed else 0.0,
+            "operations": operations,
+            "exceptions": dict(exceptions),
+            "violations": check_invariants(self.class_ids),
+        }
+
+
+def profile_environ(profile, environ=os.environ, postgresql_url=None):
+    """Returns the environment to run a command under a database profile (see `DATABASE_PROFILES`).
+    """
+    environ = {key: value for key, value in environ.items()
+               if key != "DATABASE_URL" and not key.startswith("SQLITE_")}
+    environ.update(DATABASE_PROFILES[profile])
+    if profile == "postgresql":
+        if not postgresql_url:
+            raise ValueError("The postgresql profile needs the URL of a database.")
+        environ["DATABASE_URL"] = postgresql_url
+    return environ
+
+
+def run_profile(profile, args, postgresql_url=None):
+    """Runs `load_test` (with the command line `args`) in a new process under a database profile, and returns
+    its report.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "report.json")
+        subprocess.run([sys.executable, str(settings.BASE_DIR / "manage.py"), "load_test", "--save-report", path,
+                        *args], env=profile_environ(profile, postgresql_url=postgresql_url), check=True,
+                       stdout=subprocess.DEVNULL)
+        with open(path) as f:
+            return json.load(f)
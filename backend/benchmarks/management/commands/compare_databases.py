@@ -0,0 +1,43 @@
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.loadtest import DATABASE_PROFILES, run_profile
+
+
+class Command(BaseCommand):
+    help = "Compares the throughput of concurrent enrollments under each database profile (see utils.database), " \
+           "by running load_test in a new process for each. Every database must already hold the same dataset " \
+           "(see generate_dataset); the SQLite profiles share the default database file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", action="append", dest="profiles", choices=list(DATABASE_PROFILES),
+                            help="Only run this profile (can be repeated). By default, runs the SQLite profiles, "
+                                 "and postgresql if --postgresql-url is given.")
+        parser.add_argument("--postgresql-url", help="URL of the PostgreSQL database to compare.")
+        parser.add_argument("--concurrency", type=int, default=20, help="Number of concurrent users.")
+        parser.add_argument("--duration", type=float, default=30, help="Seconds to run each profile for.")
+        parser.add_argument("--mix", default="enroll=1", help="Weights of the operations (default: %(default)s).")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+
+    def handle(self, *args, **options):
+        profiles = options["profiles"] or [profile for profile in DATABASE_PROFILES
+                                           if profile != "postgresql" or options["postgresql_url"]]
+        args = ["--concurrency", str(options["concurrency"]), "--duration", str(options["duration"]),
+                "--mix", options["mix"], "--seed", str(options["seed"])]
+
+        self.stdout.write("{:<16} {:>10} {:>9} {:>9} {:>7} {:>7}  {}".format(
+            "Profile", "Writes/s", "p50 ms", "p95 ms", "Locks", "Errors", "Database"))
+        for profile in profiles:
+            try:
+                report = run_profile(profile, args, postgresql_url=options["postgresql_url"])
+            except ValueError as e:
+                raise CommandError(e)
+            except subprocess.CalledProcessError:
+                raise CommandError("load_test failed under the {} profile".format(profile))
+            enroll = report["operations"].get("enroll", {"p50": 0, "p95": 0, "outcomes": {}})
+            errors = sum(count for outcome, count in enroll["outcomes"].items()
+                         if outcome not in ("ok", "full", "lock"))
+            self.stdout.write("{:<16} {:>10.1f} {:>9.1f} {:>9.1f} {:>7} {:>7}  {}".format(
+                profile, report["write_throughput"], enroll["p50"], enroll["p95"],
+                enroll["outcomes"].get("lock", 0), errors, report["database"]))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.models import Account
+from benchmarks.dataset import EMAIL_DOMAIN, generate_dataset
+from studios.models import Studio
+
+
+class Command(BaseCommand):
+    help = "Generates a synthetic, reproducible Toronto-scale dataset (studios, classes, accounts, enrollments " \
+           "and payments) for benchmarking. Accounts are named user<i>@{} (password: benchmark).".format(EMAIL_DOMAIN)
+
+    def add_arguments(self, parser):
+        parser.add_argument("--studios", type=int, default=2000, help="Number of studios.")
+        parser.add_argument("--classes-per-studio", type=int, default=20, help="Number of classes of each studio.")
+        parser.add_argument("--accounts", type=int, default=200000, help="Number of accounts.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed (the same seed gives the same data).")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per bulk insert.")
+        parser.add_argument("--flush", action="store_true",
+                            help="Delete all studios and benchmark accounts first.")
+
+    def handle(self, *args, **options):
+        bench_accounts = Account.objects.filter(email__endswith="@" + EMAIL_DOMAIN)
+        if options["flush"]:
+            with transaction.atomic():
+                Studio.objects.all().delete()
+                bench_accounts.delete()
+        elif Studio.objects.exists() or bench_accounts.exists():
+            raise CommandError("The database already has studios or benchmark accounts (use --flush to delete them).")
+
+        counts = generate_dataset(
+            studios=options["studios"], classes_per_studio=options["classes_per_studio"],
+            accounts=options["accounts"], seed=options["seed"], batch_size=options["batch_size"],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            "Generated " + ", ".join("{} {}".format(count, name.replace("_", " ")) for name, count in counts.items())
+        ))
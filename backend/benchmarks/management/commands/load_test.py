@@ -0,0 +1,83 @@
+import json
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.loadtest import DEFAULT_MIX, AsgiTransport, HttpTransport, LoadTest, serve
+from benchmarks.runner import client_host
+
+
+class Command(BaseCommand):
+    help = "Load tests the API with concurrent users logging in, reading schedules and toggling their enrollment " \
+           "in a few popular classes (see generate_dataset), and reports throughput, latencies, errors and " \
+           "capacity invariant violations. Unlike run_benchmarks, enrollment changes are kept."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--transport", choices=["http", "asgi"], default="http",
+                            help="Send requests over HTTP (to --url, or to a threaded server started in this "
+                                 "process), or straight to the ASGI application.")
+        parser.add_argument("--url", help="Base URL of an already running server (using the same database).")
+        parser.add_argument("--concurrency", type=int, default=20, help="Number of concurrent users.")
+        parser.add_argument("--duration", type=float, default=30, help="Seconds to run for.")
+        parser.add_argument("--requests", type=int, help="Stop each user after this many requests.")
+        parser.add_argument("--users", type=int, default=100, help="Number of accounts to log in as.")
+        parser.add_argument("--classes", type=int, default=1, help="Number of popular classes.")
+        parser.add_argument("--dates", type=int, default=3, help="Number of upcoming dates of each class.")
+        parser.add_argument("--mix", default=",".join("{}={}".format(*item) for item in DEFAULT_MIX.items()),
+                            help="Weights of the operations (default: %(default)s).")
+        parser.add_argument("--timeout", type=float, default=30, help="Seconds before a request times out.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+        parser.add_argument("--save-report", metavar="PATH", help="Save the report (as JSON) to this file.")
+        parser.add_argument("--fail-on-violation", action="store_true",
+                            help="Exit with an error if any capacity invariant is violated.")
+
+    def handle(self, *args, **options):
+        try:
+            mix = {op: float(weight) for op, weight in (item.split("=") for item in options["mix"].split(","))}
+        except ValueError:
+            raise CommandError("--mix must look like login=1,enroll=6")
+        if not set(mix).issubset(DEFAULT_MIX):
+            raise CommandError("Unknown operations: {}".format(", ".join(sorted(set(mix) - set(DEFAULT_MIX)))))
+
+        with (serve() if options["transport"] == "http" and not options["url"] else nullcontext(options["url"])) \
+                as url:
+            if options["transport"] == "http":
+                transport = HttpTransport(url, options["concurrency"], timeout=options["timeout"],
+                                          host=None if options["url"] else client_host())
+            else:
+                transport = AsgiTransport(timeout=options["timeout"])
+            try:
+                load_test = LoadTest(transport, users=options["users"], mix=mix, classes=options["classes"],
+                                     dates=options["dates"], seed=options["seed"])
+                report = load_test.run(options["concurrency"], options["duration"], options["requests"])
+            except ValueError as e:
+                raise CommandError(e)
+            finally:
+                transport.close()
+
+        if options["save_report"]:
+            with open(options["save_report"], "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+        self.stdout.write("Database: {}".format(report["database"]))
+        self.stdout.write("{} requests in {:.1f}s ({:.1f}/s), {} enrollment changes committed ({:.1f}/s)".format(
+            report["requests"], report["duration"], report["throughput"], report["writes"],
+            report["write_throughput"]))
+        self.stdout.write("{:<16} {:>8} {:>9} {:>9} {:>9} {:>9}  {}".format(
+            "Operation", "Requests", "p50 ms", "p95 ms", "p99 ms", "max ms", "Outcomes"))
+        for op, stats in sorted(report["operations"].items()):
+            self.stdout.write("{:<16} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}  {}".format(
+                op, stats["requests"], stats["p50"], stats["p95"], stats["p99"], stats["max"],
+                ", ".join("{} {}".format(count, outcome) for outcome, count in sorted(stats["outcomes"].items()))))
+        if report["exceptions"]:
+            self.stdout.write("Exceptions:")
+            for exception, count in sorted(report["exceptions"].items(), key=lambda item: -item[1]):
+                self.stdout.write("  {:>6}  {}".format(count, exception))
+        if report["violations"]:
+            self.stdout.write(self.style.ERROR("Invariant violations:"))
+            for violation in report["violations"]:
+                self.stdout.write(self.style.ERROR("  " + violation))
+            if options["fail_on_violation"]:
+                raise CommandError("{} invariant violations".format(len(report["violations"])))
+        else:
+            self.stdout.write(self.style.SUCCESS("No invariant violations"))
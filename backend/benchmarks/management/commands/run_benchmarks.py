@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.runner import Benchmark, compare, load_baseline, save_baseline
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the hot paths (studio lists, search, schedules, enrollment and billing) against the current " \
+           "database (see generate_dataset), and compares the results with a saved baseline. Writes are rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50, help="Runs of each scenario.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the requests' targets.")
+        parser.add_argument("--scenario", action="append", dest="scenarios",
+                            help="Only run this scenario (can be repeated).")
+        parser.add_argument("--save-baseline", metavar="FILE", help="Save the results as a baseline.")
+        parser.add_argument("--baseline", metavar="FILE", help="Compare the results with a saved baseline.")
+        parser.add_argument("--threshold", type=float, default=0.2,
+                            help="Relative increase (of p50, p95 or queries) that counts as a regression.")
+        parser.add_argument("--fail-on-regression", action="store_true",
+                            help="Exit with an error if any scenario has regressed.")
+
+    def handle(self, *args, **options):
+        try:
+            bench = Benchmark(seed=options["seed"])
+        except ValueError as e:
+            raise CommandError(e)
+        baseline = load_baseline(options["baseline"]) if options["baseline"] else {}
+
+        self.stdout.write("{:<16} {:>6} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+            "Scenario", "Runs", "p50 ms", "p95 ms", "p99 ms", "mean ms", "Queries"))
+        regressions = []
+
+        def report(result):
+            self.stdout.write("{:<16} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>8.1f}".format(*result))
+            if result.name in baseline:
+                changes, regressed = compare(result, baseline[result.name], options["threshold"])
+                line = "{:<16} {}".format("", "  ".join("{} {:+.0%}".format(field, change)
+                                                         for field, change in changes.items()))
+                if regressed:
+                    regressions.append(result.name)
+                    self.stdout.write(self.style.ERROR(line + "  REGRESSION"))
+                else:
+                    self.stdout.write(line)
+
+        try:
+            results = bench.run(options["iterations"], names=options["scenarios"], log=report)
+        except RuntimeError as e:
+            raise CommandError(e)
+        if options["save_baseline"]:
+            save_baseline(results, options["save_baseline"])
+            self.stdout.write("Saved the baseline to {}".format(options["save_baseline"]))
+        if regressions and options["fail_on_regression"]:
+            raise CommandError("Regressed: {}".format(", ".join(regressions)))
@@ -0,0 +1,147 @@
+import json
+import math
+import random
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.billing import process_due_payments
+from accounts.models import Account
+from classes.models import Class
+from studios.models import Studio
+from .dataset import LAT_RANGE, LONG_RANGE, CLASS_NAMES, NEIGHBOURHOODS
+
+# A benchmarked operation. `run()` performs it once (with random targets), and returns the response (if any).
+# `iterations` caps the number of runs (for slow operations). If it `writes`, each run is rolled back, so that
+# the dataset doesn't change.
+Scenario = namedtuple("Scenario", ["name", "run", "writes", "iterations"])
+Result = namedtuple("Result", ["name", "runs", "p50", "p95", "p99", "mean", "queries"])
+
+
+def client_host():
+    """A host that requests can be made to (outside of tests, which allow "testserver").
+    """
+    return "testserver" if "testserver" in settings.ALLOWED_HOSTS else "localhost"
+
+
+def percentile(values, p):
+    """The `p`th percentile of `values` (nearest rank).
+    """
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Benchmark:
+    """Runs the benchmark scenarios against the current database, with requests going through the whole
+    Django stack (including middleware), and reports latency percentiles and query counts.
+    """
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.client = APIClient(SERVER_NAME=client_host())
+        self.studio_ids = list(Studio.objects.values_list("pk", flat=True))
+        self.classes = list(Class.objects.values_list("studio_id", "pk"))
+        self.account_ids = list(Account.objects.filter(subscription__isnull=False).values_list("pk", flat=True))
+        if not self.studio_ids or not self.classes or not self.account_ids:
+            raise ValueError("The database has no studios, classes or subscribed accounts to benchmark "
+                             "(see `python manage.py generate_dataset`).")
+
+    def get(self, url, params=None, user=None):
+        self.client.force_authenticate(user)
+        response = self.client.get(url, params)
+        if response.status_code != 200:
+            raise RuntimeError("GET {} returned {}: {!r}".format(url, response.status_code, response.content[:300]))
+        return response
+
+    def random_account(self):
+        return Account.objects.get(pk=self.rng.choice(self.account_ids))
+
+    def list_studios(self):
+        return self.get("/studios/nearby", {"lat": "{:.6f}".format(self.rng.uniform(*LAT_RANGE)),
+                                            "long": "{:.6f}".format(self.rng.uniform(*LONG_RANGE)), "k": 20})
+
+    def search_studios(self):
+        words = [self.rng.choice(CLASS_NAMES), self.rng.choice(list(NEIGHBOURHOODS))]
+        return self.get("/studios/search", {"q": self.rng.choice(words)[:self.rng.randrange(3, 8)]})
+
+    def studio_schedule(self):
+        return self.get("/studios/{}/schedule".format(self.rng.choice(self.studio_ids)))
+
+    def list_schedule(self):
+        return self.get("/accounts/schedule/", user=self.random_account())
+
+    def enrollment(self):
+        studio_id, class_id = self.rng.choice(self.classes)
+        self.client.force_authenticate(self.random_account())
+        url = "/studios/{}/classes/{}/".format(studio_id, class_id)
+        response = self.client.patch(url)
+        if response.status_code != 200:
+            raise RuntimeError("PATCH {} returned {}: {!r}".format(url, response.status_code, response.data))
+        return response
+
+    def billing(self):
+        process_due_payments()
+
+    def scenarios(self):
+        return [
+            Scenario("list_studios", self.list_studios, False, None),
+            Scenario("search_studios", self.search_studios, False, None),
+            Scenario("studio_schedule", self.studio_schedule, False, None),
+            Scenario("list_schedule", self.list_schedule, False, None),
+            Scenario("enrollment", self.enrollment, True, None),
+            # A whole billing run (of every due account)
+            Scenario("billing", self.billing, True, 3),
+        ]
+
+    def run(self, iterations=50, names=None, log=None):
+        results = []
+        for scenario in self.scenarios():
+            if names and scenario.name not in names:
+                continue
+            times = []
+            queries = []
+            # The first run warms up (e.g. imports and connections) and isn't measured
+            for i in range(min(iterations, scenario.iterations or iterations) + 1):
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as captured:
+                        start = time.perf_counter()
+                        scenario.run()
+                        elapsed = time.perf_counter() - start
+                    if i:
+                        times.append(elapsed)
+                        queries.append(len(captured))
+                    # Leave the dataset as it was
+                    transaction.set_rollback(scenario.writes)
+            result = Result(scenario.name, len(times), percentile(times, 50) * 1000, percentile(times, 95) * 1000,
+                            percentile(times, 99) * 1000, sum(times) / len(times) * 1000,
+                            sum(queries) / len(queries))
+            if log:
+                log(result)
+            results.append(result)
+        return results
+
+
+def save_baseline(results, path):
+    with open(path, "w") as f:
+        json.dump({result.name: result._asdict() for result in results}, f, indent=2)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return {name: Result(**result) for name, result in json.load(f).items()}
+
+
+def compare(result, baseline, threshold):
+    """Returns the relative change of the p50 and p95 latencies and of the query count from `baseline`,
+    and whether any of them has regressed by more than `threshold`.
+    """
+    changes = {
+        field: (getattr(result, field) - getattr(baseline, field)) / getattr(baseline, field)
+        if getattr(baseline, field) else 0.0
+        for field in ("p50", "p95", "queries")
+    }
+    return changes, any(change > threshold for change in changes.values())
@@ -0,0 +1,173 @@
+import io
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import F
+from django.db import OperationalError, connection
+from django.db.utils import load_backend
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from accounts.models import Account
+from benchmarks.loadtest import check_invariants, hot_targets, profile_environ
+from classes.counters import reconcile_counters
+from classes.models import Class, ClassInstance, Occurrence
+from studios.models import SearchToken, Studio
+from studios.response_cache import get_cache
+from studios.search import search
+from utils.database import database_settings
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        call_command("generate_dataset", studios=3, classes_per_studio=2, accounts=20, seed=1, stdout=io.StringIO())
+
+    def test_generate_dataset(self):
+        self.assertEqual(Studio.objects.count(), 3)
+        self.assertFalse(Studio.objects.filter(classes__isnull=True).exists())
+        self.assertEqual(Account.objects.count(), 20)
+        self.assertTrue(Occurrence.objects.exists())
+        self.assertFalse(Class.objects.filter(enrolled__gt=F("capacity")).exists())
+        # The counters are consistent with the enrollment tables
+        self.assertEqual(reconcile_counters(fix=False), [])
+        # The search index is built
+        studio = Studio.objects.first()
+        self.assertIn(studio, search(Studio.objects.all(), studio.name.split()[0], [SearchToken.STUDIO_NAME]))
+
+        # Existing data isn't overwritten, unless flushed
+        with self.assertRaises(CommandError):
+            call_command("generate_dataset", studios=1, classes_per_studio=1, accounts=1, stdout=io.StringIO())
+        call_command("generate_dataset", studios=1, classes_per_studio=1, accounts=1, flush=True,
+                     stdout=io.StringIO())
+        self.assertEqual((Studio.objects.count(), Account.objects.count()), (1, 1))
+
+    def test_run_benchmarks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            out = io.StringIO()
+            call_command("run_benchmarks", iterations=2, save_baseline=path, stdout=out)
+            with open(path) as f:
+                baseline = json.load(f)
+            self.assertEqual(set(baseline), {"list_studios", "search_studios", "studio_schedule", "list_schedule",
+                                             "enrollment", "billing"})
+            self.assertEqual(baseline["enrollment"]["runs"], 2)
+
+            # Benchmarks don't change the data
+            enrolled = list(Class.objects.order_by("pk").values_list("enrolled", flat=True))
+            call_command("run_benchmarks", iterations=2, scenario=["enrollment"], stdout=io.StringIO())
+            self.assertEqual(list(Class.objects.order_by("pk").values_list("enrolled", flat=True)), enrolled)
+
+            # Compare with an impossibly fast baseline
+            for result in baseline.values():
+                result.update(p50=1e-6, p95=1e-6)
+            with open(path, "w") as f:
+                json.dump(baseline, f)
+            out = io.StringIO()
+            call_command("run_benchmarks", iterations=2, baseline=path, stdout=out)
+            self.assertIn("REGRESSION", out.getvalue())
+            with self.assertRaises(CommandError):
+                call_command("run_benchmarks", iterations=2, baseline=path, fail_on_regression=True,
+                             stdout=io.StringIO())
+
+    @override_settings(ALLOWED_HOSTS=[])
+    def test_failed_requests(self):
+        with self.assertRaisesMessage(CommandError, "returned 400"):
+            call_command("run_benchmarks", iterations=1, scenario=["list_studios"], stdout=io.StringIO())
+
+
+class LoadTestTests(TransactionTestCase):
+    def setUp(self):
+        get_cache().clear()
+        call_command("generate_dataset", studios=2, classes_per_studio=2, accounts=10, seed=1, stdout=io.StringIO())
+
+    def test_load_test(self):
+        out = io.StringIO()
+        call_command("load_test", concurrency=3, requests=4, users=5, stdout=out)
+        self.assertRegex(out.getvalue(), r"12 requests in [\d.]+s.* enrollment changes committed")
+        self.assertIn("Database: sqlite", out.getvalue())
+        self.assertIn("login", out.getvalue())
+        # Seats are reserved atomically, whatever the other invariants
+        self.assertNotIn("over capacity", out.getvalue())
+
+        out = io.StringIO()
+        call_command("load_test", transport="asgi", concurrency=1, requests=8, users=5, fail_on_violation=True,
+                     stdout=out)
+        self.assertRegex(out.getvalue(), r"8 requests in [\d.]+s")
+        self.assertIn("No invariant violations", out.getvalue())
+
+    def test_invariants(self):
+        targets, class_ids = hot_targets()
+        self.assertEqual(check_invariants(class_ids), [])
+        class_obj = Class.objects.get(pk=targets[0].class_id)
+        instances = ClassInstance.objects.bulk_create([
+            ClassInstance(date=targets[0].date, start_time=class_obj.start_time, end_time=class_obj.end_time,
+                          special=False, enrolled=class_obj.enrolled, parent=class_obj)
+            for _ in range(2)
+        ])
+        ClassInstance.objects.filter(pk=instances[0].pk).update(enrolled=1000)
+        violations = check_invariants(class_ids)
+        self.assertEqual(len(violations), 3)
+        self.assertIn("over capacity", violations[0])
+        self.assertIn("counter of 1000", violations[1])
+        self.assertIn("2 active non-special instances", violations[2])
+
+
+class DatabaseProfileTests(TestCase):
+    def test_settings(self):
+        default = database_settings(Path("/app"), {})["default"]
+        self.assertEqual(default["ENGINE"], "utils.sqlite")
+        self.assertEqual(default["NAME"], Path("/app/db.sqlite3"))
+        self.assertEqual(default["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+        self.assertEqual(default["OPTIONS"]["pragmas"]["journal_mode"], "wal")
+        self.assertEqual(default["CONN_MAX_AGE"], 60)
+        self.assertTrue(default["CONN_HEALTH_CHECKS"])
+
+        default = database_settings(Path("/app"), {"DATABASE_URL": "postgresql://tfc:p%40ss@db:5433/tfc",
+                                                   "DATABASE_POOL_MODE": "transaction"})["default"]
+        self.assertEqual((default["ENGINE"], default["NAME"], default["USER"], default["PASSWORD"], default["HOST"],
+                          default["PORT"]), ("django.db.backends.postgresql", "tfc", "tfc", "p@ss", "db", "5433"))
+        self.assertEqual(default["CONN_MAX_AGE"], 60)
+        self.assertTrue(default["CONN_HEALTH_CHECKS"])
+        self.assertTrue(default["DISABLE_SERVER_SIDE_CURSORS"])
+        with self.assertRaises(ImproperlyConfigured):
+            database_settings(Path("/app"), {"DATABASE_URL": "mysql://db/tfc"})
+
+    def test_profile_environ(self):
+        environ = {"DATABASE_URL": "postgresql://db/tfc", "SQLITE_BUSY_TIMEOUT": "1", "DATABASE_NAME": "test.db"}
+        self.assertEqual(profile_environ("sqlite", environ), {"DATABASE_NAME": "test.db"})
+        self.assertEqual(profile_environ("sqlite-default", environ)["SQLITE_TRANSACTION_MODE"], "DEFERRED")
+        self.assertEqual(profile_environ("sqlite-default", environ)["DATABASE_CONN_MAX_AGE"], "0")
+        self.assertEqual(profile_environ("postgresql", environ, "postgresql://other/tfc")["DATABASE_URL"],
+                         "postgresql://other/tfc")
+        with self.assertRaises(ValueError):
+            profile_environ("postgresql", environ)
+
+    def test_sqlite_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            options = database_settings(Path(directory), {"SQLITE_BUSY_TIMEOUT": "0"})["default"]["OPTIONS"]
+            settings_dict = {**connection.settings_dict, "NAME": os.path.join(directory, "db.sqlite3"),
+                             "OPTIONS": options}
+            first, second = (load_backend("utils.sqlite").DatabaseWrapper(settings_dict, alias)
+                             for alias in ("first", "second"))
+            try:
+                with first.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0], "wal")
+                    cursor.execute("CREATE TABLE enrollment (id INTEGER)")
+
+                # Transactions take the write lock as they begin, so other writers wait (here, not at all)
+                first._start_transaction_under_autocommit()
+                with self.assertRaisesMessage(OperationalError, "database is locked"):
+                    second._start_transaction_under_autocommit()
+                # Readers aren't blocked
+                with second.cursor() as cursor:
+                    cursor.execute("SELECT COUNT(*) FROM enrollment")
+                first.connection.rollback()
+            finally:
+                first.close()
+                second.close()
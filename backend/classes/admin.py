@@ -48,12 +48,7 @@ class ClassInstanceForm(ModelForm):
                                                "Duplicate classes must be marked as special."})
 
             # Check if the instance matches occurrence rules
-            occurrences = list(self.cleaned_data["parent"].schedule.between(
-                datetime.datetime.combine(self.cleaned_data["date"], datetime.time(0)),
-                datetime.datetime.combine(self.cleaned_data["date"], datetime.time(23, 59, 59)),
-                inc=True
-            ))
-            if len(occurrences) == 0:
+            if not self.cleaned_data["parent"].is_scheduled(self.cleaned_data["date"]):
                 # Does not fall on scheduled day
                 raise ValidationError(
                     {"date": "Instance does not match the schedule of the parent class. "
@@ -0,0 +1,96 @@
+import logging
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import Account
+from classes.models import Class, ClassInstance, CounterReconciliation, EnrollmentChange
+from studios.response_cache import invalidate_studios
+
+logger = logging.getLogger(__name__)
+
+Drift = namedtuple("Drift", ["model", "pk", "stored", "actual"])
+
+
+def count_rows(queryset, field):
+    """A subquery counting the rows of `queryset` (which should be filtered on an `OuterRef` to `field`).
+    """
+    return Coalesce(Subquery(queryset.order_by().values(field).annotate(count=Count("*")).values("count")), 0)
+
+
+def class_enrolled():
+    """The number of users enrolled in each class.
+    """
+    return count_rows(Account.classes.through.objects.filter(class_id=OuterRef("pk")), "class_id")
+
+
+def instance_enrolled():
+    """The number of users enrolled in each instance, i.e.
+    enrolled = parent.enrolled_users - self.dropped_users + self.enrolled_users
+    where only the users that dropped the instance while (still) enrolled in its parent are counted.
+    """
+    return count_rows(Account.classes.through.objects.filter(class_id=OuterRef("parent_id")), "class_id") \
+        - count_rows(Account.dropped_instances.through.objects.filter(classinstance_id=OuterRef("pk"),
+                                                                      account__classes=OuterRef("parent_id")),
+                     "classinstance_id") \
+        + count_rows(Account.enrolled_instances.through.objects.filter(classinstance_id=OuterRef("pk")),
+                     "classinstance_id")
+
+
+def mark_enrollment_changed(class_ids):
+    """Records that enrollment in the given classes has changed, for the next incremental reconciliation.
+    """
+    changed_at = timezone.now()
+    EnrollmentChange.objects.bulk_create([EnrollmentChange(class_id=pk, changed_at=changed_at)
+                                          for pk in set(class_ids)])
+
+
+def reconcile_counters(incremental=False, fix=True):
+    """Recomputes the `enrolled` counters of classes and instances from the enrollment tables.
+
+    The true counts are computed for all classes (and then all instances) in a single aggregate query,
+    and the counters that have drifted are fixed with a single UPDATE each. If `incremental`, only classes
+    (and their instances) whose enrollment has changed since the last run are checked.
+    Returns the list of counters that had drifted.
+    """
+    started_at = timezone.now()
+    classes = Class.objects.all()
+    instances = ClassInstance.objects.all()
+    last_run = CounterReconciliation.objects.order_by("-started_at").first() if incremental else None
+    if last_run is not None:
+        touched = EnrollmentChange.objects.filter(changed_at__gte=last_run.started_at).values("class_id")
+        classes = classes.filter(pk__in=touched)
+        instances = instances.filter(parent_id__in=touched)
+
+    with transaction.atomic():
+        drift = [
+            Drift("class", pk, stored, actual)
+            for pk, stored, actual in classes.annotate(actual=class_enrolled())
+            .exclude(enrolled=F("actual")).values_list("pk", "enrolled", "actual")
+        ] + [
+            Drift("instance", pk, stored, actual)
+            for pk, stored, actual in instances.annotate(actual=instance_enrolled())
+            .exclude(enrolled=F("actual")).values_list("pk", "enrolled", "actual")
+        ]
+        if fix:
+            Class.objects.filter(pk__in=[d.pk for d in drift if d.model == "class"]) \
+                .update(enrolled=class_enrolled())
+            ClassInstance.objects.filter(pk__in=[d.pk for d in drift if d.model == "instance"]) \
+                .update(enrolled=instance_enrolled())
+            # Class enrollment counts are shown in cached studio responses
+            invalidate_studios(Class.objects.filter(pk__in=[d.pk for d in drift if d.model == "class"])
+                               .values_list("studio_id", flat=True))
+            # Dry runs aren't recorded, so that the next incremental run still checks the same classes
+            CounterReconciliation.objects.create(started_at=started_at, incremental=last_run is not None,
+                                                 checked=classes.count() + instances.count(), drifted=len(drift))
+            # Later incremental runs only need the changes made since this one started
+            EnrollmentChange.objects.filter(changed_at__lt=started_at).delete()
+
+    for d in drift:
+        logger.warning("Enrollment counter of %s %d has drifted (stored %d, actual %d).%s",
+                       d.model, d.pk, d.stored, d.actual, "" if fix else " Not fixed (dry run).",
+                       extra={"model": d.model, "pk": d.pk, "stored": d.stored, "actual": d.actual})
+    return drift
@@ -0,0 +1,68 @@
+import datetime
+import time
+
+import recurrence
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import Account, Subscription
+from classes.models import Class, ClassInstance
+from studios.models import Studio
+from studios.views import ClassDetails, InstanceDetails, HandleNonSpecial
+
+
+class Command(BaseCommand):
+    help = "Measures the queries (and time) per enrollment request. Runs against temporary data, " \
+           "in a transaction that is rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50, help="Number of enrollments per scenario.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write("{:<12} {:>16} {:>12}".format("Scenario", "Queries/request", "ms/request"))
+            for name, queries, elapsed in self.run(options["users"]):
+                self.stdout.write("{:<12} {:>16.1f} {:>12.2f}".format(
+                    name, queries / options["users"], elapsed * 1000 / options["users"]
+                ))
+            transaction.set_rollback(True)
+
+    def run(self, users):
+        studio = Studio.objects.create(name="Benchmark", address="1 King St W", lat=43.6487, long=-79.3817,
+                                       postal_code="M5H 1A1", phone_num="4165550100")
+        classes = [
+            Class.objects.create(name="Benchmark {}".format(i), studio=studio, coach="Coach", capacity=users,
+                                 start_time=datetime.time(10), end_time=datetime.time(11),
+                                 schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)]))
+            for i in range(3)
+        ]
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        instance = ClassInstance.objects.create(date=tomorrow, start_time=datetime.time(12),
+                                                end_time=datetime.time(13), special=True, parent=classes[1])
+        subscription = Subscription.objects.create(billing_cycle="MONTHLY", charge=10)
+        accounts = [Account.objects.create(email="benchmark{}@example.com".format(i), subscription=subscription)
+                    for i in range(users)]
+
+        scenarios = [
+            ("class", ClassDetails, {"pk": studio.pk, "class_id": classes[0].pk}),
+            ("instance", InstanceDetails, {"pk": studio.pk, "class_id": classes[1].pk, "instance_id": instance.pk}),
+            ("non-special", HandleNonSpecial, {"pk": studio.pk, "class_id": classes[2].pk,
+                                               "date": tomorrow.isoformat()}),
+        ]
+        factory = APIRequestFactory()
+        for name, view, kwargs in scenarios:
+            view = view.as_view()
+            num_queries = 0
+            elapsed = 0
+            for account in accounts:
+                request = factory.patch("/")
+                force_authenticate(request, account)
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = view(request, **kwargs)
+                    elapsed += time.perf_counter() - start
+                assert response.status_code == 200, response.data
+                num_queries += len(queries)
+            yield name, num_queries, elapsed
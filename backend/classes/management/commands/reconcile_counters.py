@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from classes.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = "Recomputes the enrollment counters of classes and instances, and fixes any that have drifted " \
+           "(intended to be run periodically, e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--incremental", action="store_true",
+                            help="Only check classes whose enrollment has changed since the last run.")
+        parser.add_argument("--dry-run", action="store_true", help="Report drift without fixing it.")
+
+    def handle(self, *args, **options):
+        drift = reconcile_counters(incremental=options["incremental"], fix=not options["dry_run"])
+        for d in drift:
+            self.stdout.write("{} {}: stored {}, actual {}".format(d.model, d.pk, d.stored, d.actual))
+        self.stdout.write("{} counter(s) {}.".format(len(drift), "drifted" if options["dry_run"] else "fixed"))
@@ -0,0 +1,26 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from classes.models import Class
+
+
+class Command(BaseCommand):
+    help = "Rolls the window of materialized class occurrences forward (intended to be run daily)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true",
+                            help="Rebuild every class, even those whose window is still current.")
+
+    def handle(self, *args, **options):
+        classes = Class.objects.all()
+        if not options["all"]:
+            # Only classes whose window no longer reaches the full number of days ahead need rebuilding
+            horizon = datetime.date.today() + datetime.timedelta(days=settings.OCCURRENCE_WINDOW_FUTURE_DAYS)
+            classes = classes.exclude(occurrences_end__gte=horizon)
+        rebuilt = 0
+        for class_obj in classes.iterator():
+            class_obj.rebuild_occurrences()
+            rebuilt += 1
+        self.stdout.write("{} class(es) rebuilt.".format(rebuilt))
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.13 on 2026-10-17 22:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='class',
+            name='occurrences_end',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='class',
+            name='occurrences_start',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='Occurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='classes.class')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='occurrence',
+            index=models.Index(fields=['parent', 'date'], name='classes_occ_parent__f1ab6e_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.13 on 2026-10-17 23:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0002_occurrences'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='classinstance',
+            name='parent',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='instances', to='classes.class'),
+        ),
+        migrations.AddIndex(
+            model_name='classinstance',
+            index=models.Index(fields=['parent', 'date', 'start_time'], name='classes_instance_parent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='classinstance',
+            index=models.Index(condition=models.Q(('cancelled', False)), fields=['parent', 'special', 'date', 'start_time'], name='classes_instance_active_idx'),
+        ),
+    ]
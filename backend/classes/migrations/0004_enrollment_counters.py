@@ -0,0 +1,32 @@
+# Generated by Django 4.1.13 on 2026-10-17 23:21
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0003_instance_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterReconciliation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('incremental', models.BooleanField()),
+                ('checked', models.PositiveIntegerField(default=0)),
+                ('drifted', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EnrollmentChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('class_id', models.BigIntegerField()),
+                ('changed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
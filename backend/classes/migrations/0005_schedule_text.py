@@ -0,0 +1,27 @@
+# Generated by Django 4.1.13 on 2026-10-17 23:22
+
+from django.db import migrations, models
+
+
+def render_schedules(apps, schema_editor):
+    Class = apps.get_model("classes", "Class")
+    classes = list(Class.objects.all())
+    for class_obj in classes:
+        class_obj.schedule_text = [rule.to_text() for rule in class_obj.schedule.rrules]
+    Class.objects.bulk_update(classes, ["schedule_text"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0004_enrollment_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='class',
+            name='schedule_text',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(render_schedules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.1.13 on 2026-10-17 23:27
+
+from django.db import migrations
+import utils.fields
+
+
+def copy_lowercase(apps, schema_editor):
+    Class = apps.get_model("classes", "Class")
+    classes = list(Class.objects.all())
+    for class_obj in classes:
+        class_obj.name_lower = class_obj.name.lower()
+        class_obj.coach_lower = class_obj.coach.lower()
+    Class.objects.bulk_update(classes, ["name_lower", "coach_lower"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0005_schedule_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='class',
+            name='coach_lower',
+            field=utils.fields.LowercaseField('coach', blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='class',
+            name='name_lower',
+            field=utils.fields.LowercaseField('name', blank=True, max_length=255),
+        ),
+        migrations.RunPython(copy_lowercase, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='class',
+            index=utils.fields.CaseInsensitiveIndex(fields=['name'], name='classes_class_name_ci_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='class',
+            index=utils.fields.CaseInsensitiveIndex(fields=['coach'], name='classes_class_coach_ci_idx'),
+        ),
+    ]
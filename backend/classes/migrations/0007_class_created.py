@@ -0,0 +1,27 @@
+# Generated by Django 4.1.13 on 2026-10-18 00:12
+
+import datetime
+from django.db import migrations, models
+from django.db.models import F
+
+
+def anchor_existing_classes(apps, schema_editor):
+    # Keep the dates that have already been materialized, which were anchored at the start of their window
+    Class = apps.get_model("classes", "Class")
+    Class.objects.filter(occurrences_start__isnull=False).update(created=F("occurrences_start"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0006_case_insensitive_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='class',
+            name='created',
+            field=models.DateField(default=datetime.date.today, editable=False),
+        ),
+        migrations.RunPython(anchor_existing_classes, migrations.RunPython.noop),
+    ]
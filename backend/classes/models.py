@@ -1,13 +1,23 @@
+import copy
 import datetime
+import logging
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Max, Q
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from recurrence.fields import RecurrenceField
 
+from utils.fields import CaseInsensitiveIndex, LowercaseField
+from utils.profiling import timed
+from utils.tracking import DirtyFieldsMixin
+
+logger = logging.getLogger(__name__)
+
 
 # Create your models here.
-class Class(models.Model):
+class Class(DirtyFieldsMixin, models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     studio = models.ForeignKey("studios.Studio", related_name="classes", on_delete=models.CASCADE)
@@ -37,68 +47,186 @@ class Class(models.Model):
         <p>You can also schedule or skip individual dates by clicking "Add date".</p>
         </details>
     """)
+    # Range of dates for which `occurrences` have been materialized from `schedule`
+    occurrences_start = models.DateField(null=True, blank=True, editable=False)
+    occurrences_end = models.DateField(null=True, blank=True, editable=False)
+    # Recurrence rules without an explicit start are anchored at midnight of this date (see `expand_schedule`)
+    created = models.DateField(default=datetime.date.today, editable=False)
+    # Rendered text of each rule in `schedule` (e.g. "weekly, each Monday"), regenerated when it changes
+    schedule_text = models.JSONField(default=list, blank=True, editable=False)
+    # Lowercase copies for case-insensitive filtering, on backends without expression indexes
+    name_lower = LowercaseField("name", blank=True)
+    coach_lower = LowercaseField("coach", blank=True)
 
     class Meta:
         verbose_name_plural = "classes"
+        indexes = [
+            CaseInsensitiveIndex(fields=["name"], name="classes_class_name_ci_idx"),
+            CaseInsensitiveIndex(fields=["coach"], name="classes_class_coach_ci_idx"),
+        ]
 
     def clean(self):
         if self.start_time is not None and self.end_time is not None:
             if self.start_time >= self.end_time:
                 raise ValidationError({"end_time": "End time is not after start time"})
 
+    def expand_schedule(self, after, before):
+        """Expands the recurrence rules into the occurrences (as naive local datetimes) from `after` to `before`
+        (inclusive, also naive local datetimes).
+
+        Rules are anchored at the schedule's start if it has one, or else at midnight of the day the class was
+        created, so that every expansion (materialized or not, whenever it runs) agrees on the dates of rules
+        with an interval or a count. Midnight also lines up with the exdates added by ClassInstance.save().
+        """
+        schedule = self.schedule
+        dtstart = schedule.dtstart
+        if dtstart is None:
+            dtstart = datetime.datetime.combine(self.created, datetime.time(0))
+            # Unlike an explicit start, the anchor itself is only an occurrence if it matches the rules
+            schedule = copy.copy(schedule)
+            schedule.include_dtstart = False
+        if timezone.is_aware(dtstart):
+            # Schedules loaded from the database have an aware start
+            occurrences = schedule.between(timezone.make_aware(after), timezone.make_aware(before), inc=True,
+                                           dtstart=dtstart)
+            return [timezone.make_naive(occurrence) for occurrence in occurrences]
+        return schedule.between(after, before, inc=True, dtstart=dtstart)
+
+    def get_occurrence_dates(self, start, end):
+        """Expands the recurrence rules into the list of dates from `start` to `end` (inclusive).
+        """
+        with timed("rrule"):
+            return [occurrence.date() for occurrence in self.expand_schedule(
+                datetime.datetime.combine(start, datetime.time(0)), datetime.datetime.combine(end, datetime.time(0))
+            )]
+
+    def is_scheduled(self, date):
+        """Whether the recurrence rules have an occurrence on `date`.
+        """
+        return bool(self.expand_schedule(datetime.datetime.combine(date, datetime.time(0)),
+                                         datetime.datetime.combine(date, datetime.time(23, 59, 59))))
+
+    def rebuild_occurrences(self):
+        """Re-materializes the occurrences of this class over the rolling window around today.
+        """
+        start = datetime.date.today() - datetime.timedelta(days=settings.OCCURRENCE_WINDOW_PAST_DAYS)
+        end = datetime.date.today() + datetime.timedelta(days=settings.OCCURRENCE_WINDOW_FUTURE_DAYS)
+        with transaction.atomic():
+            self.occurrences.all().delete()
+            Occurrence.objects.bulk_create([
+                Occurrence(date=date, start_time=self.start_time, end_time=self.end_time, parent=self)
+                for date in self.get_occurrence_dates(start, end)
+            ])
+            # Use update() so that we don't go through save() again
+            Class.objects.filter(pk=self.pk).update(occurrences_start=start, occurrences_end=end)
+        self.occurrences_start = start
+        self.occurrences_end = end
+        self.reset_dirty_fields(["occurrences_start", "occurrences_end"])
+
+    def occurrences_cover(self, start, end):
+        """Whether occurrences have been materialized for every date from `start` to `end` (inclusive).
+        """
+        return self.occurrences_start is not None and self.occurrences_end is not None \
+            and self.occurrences_start <= start and end <= self.occurrences_end
+
+    def reconcile_instances(self):
+        """Brings the upcoming non-special instances in line with the current schedule and times.
+
+        Instances whose date is no longer scheduled are cancelled (and an exception is added to the schedule
+        for their date), and the rest are moved to the class start/end times. Both groups are written with
+        `bulk_update`, so this doesn't go through `ClassInstance.save()`.
+        """
+        instances = list(self.instances.filter(
+            Q(
+                Q(date=datetime.date.today()) & Q(start_time__gt=datetime.datetime.now().time()) |
+                Q(date__gt=datetime.date.today())
+            )
+            & Q(special=False) & Q(cancelled=False)
+        ))
+        if not instances:
+            return
+        valid_dates = set(self.get_occurrence_dates(datetime.date.today(), max(i.date for i in instances)))
+
+        cancelled = []
+        retimed = []
+        for instance in instances:
+            if instance.date not in valid_dates:
+                instance.cancelled = True
+                cancelled.append(instance)
+                self.schedule.exdates.append(datetime.datetime.combine(instance.date, datetime.time(0)))
+            elif instance.start_time != self.start_time or instance.end_time != self.end_time:
+                instance.start_time = self.start_time
+                instance.end_time = self.end_time
+                retimed.append(instance)
+        ClassInstance.objects.bulk_update(cancelled, ["cancelled"])
+        ClassInstance.objects.bulk_update(retimed, ["start_time", "end_time"])
+
+        if cancelled or retimed:
+            logger.warning(
+                "Class `%s` (%d) was rescheduled: %d instance(s) cancelled, since their dates do not match the "
+                "new schedule, and %d instance(s) moved to the new start/end times.",
+                self.name, self.pk, len(cancelled), len(retimed),
+                extra={"class_id": self.pk,
+                       "cancelled": [instance.date for instance in cancelled],
+                       "retimed": [instance.date for instance in retimed]}
+            )
+
+    def render_schedule(self):
+        return [rule.to_text() for rule in self.schedule.rrules]
+
     def save(self, *args, **kwargs):
+        if self.pk is None or "schedule" in self.get_dirty_fields():
+            self.schedule_text = self.render_schedule()
+            if "update_fields" in kwargs:
+                kwargs["update_fields"] = set(kwargs["update_fields"]) | {"schedule_text"}
+
         if self.pk is None:
             # Class is being created, not updated, so we don't have to worry about field changes
             super(Class, self).save(*args, **kwargs)
+            self.rebuild_occurrences()
             return
 
-        obj = Class.objects.get(pk=self.pk)
-        if self.schedule == obj.schedule and self.start_time == obj.start_time and self.end_time == obj.end_time:
+        scheduling = {"schedule", "start_time", "end_time"}
+        if not scheduling.intersection(kwargs.get("update_fields") or self.get_dirty_fields()):
             # Class hasn't had its scheduling changed, so no need to check recurrence rules
             super(Class, self).save(*args, **kwargs)
             return
 
         # RECURRENCE RULE VALIDATION
-        if furthest_date := self.instances.aggregate(Max("date"))["date__max"]:
-            # There are existing instances, and we need to make sure they all match the new recurrence rule
-            # Get a list of possible occurrences according to the recurrence rule
-            occurrences = self.schedule.between(
-                datetime.datetime.now(),
-                datetime.datetime.combine(furthest_date, datetime.time(0)) + datetime.timedelta(days=1)
-            )
-            # All instances that are not "special", haven't been cancelled, and haven't started yet, MUST
-            # have a date that is found in occurrences
-            instances = self.instances.filter(
-                Q(
-                    Q(date=datetime.date.today()) & Q(start_time__gt=datetime.datetime.now().time()) |
-                    Q(date__gt=datetime.date.today())
-                )
-                & Q(special=False) & Q(cancelled=False)
-            )
-            for instance in instances:
-                if datetime.datetime.combine(instance.date, datetime.time(0)) not in occurrences:
-                    # Instance date is no longer valid according to recurrence rules
-                    print("WARNING: Instance `{}` cancelled, since its date does not match the new parent schedule."
-                          .format(instance))
-                    instance.cancelled = True
-                else:
-                    # The date is valid, but we need to make sure the times match as well
-                    if instance.start_time != self.start_time:
-                        print("WARNING: Instance `{}` start time adjusted to match the new parent start time."
-                              .format(instance))
-                        instance.start_time = self.start_time
-                    if instance.end_time != self.end_time:
-                        print("WARNING: Instance `{}` end time adjusted to match the new parent end time."
-                              .format(instance))
-                        instance.end_time = self.end_time
-                instance.save()
-            super(Class, self).save(*args, **kwargs)
+        # Existing instances that haven't started yet must match the new recurrence rules and times
+        self.reconcile_instances()
+        super(Class, self).save(*args, **kwargs)
+        # Scheduling has changed, so the materialized occurrences are no longer valid
+        self.rebuild_occurrences()
 
     def __str__(self):
         return "{} (at {})".format(self.name, self.studio.name)
 
 
-class ClassInstance(models.Model):
+class Occurrence(models.Model):
+    """A date on which a class is scheduled to occur according to its recurrence rules.
+
+    Occurrences are materialized from `Class.schedule` whenever the schedule or times of the class
+    change, so that schedule reads can use a range query instead of expanding the recurrence rules.
+    """
+    date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    parent = models.ForeignKey("Class", related_name="occurrences", on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["parent", "date"]),
+        ]
+
+    def __str__(self):
+        return "{}, from {} to {}".format(self.date,
+                                          self.start_time.strftime("%H:%M"),
+                                          self.end_time.strftime("%H:%M")
+                                          )
+
+
+class ClassInstance(DirtyFieldsMixin, models.Model):
     date = models.DateField()
     start_time = models.TimeField()
     end_time = models.TimeField()
@@ -113,38 +241,70 @@ class ClassInstance(models.Model):
     #   enrolled = parent.enrolled_users - self.dropped_users + self.enrolled_users
     # This equality will be maintained as people enroll and drop this instance and the parent class
     enrolled = models.PositiveIntegerField(default=0)
-    parent = models.ForeignKey("Class", related_name="instances", on_delete=models.CASCADE)
+    # Indexed by `Meta.indexes`
+    parent = models.ForeignKey("Class", related_name="instances", on_delete=models.CASCADE, db_index=False)
 
     # RELATED FIELDS IN OTHER MODELS
     # enrolled_users = set of users that have enrolled in this particular instance
     # dropped_users = set of users that were enrolled (through parent), but have dropped this particular instance
 
+    class Meta:
+        indexes = [
+            # Instances of a class in date order (also replaces the index on the foreign key)
+            models.Index(fields=["parent", "date", "start_time"], name="classes_instance_parent_idx"),
+            # Active (i.e. not cancelled) special or non-special instances of a class, as listed in schedules and
+            # the admin, and looked up when enrolling in non-special instances
+            models.Index(fields=["parent", "special", "date", "start_time"], condition=models.Q(cancelled=False),
+                         name="classes_instance_active_idx"),
+        ]
+
     def save(self, *args, **kwargs):
+        reschedule_parent = False
         if self.pk and not self.special:
             # We know self.pk is not none (so we are saving an existing instance),
             # and the instance being saved is not "special"
             # Editing a non-special instance should make it special, and also add an
             # exception to the recurrence rule
-            obj = ClassInstance.objects.get(pk=self.pk)
+            previous = self.get_loaded_values()
 
             # First, check if date or times have been edited
-            if (self.date != obj.date) \
-                    or (self.start_time != obj.start_time and self.start_time != self.parent.start_time) \
-                    or (self.end_time != obj.end_time and self.end_time != self.parent.end_time):
+            if (self.date != previous["date"]) \
+                    or (self.start_time != previous["start_time"] and self.start_time != self.parent.start_time) \
+                    or (self.end_time != previous["end_time"] and self.end_time != self.parent.end_time):
                 # Set instance to special
-                print("WARNING: User is rescheduling a non-special class instance. "
-                      "The instance will be set to special.")
+                logger.warning("User is rescheduling non-special class instance %d. The instance will be set to "
+                               "special.", self.pk)
                 self.special = True
-            if self.date != obj.date or self.cancelled != obj.cancelled:
+            if self.date != previous["date"] or self.cancelled != previous["cancelled"]:
                 # We need to make an exception for the previous date of the instance, since we have
                 # rescheduled this instance
-                print("WARNING: The instance date has changed or the instance is being cancelled, so an exception "
-                      "will be added to the parent schedule.")
+                logger.warning("The date of class instance %d has changed or the instance is being cancelled, so an "
+                               "exception will be added to the parent schedule.", self.pk)
                 self.parent.schedule.exdates.append(datetime.datetime.combine(
-                    self.date, datetime.time(0)
+                    previous["date"], datetime.time(0)
                 ))
+                reschedule_parent = True
         super(ClassInstance, self).save(*args, **kwargs)
-        self.parent.save()
+        if reschedule_parent:
+            # Only the parent schedule has changed, so only it gets written
+            self.parent.save()
+
+    def reserve_seat(self):
+        """Atomically increments `enrolled`, unless the instance is already at capacity.
+
+        The capacity check and increment happen in a single conditional UPDATE, so that concurrent
+        enrollments can never oversell the instance. Returns whether a seat was reserved.
+        """
+        reserved = ClassInstance.objects.filter(pk=self.pk, enrolled__lt=self.parent.capacity) \
+            .update(enrolled=F("enrolled") + 1)
+        self.refresh_from_db(fields=["enrolled"])
+        return reserved == 1
+
+    def release_seat(self):
+        """Atomically decrements `enrolled`.
+        """
+        ClassInstance.objects.filter(pk=self.pk, enrolled__gt=0).update(enrolled=F("enrolled") - 1)
+        self.refresh_from_db(fields=["enrolled"])
 
     def __str__(self):
         return "{}, from {} to {}".format(self.date,
@@ -153,6 +313,29 @@ class ClassInstance(models.Model):
                                           )
 
 
+class CounterReconciliation(models.Model):
+    """A run of the enrollment counter reconciler (see `classes.counters`).
+    """
+    started_at = models.DateTimeField()
+    incremental = models.BooleanField()
+    # Number of classes and instances checked
+    checked = models.PositiveIntegerField(default=0)
+    # Number of classes and instances whose counters had drifted
+    drifted = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "{} ({} drifted)".format(self.started_at, self.drifted)
+
+
+class EnrollmentChange(models.Model):
+    """A change to the enrollment in a class (or one of its instances), so that the enrollment counters can be
+    reconciled incrementally (see `classes.counters`). Changes are appended here rather than recorded on the
+    class, which would add a write to a (popular) class's row to every enrollment.
+    """
+    class_id = models.BigIntegerField()
+    changed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+
 class Keyword(models.Model):
     name = models.CharField(max_length=255)
     related_class = models.ForeignKey("Class", on_delete=models.CASCADE, related_name="keywords")
@@ -1 +1,277 @@
-# Create your tests here.
+import datetime
+import re
+
+import recurrence
+from django.db import connection
+from django.forms import inlineformset_factory
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import Account, Subscription
+from accounts.schedule_cache import get_cache
+from classes.admin import SpecialInstanceFormSet, NonSpecialInstanceFormSet, CancelledPastInstanceFormSet
+from classes.counters import Drift, reconcile_counters
+from classes.models import Class, ClassInstance, CounterReconciliation, EnrollmentChange
+from studios.models import Studio
+from utils.instance_helpers import expand_recurrence
+
+
+class QueryPlanTests(TestCase):
+    """Runs the hot class instance queries through `EXPLAIN QUERY PLAN`, and checks that none of them
+    scans a whole table.
+    """
+    def setUp(self):
+        self.studio = Studio.objects.create(name="Studio", address="1 King St W", lat=43.6487, long=-79.3817,
+                                            postal_code="M5H 1A1", phone_num="4165550100")
+        self.class_obj = Class.objects.create(
+            name="Class", studio=self.studio, coach="Coach", capacity=10,
+            start_time=datetime.time(23, 58), end_time=datetime.time(23, 59),
+            schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)])
+        )
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.instance = ClassInstance.objects.create(date=tomorrow, start_time=datetime.time(10),
+                                                     end_time=datetime.time(11), special=True, parent=self.class_obj)
+        ClassInstance.objects.create(date=tomorrow, start_time=self.class_obj.start_time,
+                                     end_time=self.class_obj.end_time, special=False, parent=self.class_obj)
+        subscription = Subscription.objects.create(billing_cycle="MONTHLY", charge=10)
+        self.user = Account.objects.create(email="user@email.com", subscription=subscription)
+        self.user.classes.add(self.class_obj)
+        self.user.enrolled_instances.add(self.instance)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        get_cache().clear()
+
+    def assertNoFullScans(self, queries):
+        selects = [query["sql"] for query in queries if query["sql"].startswith("SELECT")]
+        self.assertTrue(selects)
+        for sql in selects:
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                # Scanning a table (or the whole of one of its indexes) reads every row. SQLite before 3.36
+                # reports these as "SCAN TABLE <name>"
+                match = re.match(r"SCAN (?:TABLE )?(\w+)", step)
+                if match and match.group(1) != "CONSTANT":
+                    self.fail("Full scan of {} in query:\n{}\nPlan:\n{}".format(
+                        match.group(1), sql, "\n".join(plan)))
+
+    def test_studio_schedule(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/studios/{}/schedule".format(self.studio.pk))
+        self.assertNoFullScans(queries)
+
+    def test_user_schedule(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/accounts/schedule/")
+        self.assertNoFullScans(queries)
+
+    def test_non_special_instance(self):
+        date = datetime.date.today() + datetime.timedelta(days=1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/studios/{}/classes/{}/ns/{}/".format(self.studio.pk, self.class_obj.pk, date))
+        self.assertNoFullScans(queries)
+
+    def test_admin_formsets(self):
+        for formset in (SpecialInstanceFormSet, NonSpecialInstanceFormSet, CancelledPastInstanceFormSet):
+            with self.subTest(formset=formset.__name__):
+                formset_class = inlineformset_factory(Class, ClassInstance, formset=formset,
+                                                      fields=("date", "start_time", "end_time"))
+                with CaptureQueriesContext(connection) as queries:
+                    list(formset_class(instance=self.class_obj).get_queryset())
+                self.assertNoFullScans(queries)
+
+    def test_case_insensitive_filters(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/studios/search", {"amenities": "Showers", "classes": "CLASS", "coaches": "coach"})
+        self.assertNoFullScans([query for query in queries if "LOWER(" in query["sql"]])
+
+    def test_rescheduling(self):
+        self.class_obj.start_time = datetime.time(23, 50)
+        with CaptureQueriesContext(connection) as queries:
+            self.class_obj.save()
+        self.assertNoFullScans(queries)
+
+
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        self.studio = Studio.objects.create(name="Studio", address="1 King St W", lat=43.6487, long=-79.3817,
+                                            postal_code="M5H 1A1", phone_num="4165550100")
+        self.start = datetime.date.today() + datetime.timedelta(days=1)
+        self.class_obj = Class.objects.create(
+            name="Class", studio=self.studio, coach="Coach", capacity=10,
+            start_time=datetime.time(10), end_time=datetime.time(11),
+            schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)])
+        )
+        ClassInstance.objects.bulk_create([
+            ClassInstance(date=self.start + datetime.timedelta(days=day), start_time=datetime.time(10),
+                          end_time=datetime.time(11), special=False, parent=self.class_obj)
+            for day in range(28)
+        ])
+
+    def test_reschedule(self):
+        # Every other day from tomorrow, an hour later
+        self.class_obj.schedule = recurrence.Recurrence(
+            rrules=[recurrence.Rule(recurrence.DAILY, interval=2)],
+            dtstart=datetime.datetime.combine(self.start, datetime.time(0))
+        )
+        self.class_obj.start_time = datetime.time(11)
+        self.class_obj.end_time = datetime.time(12)
+        with self.assertLogs("classes.models", level="WARNING") as logs, \
+                CaptureQueriesContext(connection) as queries:
+            self.class_obj.save()
+        num_queries = len(queries)
+
+        instances = self.class_obj.instances.order_by("date")
+        self.assertEqual([instance.cancelled for instance in instances], [False, True] * 14)
+        for instance in instances.filter(cancelled=False):
+            self.assertEqual((instance.start_time, instance.end_time), (datetime.time(11), datetime.time(12)))
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(len(logs.records[0].cancelled), 14)
+        self.assertEqual(len(logs.records[0].retimed), 14)
+        # Cancelled dates are excluded from the schedule
+        self.class_obj.refresh_from_db()
+        self.assertEqual(len(self.class_obj.schedule.exdates), 14)
+
+        # The number of queries doesn't depend on the number of instances
+        ClassInstance.objects.bulk_create([
+            ClassInstance(date=self.start + datetime.timedelta(days=day), start_time=datetime.time(11),
+                          end_time=datetime.time(12), special=False, parent=self.class_obj)
+            for day in range(28, 56)
+        ])
+        self.class_obj.start_time = datetime.time(9)
+        self.class_obj.end_time = datetime.time(10)
+        with self.assertLogs("classes.models", level="WARNING"), CaptureQueriesContext(connection) as queries:
+            self.class_obj.save()
+        self.assertLessEqual(len(queries), num_queries)
+
+
+class ScheduleExpansionTests(TestCase):
+    def setUp(self):
+        self.studio = Studio.objects.create(name="Studio", address="1 King St W", lat=43.6487, long=-79.3817,
+                                            postal_code="M5H 1A1", phone_num="4165550100")
+        self.today = datetime.date.today()
+        # Every other day (with no explicit start) since the class was created, 3 days ago
+        self.class_obj = Class.objects.create(
+            name="Class", studio=self.studio, coach="Coach", capacity=10,
+            start_time=datetime.time(10), end_time=datetime.time(11),
+            schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY, interval=2)]),
+            created=self.today - datetime.timedelta(days=3)
+        )
+
+    def test_schedule_anchor(self):
+        expected = [self.today + datetime.timedelta(days=day) for day in range(1, 15, 2)]
+        self.assertEqual(self.class_obj.get_occurrence_dates(self.today, self.today + datetime.timedelta(days=14)),
+                         expected)
+        # The materialized occurrences and direct expansions agree, whenever they start
+        self.assertEqual(list(self.class_obj.occurrences.filter(date__gt=self.today, date__lte=expected[-1])
+                              .values_list("date", flat=True).order_by("date")), expected)
+        self.assertEqual(self.class_obj.get_occurrence_dates(expected[0], expected[-1]), expected)
+        self.assertEqual(self.class_obj.get_occurrence_dates(expected[1], expected[-1]), expected[1:])
+        self.assertEqual([occurrence.date() for occurrence in expand_recurrence(self.class_obj, 14, 1)
+                          if occurrence.date() > self.today], expected)
+        self.assertFalse(self.class_obj.is_scheduled(self.today - datetime.timedelta(days=5)))
+        self.assertTrue(self.class_obj.is_scheduled(self.today + datetime.timedelta(days=1)))
+
+
+class DirtyFieldsTests(TestCase):
+    def setUp(self):
+        self.studio = Studio.objects.create(name="Studio", address="1 King St W", lat=43.6487, long=-79.3817,
+                                            postal_code="M5H 1A1", phone_num="4165550100")
+        self.class_obj = Class.objects.create(
+            name="Class", studio=self.studio, coach="Coach", capacity=10,
+            start_time=datetime.time(10), end_time=datetime.time(11),
+            schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)])
+        )
+        self.date = datetime.date.today() + datetime.timedelta(days=1)
+        ClassInstance.objects.create(date=self.date, start_time=datetime.time(10), end_time=datetime.time(11),
+                                     special=False, parent=self.class_obj)
+        self.instance = ClassInstance.objects.select_related("parent").get(parent=self.class_obj)
+
+    def test_only_changed_fields_are_written(self):
+        self.instance.enrolled += 1
+        with CaptureQueriesContext(connection) as queries:
+            self.instance.save()
+        updates = [query["sql"] for query in queries if not query["sql"].startswith("SELECT")]
+        self.assertEqual(len(updates), 1)
+        self.assertRegex(updates[0], r'^UPDATE "classes_classinstance" SET "enrolled" = 1 WHERE')
+
+        # Saving again doesn't write anything
+        with CaptureQueriesContext(connection) as queries:
+            self.instance.save()
+            self.class_obj.save()
+        self.assertEqual(len(queries), 0)
+
+    def test_cancelling_reschedules_parent(self):
+        # A stale change to the parent isn't written, since only its schedule changes
+        Class.objects.filter(pk=self.class_obj.pk).update(enrolled=5)
+        self.instance.cancelled = True
+        self.instance.save()
+        self.class_obj.refresh_from_db()
+        self.assertEqual(self.class_obj.enrolled, 5)
+        self.assertEqual([exdate.date() for exdate in self.class_obj.schedule.exdates], [self.date])
+        self.assertFalse(self.class_obj.occurrences.filter(date=self.date).exists())
+
+
+class CounterReconciliationTests(TestCase):
+    def setUp(self):
+        self.studio = Studio.objects.create(name="Studio", address="1 King St W", lat=43.6487, long=-79.3817,
+                                            postal_code="M5H 1A1", phone_num="4165550100")
+        self.classes = [
+            Class.objects.create(
+                name="Class {}".format(i), studio=self.studio, coach="Coach", capacity=10,
+                start_time=datetime.time(10), end_time=datetime.time(11),
+                schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)])
+            )
+            for i in range(2)
+        ]
+        date = datetime.date.today() + datetime.timedelta(days=1)
+        self.instances = [ClassInstance.objects.create(date=date, start_time=datetime.time(10),
+                                                       end_time=datetime.time(11), parent=class_obj)
+                          for class_obj in self.classes]
+        self.users = [Account.objects.create(email="user{}@email.com".format(i)) for i in range(3)]
+
+    def test_reconcile(self):
+        # Enroll without going through the views, so that none of the counters are updated
+        for user in self.users:
+            user.classes.add(self.classes[0])
+        self.users[0].dropped_instances.add(self.instances[0])
+        self.users[0].enrolled_instances.add(self.instances[1])
+
+        with self.assertLogs("classes.counters", level="WARNING"):
+            drift = reconcile_counters()
+        self.assertEqual(set(drift), {
+            Drift("class", self.classes[0].pk, 0, 3),
+            Drift("instance", self.instances[0].pk, 0, 2),
+            Drift("instance", self.instances[1].pk, 0, 1),
+        })
+        self.instances[0].refresh_from_db()
+        self.assertEqual(self.instances[0].enrolled, 2)
+        self.assertEqual(reconcile_counters(), [])
+
+    def test_incremental(self):
+        reconcile_counters()
+        # Untouched drift is skipped by incremental runs, but not full ones
+        Class.objects.filter(pk=self.classes[1].pk).update(enrolled=5)
+        self.users[0].classes.add(self.classes[0])
+        with self.assertLogs("classes.counters", level="WARNING"):
+            drift = reconcile_counters(incremental=True)
+        self.assertEqual({(d.model, d.pk) for d in drift},
+                         {("class", self.classes[0].pk), ("instance", self.instances[0].pk)})
+        self.assertEqual(CounterReconciliation.objects.latest("started_at").checked, 2)
+        with self.assertLogs("classes.counters", level="WARNING"):
+            drift = reconcile_counters()
+        self.assertEqual(drift, [Drift("class", self.classes[1].pk, 5, 0)])
+
+    def test_changes_do_not_write_class_rows(self):
+        reconcile_counters()
+        with CaptureQueriesContext(connection) as queries:
+            self.users[0].enrolled_instances.add(self.instances[1])
+        self.assertFalse([query for query in queries.captured_queries if 'UPDATE "classes_class"' in query["sql"]])
+        self.assertEqual(list(EnrollmentChange.objects.values_list("class_id", flat=True)), [self.classes[1].pk])
+        with self.assertLogs("classes.counters", level="WARNING"):
+            drift = reconcile_counters(incremental=True)
+        self.assertEqual(drift, [Drift("instance", self.instances[1].pk, 0, 1)])
+        # Changes that have been reconciled are pruned
+        self.assertFalse(EnrollmentChange.objects.exists())
@@ -2,6 +2,7 @@ python3 -m venv venv
 source ./venv/bin/activate
 python -m pip install -r requirements.txt
 python manage.py migrate
+python manage.py refresh_occurrences
 
 # NOTE TO TA: You can change the admin user credentials by specifying
 # different values for DJANGO_SUPERUSER_EMAIL and DJANGO_SUPERUSER_PASSWORD
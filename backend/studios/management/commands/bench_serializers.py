@@ -0,0 +1,73 @@
+import datetime
+import time
+
+import recurrence
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from classes.models import Class, Keyword
+from studios.models import Amenity, Studio
+from studios.serializers import StudioSerializer, StudioListSerializer, StudioSearchSerializer
+
+
+class Command(BaseCommand):
+    help = "Compares the time (and queries) to serialize a list of studios with the full StudioSerializer and " \
+           "with the list projections. Runs against temporary data, in a transaction that is rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--studios", type=int, default=1000, help="Number of studios to serialize.")
+        parser.add_argument("--classes", type=int, default=3, help="Number of classes per studio.")
+        parser.add_argument("--repeat", type=int, default=3, help="Number of runs (the best one is reported).")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.create_studios(options["studios"], options["classes"])
+            studios = Studio.objects.filter(name__startswith="Benchmark").order_by("name")
+            scenarios = [
+                # (The lists previously used the full serializer, with these fields excluded and these prefetches)
+                ("nearby", StudioListSerializer, ["images", "phone_num", "classes", "amenities"], []),
+                ("search", StudioSearchSerializer, ["images", "directions", "lat", "long"],
+                 ["amenities", "classes__keywords"]),
+            ]
+            self.stdout.write("{:<8} {:<12} {:>10} {:>10}".format("List", "Serializer", "Queries", "ms"))
+            for name, projection, exclude_fields, prefetches in scenarios:
+                def full():
+                    queryset = studios.prefetch_related(*prefetches)
+                    return StudioSerializer(queryset, many=True, context={"exclude_fields": exclude_fields}).data
+
+                def projected():
+                    return projection(studios.only(*projection.columns), many=True).data
+
+                for label, serialize in (("full", full), ("projection", projected)):
+                    queries, elapsed = self.measure(serialize, options["repeat"])
+                    self.stdout.write("{:<8} {:<12} {:>10} {:>10.1f}".format(name, label, queries, elapsed * 1000))
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def measure(serialize, repeat):
+        best = None
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                serialize()
+                elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return len(queries), best
+
+    @staticmethod
+    def create_studios(num_studios, num_classes):
+        studios = Studio.objects.bulk_create([
+            Studio(name="Benchmark {:05d}".format(i), address="1 King St W", lat=43.6487, long=-79.3817,
+                   postal_code="M5H 1A1", phone_num="4165550100")
+            for i in range(num_studios)
+        ])
+        Amenity.objects.bulk_create([Amenity(type="Showers", quantity=2, studio=studio) for studio in studios])
+        schedule = recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.WEEKLY, byday=[0, 2])])
+        classes = Class.objects.bulk_create([
+            Class(name="Class {}".format(j), studio=studio, coach="Coach", capacity=10,
+                  start_time=datetime.time(10), end_time=datetime.time(11), schedule=schedule,
+                  schedule_text=[rule.to_text() for rule in schedule.rrules])
+            for studio in studios for j in range(num_classes)
+        ])
+        Keyword.objects.bulk_create([Keyword(name="keyword", related_class=class_obj) for class_obj in classes])
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Account
+from studios.models import StudioImage
+from utils.images import update_variants
+
+
+class Command(BaseCommand):
+    help = "Generates the resized variants of studio images and avatars that don't have them yet " \
+           "(e.g. images uploaded before variants were introduced, or after changing IMAGE_VARIANTS)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Regenerate the variants of every image.")
+
+    def handle(self, *args, **options):
+        for model, image_field, variants_field in ((StudioImage, "image", "variants"),
+                                                   (Account, "avatar", "avatar_variants")):
+            generated = 0
+            for pk, name, variants in model.objects.exclude(**{image_field: ""}) \
+                    .values_list("pk", image_field, variants_field).iterator():
+                if options["force"] or variants.get("source") != name:
+                    update_variants(model, pk, image_field, variants_field)
+                    generated += 1
+            self.stdout.write("Generated the variants of {} {}.".format(generated, model._meta.verbose_name_plural))
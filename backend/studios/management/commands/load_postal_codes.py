@@ -0,0 +1,52 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from studios.models import PostalCodeLocation
+from utils.geocoding import get_geocoder, normalize_postal_code
+
+# Accepted column names, in order of preference
+POSTAL_CODE_COLUMNS = ("postal_code", "fsa")
+LAT_COLUMNS = ("lat", "latitude")
+LONG_COLUMNS = ("long", "lng", "longitude")
+
+
+class Command(BaseCommand):
+    help = "Preloads the postal code location cache from a CSV file of postal codes (or forward sortation areas), " \
+           "so that they can be geocoded offline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file with a header row, and postal code, latitude and longitude columns.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with open(options["path"], newline="") as file:
+            reader = csv.DictReader(file)
+            columns = [self.find_column(reader.fieldnames or [], names)
+                       for names in (POSTAL_CODE_COLUMNS, LAT_COLUMNS, LONG_COLUMNS)]
+            batch = []
+            loaded = 0
+            for row in reader:
+                postal_code, lat, long = (row[column].strip() for column in columns)
+                batch.append(PostalCodeLocation(postal_code=normalize_postal_code(postal_code), lat=lat, long=long))
+                if len(batch) >= options["batch_size"]:
+                    loaded += self.save(batch)
+                    batch = []
+            loaded += self.save(batch)
+        # Locations cached in this process may have been overwritten
+        get_geocoder().clear()
+        self.stdout.write("{} location(s) loaded.".format(loaded))
+
+    @staticmethod
+    def find_column(fieldnames, names):
+        lowered = {fieldname.strip().lower(): fieldname for fieldname in fieldnames}
+        for name in names:
+            if name in lowered:
+                return lowered[name]
+        raise CommandError("CSV file is missing a column named one of: {}".format(", ".join(names)))
+
+    @staticmethod
+    def save(batch):
+        PostalCodeLocation.objects.bulk_create(batch, update_conflicts=True, unique_fields=["postal_code"],
+                                               update_fields=["lat", "long"])
+        return len(batch)
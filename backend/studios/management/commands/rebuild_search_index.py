@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from studios.models import Studio
+from studios.search import index_studios
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the search tokens of every studio (they are otherwise kept up to date as studios change)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Number of studios to index at a time.")
+
+    def handle(self, *args, **options):
+        studio_ids = list(Studio.objects.order_by("pk").values_list("pk", flat=True))
+        for i in range(0, len(studio_ids), options["batch_size"]):
+            index_studios(studio_ids[i:i + options["batch_size"]])
+        self.stdout.write("{} studio(s) indexed.".format(len(studio_ids)))
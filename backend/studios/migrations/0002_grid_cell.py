@@ -0,0 +1,39 @@
+# Generated by Django 4.1.13 on 2026-10-17 22:56
+
+import math
+
+from django.db import migrations, models
+
+
+def grid_cell(lat, long):
+    # A copy of `utils.geo.grid_cell` (with a `GRID_CELL_SIZE` of 0.05) as of this migration, so that replaying
+    # it doesn't depend on the current code
+    return "{}:{}".format(math.floor(float(lat) / 0.05), math.floor(float(long) / 0.05))
+
+
+def populate_grid_cells(apps, schema_editor):
+    Studio = apps.get_model("studios", "Studio")
+    studios = list(Studio.objects.exclude(lat=None).exclude(long=None))
+    for studio in studios:
+        studio.grid_cell = grid_cell(studio.lat, studio.long)
+    Studio.objects.bulk_update(studios, ["grid_cell"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studios', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studio',
+            name='grid_cell',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='studio',
+            index=models.Index(fields=['lat', 'long'], name='studios_stu_lat_1b5477_idx'),
+        ),
+        migrations.RunPython(populate_grid_cells, migrations.RunPython.noop),
+    ]
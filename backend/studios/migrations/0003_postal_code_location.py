@@ -0,0 +1,21 @@
+# Generated by Django 4.1.13 on 2026-10-17 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studios', '0002_grid_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostalCodeLocation',
+            fields=[
+                ('postal_code', models.CharField(max_length=6, primary_key=True, serialize=False)),
+                ('lat', models.DecimalField(decimal_places=6, max_digits=9, verbose_name='Latitude')),
+                ('long', models.DecimalField(decimal_places=6, max_digits=9, verbose_name='Longitude')),
+            ],
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.1.13 on 2026-10-17 23:23
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Copies of `utils.search.tokenize` and `studio_tokens` as of this migration, so that replaying it doesn't depend
+# on the current code
+def tokenize(text):
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [token[:64] for token in re.findall(r"\w+", text)]
+
+
+def studio_tokens(studio):
+    for token in tokenize(studio.name):
+        yield "studio_name", token, None
+    for class_obj in studio.classes.all():
+        for token in tokenize(class_obj.name):
+            yield "class_name", token, class_obj.pk
+        for token in tokenize(class_obj.coach):
+            yield "coach", token, class_obj.pk
+        for keyword in class_obj.keywords.all():
+            for token in tokenize(keyword.name):
+                yield "keyword", token, class_obj.pk
+    for amenity in studio.amenities.all():
+        for token in tokenize(amenity.type):
+            yield "amenity", token, None
+
+
+def build_search_index(apps, schema_editor):
+    Studio = apps.get_model("studios", "Studio")
+    SearchToken = apps.get_model("studios", "SearchToken")
+    SearchToken.objects.bulk_create([
+        SearchToken(kind=kind, token=token, studio=studio, related_class_id=class_id)
+        for studio in Studio.objects.prefetch_related("classes__keywords", "amenities")
+        for kind, token, class_id in set(studio_tokens(studio))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classes', '0005_schedule_text'),
+        ('studios', '0003_postal_code_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('kind', models.CharField(choices=[('studio_name', 'Studio name'), ('class_name', 'Class name'), ('coach', 'Coach'), ('keyword', 'Class keyword'), ('amenity', 'Amenity')], max_length=16)),
+                ('related_class', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='classes.class')),
+                ('studio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='studios.studio')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['kind', 'token'], name='studios_search_token_idx'),
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
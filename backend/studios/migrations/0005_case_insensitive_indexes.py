@@ -0,0 +1,32 @@
+# Generated by Django 4.1.13 on 2026-10-17 23:27
+
+from django.db import migrations
+import utils.fields
+
+
+def copy_lowercase(apps, schema_editor):
+    Amenity = apps.get_model("studios", "Amenity")
+    amenities = list(Amenity.objects.all())
+    for amenity in amenities:
+        amenity.type_lower = amenity.type.lower()
+    Amenity.objects.bulk_update(amenities, ["type_lower"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studios', '0004_search_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='amenity',
+            name='type_lower',
+            field=utils.fields.LowercaseField('type', blank=True, max_length=255),
+        ),
+        migrations.RunPython(copy_lowercase, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='amenity',
+            index=utils.fields.CaseInsensitiveIndex(fields=['type'], name='studios_amenity_type_ci_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-17 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studios', '0005_case_insensitive_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studioimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
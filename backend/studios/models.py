@@ -1,10 +1,13 @@
 from django.core.exceptions import ValidationError
 from django.db import models
-from geopy import MapBox
 
+from utils.fields import CaseInsensitiveIndex, LowercaseField
+from utils.geo import grid_cell
+from utils.geocoding import get_geocoder, GeocoderUnavailable
 from utils.validators import validate_postal_code, validate_phone_number
 
 from django.db.models import Field
+from django.db.models.expressions import Col
 from django.db.models.lookups import In
 
 
@@ -12,10 +15,16 @@ from django.db.models.lookups import In
 class IIn(In):
     lookup_name = 'iin'
 
-    def process_lhs(self, *args, **kwargs):
-        sql, params = super().process_lhs(*args, **kwargs)
+    def process_lhs(self, compiler, connection, lhs=None):
+        shadow = getattr(getattr(self.lhs, "target", None), "lowercase_field", None)
+        if lhs is None and shadow is not None and not connection.features.supports_expression_indexes:
+            # LOWER(column) can't be indexed on this backend, so use the stored lowercase copy instead
+            # (see `CaseInsensitiveIndex`)
+            return super().process_lhs(compiler, connection, Col(self.lhs.alias, shadow))
 
-        # Convert LHS to lowercase
+        sql, params = super().process_lhs(compiler, connection, lhs)
+
+        # Convert LHS to lowercase (matching the expression indexed by `CaseInsensitiveIndex`)
         sql = f'LOWER({sql})'
 
         return sql, params
@@ -36,37 +45,97 @@ class Studio(models.Model):
     long = models.DecimalField("Longitude", max_digits=9, decimal_places=6, blank=True)
     postal_code = models.CharField(max_length=7, validators=[validate_postal_code])
     phone_num = models.CharField("Phone number", max_length=16, validators=[validate_phone_number])
+    # Key of the grid cell containing (lat, long), used to prefilter nearby searches
+    grid_cell = models.CharField(max_length=32, blank=True, editable=False, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["lat", "long"]),
+        ]
 
     def __str__(self):
         return str(self.name) + " ({} classes)".format(self.classes.all().count())
 
+    def save(self, *args, **kwargs):
+        if self.lat is not None and self.long is not None:
+            self.grid_cell = grid_cell(self.lat, self.long)
+        super(Studio, self).save(*args, **kwargs)
+
     def clean(self):
         if not self.lat or not self.long:
             # Either lat or long is missing
-            geolocator = MapBox(
-                api_key="pk.eyJ1IjoiMWl6YXJkbyIsImEiOiJjbGFoOHFtZ2owNzV6M3ZuNTkyamVkeWozIn0.2LLzH1LNQYbi-O1upIKLGQ"
-            )
             try:
-                loc = geolocator.geocode(query="{}, Canada".format(self.postal_code), exactly_one=True)
-                if loc is None:
-                    raise ValidationError("No matching location found. Please enter a valid postal code, "
-                                          "or manually enter values for latitude and longitude.")
-                self.lat = loc.latitude
-                self.long = loc.longitude
-            except Exception as err:
+                loc = get_geocoder().geocode(self.postal_code)
+            except GeocoderUnavailable:
                 raise ValidationError("Location services are unavailable. Please manually enter values for latitude "
                                       "and longitude.")
+            if loc is None:
+                raise ValidationError("No matching location found. Please enter a valid postal code, "
+                                      "or manually enter values for latitude and longitude.")
+            self.lat = loc.lat
+            self.long = loc.long
 
 
 class Amenity(models.Model):
     type = models.CharField(max_length=255)
     quantity = models.PositiveSmallIntegerField()
     studio = models.ForeignKey("Studio", on_delete=models.CASCADE, related_name="amenities")
+    # Lowercase copy for case-insensitive filtering, on backends without expression indexes
+    type_lower = LowercaseField("type", blank=True)
 
     class Meta:
         verbose_name_plural = "amenities"
+        indexes = [
+            CaseInsensitiveIndex(fields=["type"], name="studios_amenity_type_ci_idx"),
+        ]
 
 
 class StudioImage(models.Model):
     image = models.ImageField(upload_to="studios/")
     studio = models.ForeignKey("Studio", on_delete=models.CASCADE, related_name="images")
+    # Resized copies of `image`, generated in the background (see `utils.images`)
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+
+
+class PostalCodeLocation(models.Model):
+    """Cached location of a postal code (or of a forward sortation area, i.e. the first 3 characters of a
+    postal code), used by `utils.geocoding`.
+    """
+    postal_code = models.CharField(max_length=6, primary_key=True)
+    lat = models.DecimalField("Latitude", max_digits=9, decimal_places=6)
+    long = models.DecimalField("Longitude", max_digits=9, decimal_places=6)
+
+    def __str__(self):
+        return "{} ({}, {})".format(self.postal_code, self.lat, self.long)
+
+
+class SearchToken(models.Model):
+    """A normalized word of a searchable field of a studio, or of one of its classes or amenities.
+
+    Maintained by `studios.search` whenever studios, classes, amenities or keywords change, so that searches
+    are prefix (range) lookups on an index, instead of scans of the searched tables.
+    """
+    STUDIO_NAME = "studio_name"
+    CLASS_NAME = "class_name"
+    COACH = "coach"
+    KEYWORD = "keyword"
+    AMENITY = "amenity"
+    KIND_CHOICES = [
+        (STUDIO_NAME, "Studio name"),
+        (CLASS_NAME, "Class name"),
+        (COACH, "Coach"),
+        (KEYWORD, "Class keyword"),
+        (AMENITY, "Amenity"),
+    ]
+
+    token = models.CharField(max_length=64)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    studio = models.ForeignKey("Studio", on_delete=models.CASCADE, related_name="search_tokens")
+    # Class that the token belongs to (if any)
+    related_class = models.ForeignKey("classes.Class", on_delete=models.CASCADE, null=True,
+                                      related_name="search_tokens")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["kind", "token"], name="studios_search_token_idx"),
+        ]
@@ -0,0 +1,122 @@
+import datetime
+import hashlib
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+def get_cache():
+    return caches[settings.STUDIO_CACHE["ALIAS"]]
+
+
+def version_key(studio_id):
+    return "studio:version:{}".format(studio_id)
+
+
+def get_version(cache, studio_id):
+    """Returns the current version of the studio's data, and when it started (as a timestamp).
+
+    Like users' schedules (see `accounts.schedule_cache`), changing a studio deletes its version, and
+    the next request starts a new, random one. This means that versions are never reused, even if the
+    cache is cleared. Versions also expire after `STUDIO_CACHE["VERSION_TIMEOUT"]`, which bounds how long
+    a process that doesn't share the cache of the one that changed the studio keeps serving stale data.
+    """
+    version = cache.get(version_key(studio_id))
+    if version is None:
+        version = (uuid.uuid4().hex, int(time.time()))
+        # Use add(), so that concurrent requests agree on the new version
+        if not cache.add(version_key(studio_id), version, timeout=settings.STUDIO_CACHE["VERSION_TIMEOUT"]):
+            version = cache.get(version_key(studio_id), version)
+    return version
+
+
+def invalidate_studios(studio_ids):
+    """Invalidates the cached responses (and ETags) of the given studios, once the current transaction commits.
+    """
+    keys = [version_key(studio_id) for studio_id in set(studio_ids)]
+    if keys:
+        transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+def current_minute():
+    return datetime.datetime.now().replace(second=0, microsecond=0)
+
+
+def response_etag(cache, request, studio_id, time_dependent):
+    """Returns the ETag of a response with the studio's data (see `StudioCacheMixin`), and when its data last
+    changed (as a timestamp).
+    """
+    version, modified = get_version(cache, studio_id)
+    parts = [version, request.build_absolute_uri()]
+    if time_dependent:
+        minute = current_minute()
+        parts.append(minute.isoformat())
+        modified = max(modified, int(time.mktime(minute.timetuple())))
+    return '"{}"'.format(hashlib.md5("\n".join(parts).encode()).hexdigest()), modified
+
+
+def response_key(etag):
+    return "studio:response:{}".format(etag)
+
+
+def add_validators(response, etag, modified):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(modified)
+    return response
+
+
+class StudioCacheMixin:
+    """Adds conditional GET support (and a shared response cache) to a view of a studio's data.
+
+    The ETag of a response is derived from the version of the studio (`kwargs["pk"]`) and the requested URL
+    (including query parameters), so a client's cached copy can be validated without computing anything.
+    Responses are also cached under their ETag, for every client. Responses must only depend on the studio
+    and the URL (not on the user).
+    """
+    # Whether responses depend on the time of day (schedules only list instances that haven't started yet).
+    # If so, ETags are only valid until the end of the minute.
+    time_dependent = False
+
+    def get(self, request, *args, **kwargs):
+        cache = get_cache()
+        etag, modified = response_etag(cache, request, kwargs["pk"], self.time_dependent)
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            data = cache.get(response_key(etag))
+            if data is None:
+                response = super().get(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(response_key(etag), response.data, timeout=settings.STUDIO_CACHE["TIMEOUT"])
+            else:
+                response = Response(data)
+        return add_validators(response, etag, modified)
+
+
+class AsyncStudioCacheMixin:
+    """`StudioCacheMixin` for async views (see `utils.async_views`). ETags and cached responses are shared
+    with the sync views.
+    """
+    time_dependent = False
+
+    async def get(self, request, *args, **kwargs):
+        cache = get_cache()
+        etag, modified = await sync_to_async(response_etag)(cache, request, kwargs["pk"], self.time_dependent)
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            data = await cache.aget(response_key(etag))
+            if data is None:
+                response = await super().get(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                await cache.aset(response_key(etag), response.data, timeout=settings.STUDIO_CACHE["TIMEOUT"])
+            else:
+                response = Response(data)
+        return add_validators(response, etag, modified)
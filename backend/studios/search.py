@@ -0,0 +1,58 @@
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from utils.search import prefix_range, studio_tokens, tokenize
+from .models import Studio, SearchToken
+
+# How much a match in each kind of field counts towards the rank of a result
+WEIGHTS = {
+    SearchToken.STUDIO_NAME: 4,
+    SearchToken.CLASS_NAME: 3,
+    SearchToken.KEYWORD: 2,
+    SearchToken.COACH: 2,
+    SearchToken.AMENITY: 1,
+}
+
+
+def index_studios(studio_ids):
+    """Rebuilds the search tokens of the given studios.
+    """
+    studios = Studio.objects.filter(pk__in=studio_ids).prefetch_related("classes__keywords", "amenities")
+    with transaction.atomic():
+        SearchToken.objects.filter(studio_id__in=studio_ids).delete()
+        SearchToken.objects.bulk_create([
+            SearchToken(kind=kind, token=token, studio=studio, related_class_id=class_id)
+            # Repeated words only need to be indexed once
+            for studio in studios for kind, token, class_id in set(studio_tokens(studio))
+        ])
+
+
+def matching_tokens(term, kinds):
+    start, end = prefix_range(term)
+    return SearchToken.objects.filter(kind__in=kinds, token__gte=start, token__lt=end)
+
+
+def search(queryset, text, kinds, key="studio_id", rank=False):
+    """Filters `queryset` to the results with a word starting with each word of `text`, in any of `kinds`.
+
+    `key` is the field of `SearchToken` that refers to the results (`studio_id` or `related_class_id`).
+    If `rank`, results are annotated with a `rank`, which is the weighted number of words that matched.
+    """
+    terms = tokenize(text)
+    for term in terms:
+        # Each term is a separate subquery, so that results never have duplicates (like they would with joins)
+        queryset = queryset.filter(pk__in=matching_tokens(term, kinds).values(key))
+    if not rank:
+        return queryset
+    if not terms:
+        return queryset.annotate(rank=Value(0))
+    weight = Case(*[When(kind=kind, then=Value(WEIGHTS[kind])) for kind in kinds], default=Value(0))
+    ranks = SearchToken.objects.filter(
+        reduce(or_, [Q(token__gte=start, token__lt=end) for start, end in map(prefix_range, terms)]),
+        kind__in=kinds, **{key: OuterRef("pk")}
+    ).order_by().values(key).annotate(rank=Sum(weight)).values("rank")
+    return queryset.annotate(rank=Coalesce(Subquery(ranks), 0))
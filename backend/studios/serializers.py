@@ -1,6 +1,8 @@
+from asgiref.sync import sync_to_async
 from rest_framework import serializers
 
-from classes.models import Class, ClassInstance
+from classes.models import Class, ClassInstance, Keyword
+from utils.images import thumbnail_urls, variant_urls
 from utils.validators import validate_postal_code, validate_lat, validate_long
 from .models import Studio, StudioImage, Amenity
 
@@ -26,14 +28,18 @@ class ClassInstanceSerializer(serializers.ModelSerializer):
 
 class StudioImageSerializer(serializers.ModelSerializer):
     path = serializers.SerializerMethodField()
+    variants = serializers.SerializerMethodField()
 
     class Meta:
         model = StudioImage
-        fields = ["path"]
+        fields = ["path", "variants"]
 
     def get_path(self, obj):
         return obj.image.url
 
+    def get_variants(self, obj):
+        return variant_urls(obj.image, obj.variants)
+
 
 class AmenitySerializer(serializers.ModelSerializer):
     class Meta:
@@ -50,8 +56,10 @@ class ClassSerializer(serializers.ModelSerializer):
     def get_user_enrolled(self, obj):
         return self.context.get("user_enrolled")
 
+    # Note: to avoid a query per class, querysets should use select_related("studio") and
+    # prefetch_related("keywords")
     def get_schedule(self, obj):
-        return [rule.to_text() for rule in obj.schedule.rrules]
+        return obj.schedule_text
 
     def get_studio(self, obj):
         return obj.studio.name
@@ -61,7 +69,7 @@ class ClassSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Class
-        fields = "__all__"
+        exclude = ["schedule_text", "occurrences_start", "occurrences_end", "created", "name_lower", "coach_lower"]
 
 
 class StudioSerializer(serializers.ModelSerializer):
@@ -88,6 +96,133 @@ class StudioSerializer(serializers.ModelSerializer):
         return fields
 
 
+class ProjectionSerializer:
+    """Read-only serializer for list endpoints, which builds plain dicts from the given objects without
+    constructing (and running) a DRF field per column for every row.
+
+    Subclasses list the `columns` they read (so that querysets can load them with `.only()`), and implement
+    `to_representation()`. `prepare()` can fetch related rows for all the objects at once.
+    """
+    columns = []
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    def prepare(self, objs):
+        pass
+
+    def to_representation(self, obj):
+        raise NotImplementedError
+
+    @property
+    def data(self):
+        objs = list(self.instance) if self.many else [self.instance]
+        self.prepare(objs)
+        data = [self.to_representation(obj) for obj in objs]
+        return data if self.many else data[0]
+
+    async def adata(self):
+        """`data`, for async views. The objects must already be loaded (e.g. a page), and `prepare()` runs
+        in a thread, since it may query the database.
+        """
+        objs = list(self.instance) if self.many else [self.instance]
+        await sync_to_async(self.prepare)(objs)
+        data = [self.to_representation(obj) for obj in objs]
+        return data if self.many else data[0]
+
+
+def decimal_to_string(value):
+    # Same format as (default) DRF decimal fields
+    return format(value, "f")
+
+
+def studio_thumbnails(studio_ids):
+    """The URLs of the thumbnail of the first image of each studio, by format (for list cards).
+    """
+    thumbnails = {}
+    # In reverse, so that the first image of each studio is the one that's kept
+    for image in StudioImage.objects.filter(studio_id__in=studio_ids).order_by("-pk") \
+            .only("studio_id", "image", "variants"):
+        thumbnails[image.studio_id] = thumbnail_urls(image.image, image.variants)
+    return thumbnails
+
+
+class StudioListSerializer(ProjectionSerializer):
+    """Studios in the nearby list (`StudioSerializer` without images, phone number, classes and amenities,
+    but with the thumbnail of their first image).
+    """
+    columns = ["id", "name", "address", "postal_code", "lat", "long"]
+
+    def prepare(self, objs):
+        self.thumbnails = studio_thumbnails([obj.id for obj in objs])
+
+    def to_representation(self, obj):
+        return {
+            "id": obj.id,
+            "name": obj.name,
+            "address": obj.address,
+            "postal_code": obj.postal_code,
+            "lat": decimal_to_string(obj.lat),
+            "long": decimal_to_string(obj.long),
+            "directions": "https://www.google.com/maps/place/{},{}/".format(obj.lat, obj.long),
+            "thumbnail": self.thumbnails.get(obj.id),
+        }
+
+
+class StudioSearchSerializer(ProjectionSerializer):
+    """Studios in search results (`StudioSerializer` without images, directions and location, but with the
+    thumbnail of their first image).
+
+    Their classes (with keywords) and amenities are fetched for all the studios at once, with `.values()`.
+    """
+    columns = ["id", "name", "address", "postal_code", "phone_num"]
+    class_columns = ["id", "studio_id", "schedule_text", "name", "description", "coach", "capacity", "enrolled",
+                     "start_time", "end_time"]
+
+    def prepare(self, objs):
+        studios = {obj.id: obj for obj in objs}
+        self.classes = {studio_id: [] for studio_id in studios}
+        self.amenities = {studio_id: [] for studio_id in studios}
+        classes = Class.objects.filter(studio_id__in=studios).order_by("pk").values(*self.class_columns)
+        keywords = {class_obj["id"]: [] for class_obj in classes}
+        for class_id, name in Keyword.objects.filter(related_class_id__in=keywords).order_by("pk") \
+                .values_list("related_class_id", "name"):
+            keywords[class_id].append(name)
+        for class_obj in classes:
+            self.classes[class_obj["studio_id"]].append({
+                "id": class_obj["id"],
+                "user_enrolled": None,
+                "schedule": class_obj["schedule_text"],
+                "studio": studios[class_obj["studio_id"]].name,
+                "keywords": keywords[class_obj["id"]],
+                "name": class_obj["name"],
+                "description": class_obj["description"],
+                "coach": class_obj["coach"],
+                "capacity": class_obj["capacity"],
+                "enrolled": class_obj["enrolled"],
+                "start_time": class_obj["start_time"].isoformat(),
+                "end_time": class_obj["end_time"].isoformat(),
+            })
+        for studio_id, amenity_type, quantity in Amenity.objects.filter(studio_id__in=studios).order_by("pk") \
+                .values_list("studio_id", "type", "quantity"):
+            self.amenities[studio_id].append({"type": amenity_type, "quantity": quantity})
+        self.thumbnails = studio_thumbnails(studios)
+
+    def to_representation(self, obj):
+        return {
+            "id": obj.id,
+            "name": obj.name,
+            "address": obj.address,
+            "postal_code": obj.postal_code,
+            "phone_num": obj.phone_num,
+            "classes": self.classes[obj.id],
+            "amenities": self.amenities[obj.id],
+            "thumbnail": self.thumbnails.get(obj.id),
+        }
+
+
 class LocationSerializer(serializers.Serializer):
     lat = serializers.DecimalField(max_digits=9, decimal_places=6, required=False,
                                    allow_null=True, validators=[validate_lat])
@@ -108,3 +243,44 @@ class LocationSerializer(serializers.Serializer):
 
     def update(self, instance, validated_data):
         pass
+
+
+class NearbySearchSerializer(serializers.Serializer):
+    radius = serializers.FloatField(required=False, min_value=0)
+    k = serializers.IntegerField(required=False, min_value=1)
+
+    def create(self, validated_data):
+        pass
+
+    def update(self, instance, validated_data):
+        pass
+
+
+class BulkEnrollmentItemSerializer(serializers.Serializer):
+    instance_id = serializers.IntegerField(required=False)
+    class_id = serializers.IntegerField(required=False)
+    date = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if "instance_id" in data or ("class_id" in data and "date" in data):
+            pass
+        else:
+            raise serializers.ValidationError("Either an instance id, or a class id and date, is required")
+        return data
+
+    def create(self, validated_data):
+        pass
+
+    def update(self, instance, validated_data):
+        pass
+
+
+class BulkEnrollmentSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=["enroll", "drop"])
+    items = BulkEnrollmentItemSerializer(many=True, allow_empty=False, max_length=100)
+
+    def create(self, validated_data):
+        pass
+
+    def update(self, instance, validated_data):
+        pass
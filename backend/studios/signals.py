@@ -0,0 +1,95 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from classes.models import Class, ClassInstance, Keyword
+from utils.images import register_variants, variants_ready
+from .models import Studio, Amenity, SearchToken, StudioImage
+from .response_cache import invalidate_studios
+from .search import index_studios
+
+# Fields of a class that are indexed for search
+SEARCHABLE_CLASS_FIELDS = {"name", "coach", "studio"}
+
+
+@receiver(post_save, sender=Studio)
+def studio_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or "name" in update_fields:
+        index_studios([instance.pk])
+
+
+@receiver(post_delete, sender=Studio)
+def studio_deleted(sender, instance, **kwargs):
+    # The studio's classes and amenities are deleted before it, and their receivers re-index it
+    SearchToken.objects.filter(studio_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Class)
+@receiver(post_delete, sender=Class)
+def class_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or SEARCHABLE_CLASS_FIELDS.intersection(update_fields):
+        # Include the studio that the class was indexed under, in case it has moved
+        studio_ids = set(SearchToken.objects.filter(related_class_id=instance.pk).values_list("studio_id", flat=True))
+        index_studios(studio_ids | {instance.studio_id})
+
+
+@receiver(post_save, sender=Amenity)
+@receiver(post_delete, sender=Amenity)
+def amenity_changed(sender, instance, **kwargs):
+    index_studios([instance.studio_id])
+
+
+@receiver(post_save, sender=Keyword)
+@receiver(post_delete, sender=Keyword)
+def keyword_changed(sender, instance, **kwargs):
+    index_studios(Class.objects.filter(pk=instance.related_class_id).values("studio_id"))
+
+
+# Fields that aren't shown by the cached studio views, so saving only these doesn't invalidate them
+UNCACHED_CLASS_FIELDS = {"occurrences_start", "occurrences_end"}
+UNCACHED_INSTANCE_FIELDS = {"enrolled"}
+
+
+@receiver(post_save, sender=Studio)
+@receiver(post_delete, sender=Studio)
+def studio_changed(sender, instance, **kwargs):
+    invalidate_studios([instance.pk])
+
+
+@receiver(post_save, sender=Class)
+@receiver(post_delete, sender=Class)
+def class_cache_changed(sender, instance, update_fields=None, created=False, **kwargs):
+    if update_fields is None or not UNCACHED_CLASS_FIELDS.issuperset(update_fields):
+        studio_ids = [instance.studio_id]
+        if kwargs["signal"] is post_save and not created:
+            # The class may have moved from another studio
+            studio_ids.append(instance.get_loaded_values()["studio_id"])
+        invalidate_studios(studio_ids)
+
+
+@receiver(post_save, sender=ClassInstance)
+@receiver(post_delete, sender=ClassInstance)
+def instance_cache_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or not UNCACHED_INSTANCE_FIELDS.issuperset(update_fields):
+        invalidate_studios(Class.objects.filter(pk=instance.parent_id).values_list("studio_id", flat=True))
+
+
+@receiver(post_save, sender=Amenity)
+@receiver(post_delete, sender=Amenity)
+@receiver(post_save, sender=StudioImage)
+@receiver(post_delete, sender=StudioImage)
+def studio_item_changed(sender, instance, **kwargs):
+    invalidate_studios([instance.studio_id])
+
+
+@receiver(post_save, sender=Keyword)
+@receiver(post_delete, sender=Keyword)
+def keyword_cache_changed(sender, instance, **kwargs):
+    invalidate_studios(Class.objects.filter(pk=instance.related_class_id).values_list("studio_id", flat=True))
+
+
+register_variants(StudioImage, "image", "variants")
+
+
+@receiver(variants_ready, sender=StudioImage)
+def studio_image_variants_ready(sender, pk, **kwargs):
+    invalidate_studios(StudioImage.objects.filter(pk=pk).values_list("studio_id", flat=True))
@@ -1 +1,875 @@
-# Create your tests here.
+import contextlib
+import datetime
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+import types
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import recurrence
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image as PILImage
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from classes.counters import reconcile_counters
+from classes.models import Class, ClassInstance, Keyword
+from accounts.models import Account, Subscription
+from studios.models import Studio, Amenity, PostalCodeLocation, StudioImage
+from studios.response_cache import get_cache
+from studios.serializers import StudioSerializer, StudioListSerializer, StudioSearchSerializer
+from utils.geo import great_circle_distance
+from utils.search import prefix_range
+from utils.geocoding import Geocoder, GeocoderUnavailable, Location, get_geocoder
+from utils.images import variant_name
+
+
+def create_studio(name="Studio", lat=43.6487, long=-79.3817):
+    return Studio.objects.create(name=name, address="1 King St W", lat=lat, long=long,
+                                 postal_code="M5H 1A1", phone_num="4165550100")
+
+
+def create_class(studio, name="Class", coach="Coach", start_time=datetime.time(23, 58),
+                 end_time=datetime.time(23, 59), capacity=10):
+    return Class.objects.create(
+        name=name, studio=studio, coach=coach, capacity=capacity, start_time=start_time, end_time=end_time,
+        schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)])
+    )
+
+
+def frozen_clock(now):
+    """Patches `datetime.date.today()` and `datetime.datetime.now()` in the modules that list schedules, so that
+    tests of schedules don't depend on the time of day (or on midnight passing while they run).
+    """
+    class FrozenDate(datetime.date):
+        @classmethod
+        def today(cls):
+            return now.date()
+
+    class FrozenDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now
+
+    clock = types.SimpleNamespace(**{name: getattr(datetime, name) for name in dir(datetime)
+                                     if not name.startswith("__")})
+    clock.date, clock.datetime = FrozenDate, FrozenDatetime
+    stack = contextlib.ExitStack()
+    for module in ("utils.instance_helpers", "accounts.schedule_cache", "classes.models", "studios.response_cache"):
+        stack.enter_context(mock.patch(module + ".datetime", clock))
+    return stack
+
+
+class StudioScheduleTests(TestCase):
+    def setUp(self):
+        self.today = datetime.date.today()
+        clock = frozen_clock(datetime.datetime.combine(self.today, datetime.time(12)))
+        clock.__enter__()
+        self.addCleanup(clock.close)
+        self.studio = create_studio()
+        self.client = APIClient()
+        get_cache().clear()
+
+    def get_schedule(self):
+        # Measure the view itself, rather than the response cache
+        get_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/studios/{}/schedule".format(self.studio.pk), {"range": 7, "limit": 500})
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_schedule_is_merged_in_order(self):
+        early = create_class(self.studio, name="Early", start_time=datetime.time(23, 0),
+                             end_time=datetime.time(23, 30))
+        late = create_class(self.studio, name="Late")
+        ClassInstance.objects.create(date=self.today + datetime.timedelta(days=1),
+                                     start_time=datetime.time(23, 10), end_time=datetime.time(23, 20),
+                                     special=True, parent=late)
+        data, _ = self.get_schedule()
+        keys = [(item["date"], item["start_time"]) for item in data["results"]]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(data["results"]), 2 * 8 + 1)
+        self.assertEqual([item["class_id"] for item in data["results"][:6]],
+                         [early.id, late.id, early.id, late.id, late.id, early.id])
+
+    def test_query_count_does_not_grow_with_classes(self):
+        create_class(self.studio)
+        _, baseline = self.get_schedule()
+        for i in range(5):
+            class_obj = create_class(self.studio, name="Class {}".format(i))
+            ClassInstance.objects.create(date=self.today + datetime.timedelta(days=1),
+                                         start_time=datetime.time(23, 0), end_time=datetime.time(23, 30),
+                                         special=True, parent=class_obj)
+        _, num_queries = self.get_schedule()
+        self.assertEqual(num_queries, baseline)
+
+    def test_cursor_pagination(self):
+        for i in range(3):
+            class_obj = create_class(self.studio, name="Class {}".format(i))
+            # Several instances at the same position, which must be split across pages
+            for _ in range(2):
+                ClassInstance.objects.create(date=self.today + datetime.timedelta(days=1),
+                                             start_time=datetime.time(23, 58), end_time=datetime.time(23, 59),
+                                             special=True, parent=class_obj)
+        expected, _ = self.get_schedule()
+
+        results = []
+        params = {"range": 7, "limit": 4, "cursor": ""}
+        while True:
+            response = self.client.get("/studios/{}/schedule".format(self.studio.pk), params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.data)
+            results.extend(response.data["results"])
+            if response.data["next"] is None:
+                break
+            self.assertLessEqual(len(response.data["results"]), 4)
+            params["cursor"] = response.data["next"].split("cursor=")[1]
+        self.assertEqual(results, expected["results"])
+
+        response = self.client.get("/studios/{}/schedule".format(self.studio.pk), {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.studio = create_studio()
+        self.class_obj = create_class(self.studio)
+        self.client = APIClient()
+        get_cache().clear()
+
+    def test_conditional_get(self):
+        url = "/studios/{}/details/".format(self.studio.pk)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+        # Other query parameters have their own ETag
+        response = self.client.get(url, {"format": "json"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # Responses are shared between clients
+        with self.assertNumQueries(0):
+            response = APIClient().get(url)
+        self.assertEqual(response["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Amenity.objects.create(type="Showers", quantity=2, studio=self.studio)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["amenities"], [{"type": "Showers", "quantity": 2}])
+
+    def test_versions_expire(self):
+        # Changes made by other processes aren't seen until then, unless the cache is shared
+        url = "/studios/{}/details/".format(self.studio.pk)
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with mock.patch("time.time", return_value=time.time() + settings.STUDIO_CACHE["VERSION_TIMEOUT"] + 1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch("studios.response_cache.current_minute",
+                return_value=datetime.datetime.combine(datetime.date.today(), datetime.time(0)))
+    def test_invalidation(self, current_minute):
+        urls = ["/studios/{}/schedule".format(self.studio.pk),
+                "/studios/{}/classes/{}/list".format(self.studio.pk, self.class_obj.pk),
+                "/studios/{}/classes/search".format(self.studio.pk)]
+        etags = [self.client.get(url)["ETag"] for url in urls]
+        # Enrollment counts aren't shown in schedules
+        instance = ClassInstance.objects.create(date=datetime.date.today() + datetime.timedelta(days=1),
+                                                start_time=datetime.time(23, 10), end_time=datetime.time(23, 20),
+                                                special=True, parent=self.class_obj)
+        get_cache().clear()
+        etags = [self.client.get(url)["ETag"] for url in urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.enrolled = 1
+            instance.save()
+        self.assertEqual([self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+                          for url, etag in zip(urls, etags)], [304] * 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.cancelled = True
+            instance.save()
+        responses = [self.client.get(url, HTTP_IF_NONE_MATCH=etag) for url, etag in zip(urls, etags)]
+        self.assertEqual([response.status_code for response in responses], [200] * 3)
+        self.assertNotIn(instance.start_time, [item["start_time"] for item in responses[0].data["results"]])
+
+
+class ClassSerializerTests(TestCase):
+    def setUp(self):
+        self.studio = create_studio()
+        self.client = APIClient()
+
+    def create_classes(self, n):
+        for i in range(n):
+            class_obj = create_class(self.studio, name="Class {}".format(i))
+            Keyword.objects.bulk_create([Keyword(name="keyword {}".format(j), related_class=class_obj)
+                                         for j in range(2)])
+
+    def get(self, url):
+        # Measure the views themselves, rather than the response cache
+        get_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"limit": 100})
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_query_count_does_not_grow_with_classes(self):
+        for url in ("/studios/{}/classes/search".format(self.studio.pk),
+                    "/studios/{}/details/".format(self.studio.pk),
+                    "/studios/search"):
+            with self.subTest(url=url):
+                Class.objects.all().delete()
+                self.create_classes(2)
+                _, baseline = self.get(url)
+                self.create_classes(50)
+                _, num_queries = self.get(url)
+                self.assertEqual(num_queries, baseline)
+
+    def test_schedule_text_is_cached(self):
+        class_obj = create_class(self.studio)
+        self.create_classes(10)
+        url = "/studios/{}/classes/search".format(self.studio.pk)
+        with mock.patch.object(recurrence.Rule, "to_text", autospec=True) as to_text:
+            data, _ = self.get(url)
+        to_text.assert_not_called()
+        self.assertEqual(data["results"][0]["schedule"], ["daily"])
+        self.assertEqual(data["results"][0]["keywords"], [])
+        self.assertEqual(data["results"][1]["keywords"], ["keyword 0", "keyword 1"])
+
+        class_obj.schedule = recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.WEEKLY)])
+        class_obj.save()
+        class_obj.refresh_from_db()
+        self.assertEqual(class_obj.schedule_text, ["weekly"])
+
+
+class ListStudiosTests(TestCase):
+    def setUp(self):
+        # Studios spread out from downtown Toronto, up to ~100km north-east
+        self.studios = [create_studio(name="Studio {}".format(i), lat=43.6487 + i * 0.04, long=-79.3817 + i * 0.03)
+                        for i in range(20)]
+        self.client = APIClient()
+
+    def get_nearby(self, **params):
+        response = self.client.get("/studios/nearby", {"lat": "43.650000", "long": "-79.380000", "limit": 100,
+                                                       **params})
+        self.assertEqual(response.status_code, 200)
+        return [studio["id"] for studio in response.data["results"]]
+
+    def expected(self):
+        return sorted(self.studios, key=lambda studio: great_circle_distance(43.65, -79.38, studio.lat, studio.long))
+
+    def test_radius(self):
+        expected = [studio.id for studio in self.expected()
+                    if great_circle_distance(43.65, -79.38, studio.lat, studio.long) <= 25]
+        self.assertEqual(self.get_nearby(radius=25), expected)
+
+    def test_k_nearest(self):
+        self.assertEqual(self.get_nearby(k=5), [studio.id for studio in self.expected()[:5]])
+        self.assertEqual(self.get_nearby(k=50), [studio.id for studio in self.expected()])
+
+    def test_unfiltered(self):
+        self.assertEqual(self.get_nearby(), [studio.id for studio in self.expected()])
+
+    def test_invalid_parameters(self):
+        response = self.client.get("/studios/nearby", {"lat": "43.65", "long": "-79.38", "k": "0"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/studios/nearby", {})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.yoga = create_studio(name="Downtown Yoga Café")
+        self.gym = create_studio(name="Uptown Gym")
+        for studio in (self.yoga, self.gym):
+            Amenity.objects.create(type="Showers", quantity=2, studio=studio)
+            Amenity.objects.create(type="Lockers", quantity=20, studio=studio)
+        self.spin = Class.objects.create(
+            name="Spin", studio=self.gym, coach="Yolanda", capacity=10,
+            start_time=datetime.time(10), end_time=datetime.time(11),
+            schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)])
+        )
+        Keyword.objects.create(name="cardio", related_class=self.spin)
+        self.client = APIClient()
+
+    def search_studios(self, **params):
+        response = self.client.get("/studios/search", params)
+        self.assertEqual(response.status_code, 200)
+        return [studio["id"] for studio in response.data["results"]]
+
+    def test_prefix(self):
+        self.assertEqual(self.search_studios(q="YOG"), [self.yoga.pk])
+        self.assertEqual(self.search_studios(q="cafe down"), [self.yoga.pk])
+        self.assertEqual(self.search_studios(q="yoga gym"), [])
+        self.assertEqual(prefix_range("yog"), ("yog", "yoh"))
+
+    def test_substring_filters(self):
+        # Unlike `q`, the `name` (and `coach`) filters match anywhere in the name
+        self.assertEqual(self.search_studios(name="town"), [self.yoga.pk, self.gym.pk])
+        self.assertEqual(self.search_studios(name="TOWN YOGA"), [self.yoga.pk])
+        response = self.client.get("/studios/{}/classes/search".format(self.gym.pk), {"coach": "land"})
+        self.assertEqual([class_obj["id"] for class_obj in response.data["results"]], [self.spin.pk])
+
+    def test_ranking(self):
+        # A studio name match outranks a coach match
+        self.assertEqual(self.search_studios(q="yo"), [self.yoga.pk, self.gym.pk])
+        self.assertEqual(self.search_studios(q="cardio"), [self.gym.pk])
+
+    def test_no_duplicates(self):
+        self.assertEqual(self.search_studios(amenities=["showers", "lockers"]), [self.yoga.pk, self.gym.pk])
+        self.assertEqual(self.search_studios(q="town"), [])
+
+    def test_case_insensitive_filters(self):
+        self.assertEqual(self.search_studios(coaches="YOLANDA", amenities="showers"), [self.gym.pk])
+        Amenity.objects.create(type="Sauna", quantity=1, studio=self.yoga)
+        self.spin.name = "Spin Cycle"
+        self.spin.save()
+        # Backends without expression indexes compare against the stored lowercase copy instead
+        with mock.patch.object(connection.features, "supports_expression_indexes", False), \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.search_studios(amenities="SAUNA"), [self.yoga.pk])
+            self.assertEqual(self.search_studios(classes="spin cycle"), [self.gym.pk])
+        self.assertIn('"type_lower" IN', queries[0]["sql"])
+        self.assertNotIn("LOWER(", queries[0]["sql"])
+
+    def test_search_classes(self):
+        response = self.client.get("/studios/{}/classes/search".format(self.gym.pk), {"q": "card"})
+        self.assertEqual([class_obj["id"] for class_obj in response.data["results"]], [self.spin.pk])
+        response = self.client.get("/studios/{}/classes/search".format(self.gym.pk), {"coach": "spin"})
+        self.assertEqual(response.data["results"], [])
+
+    def test_reindex(self):
+        self.gym.name = "Midtown Pilates"
+        self.gym.save()
+        self.assertEqual(self.search_studios(name="pilates"), [self.gym.pk])
+        self.spin.studio = self.yoga
+        self.spin.save()
+        self.assertEqual(self.search_studios(q="cardio"), [self.yoga.pk])
+        self.spin.delete()
+        self.assertEqual(self.search_studios(q="cardio"), [])
+
+
+class StudioProjectionTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            studio = create_studio(name="Studio {}".format(i), lat=43.6487 + i * 0.01)
+            Amenity.objects.create(type="Showers", quantity=i, studio=studio)
+            for j in range(2):
+                class_obj = Class.objects.create(
+                    name="Class {}".format(j), studio=studio, coach="Coach", capacity=10,
+                    start_time=datetime.time(10, 30), end_time=datetime.time(11),
+                    schedule=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.WEEKLY, byday=[0, 2])])
+                )
+                Keyword.objects.create(name="keyword {}".format(j), related_class=class_obj)
+        self.client = APIClient()
+
+    def assertSameData(self, projection, exclude_fields, queryset):
+        expected = StudioSerializer(queryset.prefetch_related("images", "amenities", "classes__keywords"),
+                                    many=True, context={"exclude_fields": exclude_fields}).data
+        with self.assertNumQueries(2 if projection is StudioListSerializer else 5):
+            data = projection(queryset.only(*projection.columns), many=True).data
+        for studio in data:
+            # Projections also have the thumbnail of the studio
+            self.assertIsNone(studio.pop("thumbnail"))
+        self.assertEqual(JSONRenderer().render(data), JSONRenderer().render(expected))
+
+    def test_list(self):
+        self.assertSameData(StudioListSerializer, ["images", "phone_num", "classes", "amenities"],
+                            Studio.objects.order_by("name"))
+
+    def test_search(self):
+        self.assertSameData(StudioSearchSerializer, ["images", "directions", "lat", "long"],
+                            Studio.objects.order_by("name"))
+
+    def test_views(self):
+        response = self.client.get("/studios/search", {"amenities": "showers"})
+        self.assertEqual([studio["name"] for studio in response.data["results"]],
+                         ["Studio 0", "Studio 1", "Studio 2"])
+        self.assertEqual(response.data["results"][0]["classes"][0]["keywords"], ["keyword 0"])
+        response = self.client.get("/studios/nearby", {"lat": "43.648700", "long": "-79.381700", "k": 1})
+        self.assertEqual(response.data["results"][0]["lat"], "43.648700")
+
+
+class ImageVariantsTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        variants = {"SIZES": {"thumbnail": 160, "card": 480}, "FORMATS": ["webp", "jpeg"], "QUALITY": 80,
+                    "WORKERS": 0}
+        settings = override_settings(MEDIA_ROOT=media_root.name, IMAGE_VARIANTS=variants)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.studio = create_studio()
+        self.client = APIClient()
+        get_cache().clear()
+
+    @staticmethod
+    def upload(width, height):
+        buffer = io.BytesIO()
+        PILImage.new("RGB", (width, height), "orange").save(buffer, "JPEG")
+        return SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+    def test_variants(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            image = StudioImage.objects.create(image=self.upload(2000, 1000), studio=self.studio)
+        # Until the variants are generated, the original is used
+        response = self.client.get("/studios/{}/details/".format(self.studio.pk))
+        self.assertEqual(response.data["images"][0]["variants"]["card"]["webp"], image.image.url)
+
+        for callback in callbacks:
+            callback()
+        image.refresh_from_db()
+        self.assertEqual(image.variants["source"], image.image.name)
+        for size, width, height in (("thumbnail", 160, 80), ("card", 480, 240)):
+            for fmt in ("webp", "jpeg"):
+                with image.image.storage.open(image.variants["sizes"][size][fmt]) as f, PILImage.open(f) as variant:
+                    self.assertEqual(variant.size, (width, height))
+                    self.assertEqual(variant.format, fmt.upper())
+
+        get_cache().clear()
+        response = self.client.get("/studios/{}/details/".format(self.studio.pk))
+        self.assertEqual(response.data["images"][0]["path"], image.image.url)
+        self.assertTrue(response.data["images"][0]["variants"]["thumbnail"]["jpeg"].endswith("_160.jpg"))
+        response = self.client.get("/studios/search")
+        self.assertTrue(response.data["results"][0]["thumbnail"]["webp"].endswith("_160.webp"))
+
+        # Saving without changing the image doesn't regenerate them
+        with mock.patch("utils.images.schedule_variants") as schedule_variants:
+            image.save()
+        schedule_variants.assert_not_called()
+
+    def test_changed_sizes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = StudioImage.objects.create(image=self.upload(2000, 1000), studio=self.studio)
+        image.refresh_from_db()
+
+        # Sizes without variants yet use the original, and the smallest size is used if there's no thumbnail
+        with self.settings(IMAGE_VARIANTS={**settings.IMAGE_VARIANTS, "SIZES": {"small": 240, "card": 480}}):
+            response = self.client.get("/studios/search")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["results"][0]["thumbnail"]["webp"], image.image.url)
+            response = self.client.get("/studios/{}/details/".format(self.studio.pk))
+            self.assertEqual(set(response.data["images"][0]["variants"]), {"small", "card"})
+            self.assertTrue(response.data["images"][0]["variants"]["card"]["webp"].endswith("_480.webp"))
+
+    def test_small_images_are_not_enlarged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = StudioImage.objects.create(image=self.upload(100, 50), studio=self.studio)
+        image.refresh_from_db()
+        with image.image.storage.open(image.variants["sizes"]["card"]["jpeg"]) as f, PILImage.open(f) as variant:
+            self.assertEqual(variant.size, (100, 50))
+
+    def test_names(self):
+        self.assertEqual(variant_name("studios/gym.jpg", "card", "webp"), "variants/studios/gym_jpg_480.webp")
+        self.assertNotEqual(variant_name("studios/gym.png", "card", "webp"),
+                            variant_name("studios/gym.jpg", "card", "webp"))
+
+    def test_replaced_and_deleted_images(self):
+        def exist(variants):
+            return [image.image.storage.exists(name) for formats in variants["sizes"].values()
+                    for name in formats.values()]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image = StudioImage.objects.create(image=self.upload(100, 50), studio=self.studio)
+        image.refresh_from_db()
+        first = image.variants
+        self.assertEqual(exist(first), [True] * 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.image = self.upload(200, 100)
+            image.save()
+        image.refresh_from_db()
+        self.assertEqual(exist(first), [False] * 4)
+        self.assertEqual(exist(image.variants), [True] * 4)
+
+        second = image.variants
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertEqual(exist(second), [False] * 4)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.studio = create_studio()
+        create_class(self.studio)
+        self.client = APIClient()
+        get_cache().clear()
+
+    def timings(self, response):
+        timings = {}
+        for metric in response["Server-Timing"].split(", "):
+            name, duration = metric.split(";")[:2]
+            timings[name] = float(duration[len("dur="):])
+        return timings
+
+    @override_settings(PROFILING={"SAMPLE_RATE": 1, "PROFILE_SAMPLE_RATE": 0, "PROFILE_DIR": "",
+                                  "EXPOSE_HEADER": True})
+    def test_timings(self):
+        with self.assertLogs("utils.profiling", level="INFO") as logs:
+            response = self.client.get("/studios/{}/classes/search".format(self.studio.pk))
+        self.assertEqual(set(self.timings(response)), {"total", "db", "serialize"})
+        record = logs.records[0]
+        self.assertEqual((record.view, record.status), ("studios:search_classes", 200))
+        self.assertGreater(record.queries, 0)
+        self.assertIn('desc="{} queries"'.format(record.queries), response["Server-Timing"])
+
+        # Expanding recurrences that haven't been materialized
+        with self.assertLogs("utils.profiling", level="INFO") as logs:
+            response = self.client.get("/studios/{}/schedule".format(self.studio.pk), {"range": 400})
+        self.assertIn("rrule", self.timings(response))
+        self.assertIn("rrule", logs.records[0].timings_ms)
+
+    @override_settings(PROFILING={"SAMPLE_RATE": 0, "PROFILE_SAMPLE_RATE": 0, "PROFILE_DIR": "",
+                                  "EXPOSE_HEADER": True})
+    def test_unsampled(self):
+        response = self.client.get("/studios/{}/classes/search".format(self.studio.pk))
+        self.assertNotIn("Server-Timing", response)
+
+    @override_settings(PROFILING={"SAMPLE_RATE": 1, "PROFILE_SAMPLE_RATE": 0, "PROFILE_DIR": "",
+                                  "EXPOSE_HEADER": False})
+    def test_hidden_header(self):
+        # Timings are still logged, but not sent to clients
+        with self.assertLogs("utils.profiling", level="INFO"):
+            response = self.client.get("/studios/{}/classes/search".format(self.studio.pk))
+        self.assertNotIn("Server-Timing", response)
+
+    def test_profiles(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(PROFILING={"SAMPLE_RATE": 1, "PROFILE_SAMPLE_RATE": 1, "PROFILE_DIR": directory,
+                                             "EXPOSE_HEADER": False}):
+            self.client.get("/studios/{}/details/".format(self.studio.pk))
+            self.assertEqual(len(os.listdir(os.path.join(directory, "studios.studio_details"))), 1)
+
+
+class CountingGeocoder(Geocoder):
+    """Local stand-in for the MapBox geocoder, which counts how often it is called.
+    """
+    calls = 0
+
+    def __init__(self, available=True):
+        self.available = available
+
+    def geocode(self, postal_code):
+        CountingGeocoder.calls += 1
+        if not self.available:
+            raise GeocoderUnavailable("Offline")
+        return Location(43.6487, -79.3817) if postal_code == "M5H1A1" else None
+
+
+@override_settings(GEOCODER={"BACKEND": "studios.tests.CountingGeocoder"})
+class GeocoderTests(TestCase):
+    def setUp(self):
+        CountingGeocoder.calls = 0
+
+    def test_repeat_lookups_are_cached(self):
+        self.assertEqual(tuple(get_geocoder().geocode("m5h 1a1")), (43.6487, -79.3817))
+        self.assertEqual(tuple(get_geocoder().geocode("M5H1A1")), (43.6487, -79.3817))
+        self.assertEqual(CountingGeocoder.calls, 1)
+        self.assertTrue(PostalCodeLocation.objects.filter(pk="M5H1A1").exists())
+
+        # A new process should find the location in the database instead
+        get_geocoder().clear()
+        get_geocoder().geocode("M5H 1A1")
+        self.assertEqual(CountingGeocoder.calls, 1)
+
+    @override_settings(GEOCODER={"BACKEND": "studios.tests.CountingGeocoder", "OPTIONS": {"available": False}})
+    def test_preloaded_locations_work_offline(self):
+        with self.assertRaises(GeocoderUnavailable):
+            get_geocoder().geocode("M4W 1A8")
+        PostalCodeLocation.objects.create(postal_code="M4W", lat=43.68, long=-79.38)
+        location = get_geocoder().geocode("M4W 1A8")
+        self.assertEqual(tuple(location), (43.68, -79.38))
+
+    def test_nearby_postal_code(self):
+        create_studio()
+        response = APIClient().get("/studios/nearby", {"postal_code": "M5H 1A1", "k": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 1)
+        response = APIClient().get("/studios/nearby", {"postal_code": "A1A 1A1"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_load_postal_codes(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as file:
+            file.write("FSA,Latitude,Longitude\nM5V,43.6426,-79.3871\nm4w,43.68,-79.38\n")
+        try:
+            call_command("load_postal_codes", file.name, stdout=io.StringIO())
+        finally:
+            os.remove(file.name)
+        self.assertEqual(set(PostalCodeLocation.objects.values_list("postal_code", flat=True)), {"M5V", "M4W"})
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.studios = [create_studio(name="Studio {}".format(i), lat=43.6487 + i * 0.04, long=-79.3817 + i * 0.03)
+                        for i in range(10)]
+        self.studio = self.studios[0]
+        self.client = APIClient()
+        get_cache().clear()
+
+    def get(self, path, params=None, **headers):
+        """Requests `path` from both the sync view and its async variant, and checks that the responses match.
+        """
+        expected = self.client.get("/studios/" + path, params)
+        get_cache().clear()
+        response = self.aget("/async/studios/" + path, params, **headers)
+        self.assertEqual(response.status_code, expected.status_code)
+        if response.status_code == 200:
+            # Pagination links point at the async variant
+            self.assertEqual(response.content.replace(b"/async/", b"/"), expected.content)
+        return response
+
+    def aget(self, path, params=None, **headers):
+        async def get():
+            return await self.async_client.get(path, params, **headers)
+        return async_to_sync(get)()
+
+    def test_nearby(self):
+        self.get("nearby", {"lat": "43.650000", "long": "-79.380000", "k": 5})
+        self.get("nearby", {"lat": "43.650000", "long": "-79.380000", "radius": 25})
+        response = self.get("nearby", {"lat": "43.650000", "long": "-79.380000", "limit": 100})
+        self.assertEqual(len(response.json()["results"]), 10)
+        self.get("nearby", {"lat": "43.65", "long": "-79.38", "k": "0"})
+
+    @override_settings(GEOCODER={"BACKEND": "studios.tests.CountingGeocoder"})
+    def test_nearby_postal_code(self):
+        response = self.get("nearby", {"postal_code": "M5H 1A1", "k": 1})
+        self.assertEqual(response.json()["results"][0]["id"], self.studio.id)
+        self.get("nearby", {"postal_code": "A1A 1A1"})
+
+    def test_search(self):
+        response = self.get("search", {"q": "studio"})
+        self.assertEqual(response.json()["count"], 10)
+        self.get("search", {"q": "studio 3", "limit": 2})
+
+    def test_schedule(self):
+        create_class(self.studio, name="Early", start_time=datetime.time(23, 0), end_time=datetime.time(23, 30))
+        late = create_class(self.studio, name="Late")
+        ClassInstance.objects.create(date=datetime.date.today() + datetime.timedelta(days=1),
+                                     start_time=datetime.time(23, 10), end_time=datetime.time(23, 20),
+                                     special=True, parent=late)
+        # Expand the schedule from its rules, rather than from the stored occurrences
+        unexpanded = create_class(self.studio, name="Unexpanded")
+        Class.objects.filter(pk=unexpanded.pk).update(occurrences_start=None, occurrences_end=None)
+
+        path = "{}/schedule".format(self.studio.pk)
+        response = self.get(path, {"range": 7, "limit": 500})
+        self.assertGreater(len(response.json()["results"]), 3 * 6)
+        self.get(path, {"range": 7, "limit": 4, "page": 2})
+
+        params = {"range": 7, "limit": 4, "cursor": ""}
+        for _ in range(3):
+            response = self.get(path, params)
+            params["cursor"] = response.json()["next"].split("cursor=")[1]
+        self.get(path, {"cursor": "invalid"})
+        self.get("0/schedule")
+
+    def test_conditional_get(self):
+        class_obj = create_class(self.studio)
+        path = "/async/studios/{}/schedule".format(self.studio.pk)
+        etag = self.aget(path).headers["ETag"]
+        self.assertEqual(self.aget(path, **{"if-none-match": etag}).status_code, 304)
+        # The studio's version is shared with the sync views, so changes invalidate both
+        with self.captureOnCommitCallbacks(execute=True):
+            class_obj.name = "Renamed"
+            class_obj.save()
+        self.assertEqual(self.aget(path, **{"if-none-match": etag}).status_code, 200)
+
+
+class BulkEnrollmentTests(TestCase):
+    def setUp(self):
+        self.studio = create_studio()
+        self.class_obj = create_class(self.studio, capacity=1)
+        self.other_class = create_class(self.studio, name="Other")
+        self.instance = ClassInstance.objects.create(
+            date=datetime.date.today() + datetime.timedelta(days=1), start_time=datetime.time(10),
+            end_time=datetime.time(11), special=True, parent=self.class_obj
+        )
+        subscription = Subscription.objects.create(billing_cycle="MONTHLY", charge=10)
+        self.user = Account.objects.create(email="user@email.com", subscription=subscription)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, action, items):
+        return self.client.post("/studios/enroll", {"action": action, "items": items}, format="json")
+
+    def test_enroll_and_drop(self):
+        date = datetime.date.today() + datetime.timedelta(days=2)
+        items = [
+            {"instance_id": self.instance.pk},
+            {"class_id": self.other_class.pk, "date": date.isoformat()},
+            {"class_id": self.other_class.pk, "date": date.isoformat()},
+            {"instance_id": 0},
+        ]
+        response = self.post("enroll", items)
+        self.assertEqual(response.status_code, 200)
+        statuses = [result["status"] for result in response.data["results"]]
+        self.assertEqual(statuses, ["enrolled", "enrolled", "unchanged", "error"])
+
+        # The missing non-special instance was created
+        created = ClassInstance.objects.get(parent=self.other_class, date=date, special=False)
+        self.assertEqual(response.data["results"][1]["instance_id"], created.pk)
+        self.assertEqual(set(self.user.enrolled_instances.all()), {self.instance, created})
+        self.instance.refresh_from_db()
+        created.refresh_from_db()
+        self.assertEqual((self.instance.enrolled, created.enrolled), (1, 1))
+
+        response = self.post("drop", items[:2])
+        self.assertEqual([result["status"] for result in response.data["results"]], ["dropped", "dropped"])
+        self.assertFalse(self.user.enrolled_instances.exists())
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.enrolled, 0)
+
+    def test_capacity(self):
+        other_user = Account.objects.create(email="other@email.com", subscription=self.user.subscription)
+        other_user.enrolled_instances.add(self.instance)
+        ClassInstance.objects.filter(pk=self.instance.pk).update(enrolled=1)
+        response = self.post("enroll", [{"instance_id": self.instance.pk}])
+        self.assertEqual(response.data["results"][0]["status"], "error")
+        self.assertFalse(self.user.enrolled_instances.exists())
+
+        # A duplicate of an item that failed is tried again, rather than reported as unchanged
+        response = self.post("enroll", [{"instance_id": self.instance.pk}] * 2)
+        self.assertEqual([result["status"] for result in response.data["results"]], ["error", "error"])
+        self.user.classes.add(self.class_obj)
+        self.user.dropped_instances.add(self.instance)
+        response = self.post("enroll", [{"instance_id": self.instance.pk}] * 2)
+        self.assertEqual([result["status"] for result in response.data["results"]], ["error", "error"])
+        self.assertIn(self.instance, self.user.dropped_instances.all())
+
+    def test_parent_enrollment(self):
+        self.user.classes.add(self.class_obj)
+        response = self.post("drop", [{"instance_id": self.instance.pk}])
+        self.assertEqual(response.data["results"][0]["status"], "dropped")
+        self.assertIn(self.instance, self.user.dropped_instances.all())
+        response = self.post("enroll", [{"instance_id": self.instance.pk}])
+        self.assertEqual(response.data["results"][0]["status"], "enrolled")
+        self.assertFalse(self.user.dropped_instances.exists())
+
+    def test_created_instance_pks(self):
+        date = datetime.date.today() + datetime.timedelta(days=2)
+        items = [{"class_id": self.other_class.pk, "date": date.isoformat()},
+                 {"class_id": self.class_obj.pk, "date": date.isoformat()}]
+        # Backends that can't return the primary keys of bulk inserts look them up instead
+        with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert", False):
+            response = self.post("enroll", items)
+        created = [ClassInstance.objects.get(parent_id=item["class_id"], date=date, special=False).pk
+                   for item in items]
+        self.assertEqual([result["instance_id"] for result in response.data["results"]], created)
+        self.assertEqual(set(self.user.enrolled_instances.values_list("pk", flat=True)), set(created))
+
+    def test_unscheduled_date(self):
+        self.other_class.schedule = recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.WEEKLY)],
+                                                          dtstart=datetime.datetime.combine(
+                                                              datetime.date.today(), datetime.time(0)))
+        self.other_class.save()
+        date = datetime.date.today() + datetime.timedelta(days=3)
+        response = self.post("enroll", [{"class_id": self.other_class.pk, "date": date.isoformat()}])
+        self.assertEqual(response.data["results"][0]["status"], "error")
+        self.assertFalse(ClassInstance.objects.filter(parent=self.other_class, date=date).exists())
+
+    def test_invalid_item(self):
+        response = self.post("enroll", [{"class_id": self.other_class.pk}])
+        self.assertEqual(response.status_code, 400)
+
+
+class NonSpecialInstanceTests(TestCase):
+    def setUp(self):
+        self.studio = create_studio()
+        self.class_obj = create_class(self.studio, capacity=2)
+        subscription = Subscription.objects.create(billing_cycle="MONTHLY", charge=10)
+        self.users = [Account.objects.create(email="user{}@email.com".format(i), subscription=subscription)
+                      for i in range(3)]
+        self.client = APIClient()
+
+    def test_created_instances_count_class_enrollees(self):
+        self.client.force_authenticate(self.users[0])
+        response = self.client.patch("/studios/{}/classes/{}/".format(self.studio.pk, self.class_obj.pk))
+        self.assertEqual(response.status_code, 200)
+
+        url = "/studios/{}/classes/{}/ns/{}/".format(self.studio.pk, self.class_obj.pk,
+                                                     datetime.date.today() + datetime.timedelta(days=1))
+        self.client.force_authenticate(self.users[1])
+        response = self.client.patch(url)
+        self.assertEqual(response.status_code, 200)
+        instance = ClassInstance.objects.get(parent=self.class_obj, special=False)
+        self.assertEqual(instance.enrolled, 2)
+        self.assertEqual(reconcile_counters(fix=False), [])
+        # Which fills the instance
+        self.client.force_authenticate(self.users[2])
+        response = self.client.patch(url)
+        self.assertNotEqual(response.status_code, 200)
+        self.assertFalse(self.users[2].enrolled_instances.exists())
+
+
+class ConcurrentEnrollmentTests(TransactionTestCase):
+    """Fires many simultaneous enrollments at the same instance from a pool of threads, and checks that the
+    instance is never oversold.
+    """
+    users = 200
+    threads = 25
+    capacity = 30
+
+    def setUp(self):
+        self.studio = create_studio()
+        self.class_obj = create_class(self.studio, capacity=self.capacity)
+        self.instance = ClassInstance.objects.create(
+            date=datetime.date.today() + datetime.timedelta(days=1), start_time=datetime.time(10),
+            end_time=datetime.time(11), special=True, parent=self.class_obj
+        )
+        subscription = Subscription.objects.create(billing_cycle="MONTHLY", charge=10)
+        Account.objects.bulk_create([Account(email="user{}@email.com".format(i), subscription=subscription)
+                                     for i in range(self.users)])
+        self.url = "/studios/{}/classes/{}/{}/".format(self.studio.pk, self.class_obj.pk, self.instance.pk)
+
+    def enroll(self, user, start):
+        """Enrolls `user` in the instance, returning whether they were enrolled.
+        """
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            start.wait()
+            while True:
+                try:
+                    return client.patch(self.url).status_code == 200
+                except OperationalError:
+                    # SQLite only allows a single writer, so (like a real client would) check whether the
+                    # enrollment went through anyway, and retry if it didn't
+                    if self.retry(client.get, self.url).data["user_enrolled"]:
+                        return True
+        finally:
+            connections.close_all()
+
+    @staticmethod
+    def retry(request, *args):
+        while True:
+            try:
+                return request(*args)
+            except OperationalError:
+                time.sleep(random.uniform(0, 0.01))
+
+    def test_no_overselling(self):
+        users = list(Account.objects.all())
+        start = threading.Event()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = [executor.submit(self.enroll, user, start) for user in users]
+            start.set()
+            enrolled = [future.result() for future in futures]
+
+        self.instance.refresh_from_db()
+        self.assertEqual(enrolled.count(True), self.capacity)
+        self.assertEqual(self.instance.enrolled, self.capacity)
+        self.assertEqual(self.instance.enrolled_users.count(), self.capacity)
@@ -1,13 +1,15 @@
 from django.urls import path
 
 from .views import ListStudios, StudioDetails, ListInstances, InstanceDetails, \
-    HandleNonSpecial, StudioSchedule, ClassDetails, SearchStudios, SearchClasses
+    HandleNonSpecial, StudioSchedule, ClassDetails, SearchStudios, SearchClasses, BulkEnrollment, AsyncListStudios, \
+    AsyncSearchStudios, AsyncStudioSchedule
 
 app_name = "studios"
 
 urlpatterns = [
     path("nearby", ListStudios.as_view(), name="nearby"),
     path("search", SearchStudios.as_view(), name="search_studios"),
+    path("enroll", BulkEnrollment.as_view(), name="bulk_enroll"),
     path("<int:pk>/details/", StudioDetails.as_view(), name="studio_details"),
     path("<int:pk>/classes/search", SearchClasses.as_view(), name="search_classes"),
     path("<int:pk>/classes/<int:class_id>/", ClassDetails.as_view(), name="class_details"),
@@ -16,3 +18,10 @@ urlpatterns = [
     path("<int:pk>/classes/<int:class_id>/ns/<str:date>/", HandleNonSpecial.as_view(), name="handle_non_special"),
     path("<int:pk>/schedule", StudioSchedule.as_view(), name="schedule")
 ]
+
+# Async variants (see tfc/urls.py)
+async_urlpatterns = [
+    path("nearby", AsyncListStudios.as_view(), name="nearby"),
+    path("search", AsyncSearchStudios.as_view(), name="search_studios"),
+    path("<int:pk>/schedule", AsyncStudioSchedule.as_view(), name="schedule"),
+]
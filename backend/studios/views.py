@@ -1,70 +1,94 @@
 import datetime
+import math
 
+from django.db import connection, transaction
 from django.db.models import F
 from django.db.models.expressions import RawSQL
 from django.shortcuts import get_object_or_404
-from geopy import MapBox
 from rest_framework import generics, status
-from rest_framework.exceptions import NotFound, PermissionDenied, ParseError
+from rest_framework.exceptions import NotFound, PermissionDenied, ParseError, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from classes.models import Class, ClassInstance
-from utils.instance_helpers import get_all_instances, ClassInstancePaginator
+from classes.models import Class, ClassInstance, Occurrence
+from utils.async_views import AsyncListAPIView, AsyncRetrieveAPIView
+from utils.geo import EARTH_RADIUS, NEARBY_INITIAL_RADIUS, bounding_box, grid_cells, great_circle_distance
+from utils.geocoding import get_geocoder, GeocoderUnavailable
+from utils.instance_helpers import get_all_instances, iter_class_instances, aiter_class_instances, instance_key, \
+    ClassInstancePaginator
 from utils.pagination import LimitPageNumberPagination
-from .models import Studio
-from .serializers import StudioSerializer, LocationSerializer, ClassSerializer, ClassInstanceSerializer
+from utils.profiling import ProfiledViewMixin
+from .models import Studio, Amenity, SearchToken
+from .response_cache import AsyncStudioCacheMixin, StudioCacheMixin
+from .search import WEIGHTS, search
+from .serializers import StudioSerializer, LocationSerializer, NearbySearchSerializer, ClassSerializer, \
+    ClassInstanceSerializer, BulkEnrollmentSerializer, StudioListSerializer, StudioSearchSerializer
 
 
 # Create your views here.
 
 
-class ListStudios(generics.ListAPIView):
-    serializer_class = StudioSerializer
+class ListStudios(ProfiledViewMixin, generics.ListAPIView):
+    serializer_class = StudioListSerializer
     pagination_class = LimitPageNumberPagination
 
-    def get_serializer_context(self):
-        context = super(ListStudios, self).get_serializer_context()
-        context["exclude_fields"] = ["images", "phone_num", "classes", "amenities"]
-        return context
-
     def get_queryset(self):
-        request = self.request
+        location = self.parse_location(self.request)
+        if isinstance(location, str):
+            try:
+                location = self.check_location(get_geocoder().geocode(location))
+            except GeocoderUnavailable as err:
+                raise ParseError(detail=str(err))
+        lat, long = location
+
+        # If we are here, we have a lat and long value
+        search = self.parse_search(self.request)
+        if "radius" in search or "k" in search:
+            return self.get_nearby(lat, long, search.get("radius"), search.get("k"))
+        return self.by_distance(lat, long)
+
+    @staticmethod
+    def parse_location(request):
+        """Returns the requested (lat, long), or the requested postal code (to be geocoded).
+        """
         if request.query_params.get("lat") and request.query_params.get("long"):
             location = LocationSerializer(data={
                 "lat": request.query_params.get("lat"),
                 "long": request.query_params.get("long")
             })
             if location.is_valid():
-                lat = location.data["lat"]
-                long = location.data["long"]
-            else:
-                return Response(location.errors, status=status.HTTP_400_BAD_REQUEST)
+                return location.data["lat"], location.data["long"]
+            raise ValidationError(location.errors)
         elif request.query_params.get("postal_code"):
             location = LocationSerializer(data={
                 "postal_code": request.query_params.get("postal_code")
             })
             if location.is_valid():
-                # TODO: Use environment variables so this doesn't get exposed in the git repo
-                geolocator = MapBox(
-                    api_key="pk.eyJ1IjoiMWl6YXJkbyIsImEiOiJjbGFoOHFtZ2owNzV6M3ZuNTkyamVkeWozIn0.2LLzH1LNQYbi-O1upIKLGQ"
-                )
-                try:
-                    loc = geolocator.geocode(query="{}, Canada".format(location.data["postal_code"]), exactly_one=True)
-                    if loc is None:
-                        return Response({"detail": "No matching location found."}, status=status.HTTP_404_NOT_FOUND)
-                    lat = loc.latitude
-                    long = loc.longitude
-                except Exception as err:
-                    return Response(err, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                return Response(location.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            location = LocationSerializer(data={})
-            if not location.is_valid():
-                return Response(location.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        # If we are here, we have a lat and long value
+                return location.data["postal_code"]
+            raise ValidationError(location.errors)
+        location = LocationSerializer(data={})
+        location.is_valid()
+        raise ValidationError(location.errors)
+
+    @staticmethod
+    def check_location(loc):
+        if loc is None:
+            raise NotFound(detail="No matching location found.")
+        return loc.lat, loc.long
+
+    @staticmethod
+    def parse_search(request):
+        search = NearbySearchSerializer(data={
+            key: request.query_params.get(key) for key in ("radius", "k") if request.query_params.get(key)
+        })
+        if not search.is_valid():
+            raise ValidationError(search.errors)
+        return search.validated_data
+
+    @staticmethod
+    def by_distance(lat, long):
+        """All studios, sorted by distance from (`lat`, `long`).
+        """
         # Calculate distances using great circle distance formula
         # (https://stackoverflow.com/a/26219292)
         gcd_formula = "6371 * acos(min(max(\
@@ -76,19 +100,67 @@ class ListStudios(generics.ListAPIView):
             gcd_formula,
             (lat, long, lat)
         )
-        qs = Studio.objects.all() \
+        qs = Studio.objects.only(*StudioListSerializer.columns) \
             .annotate(distance=distance_raw_sql) \
             .order_by("distance")
         return qs
 
+    @staticmethod
+    def get_nearby(lat, long, radius=None, k=None):
+        """Get the studios within `radius` km of (`lat`, `long`), or the `k` nearest ones, sorted by distance.
 
-class StudioDetails(generics.RetrieveAPIView):
+        Studios are prefiltered using a bounding box (and the grid cells it overlaps), so that exact distances
+        are only calculated for nearby candidates. Without a radius, the box grows until it contains `k` studios.
+        """
+        search_radius = radius if radius is not None else NEARBY_INITIAL_RADIUS
+        while True:
+            studios = ListStudios.within(ListStudios.candidates(lat, long, search_radius), lat, long, search_radius)
+            if ListStudios.found(studios, radius, k, search_radius):
+                break
+            search_radius *= 4
+        return ListStudios.nearest(studios, k)
+
+    @staticmethod
+    def candidates(lat, long, search_radius):
+        """The studios in the bounding box (and grid cells) of the circle of `search_radius` km.
+        """
+        min_lat, max_lat, min_long, max_long = bounding_box(lat, long, search_radius)
+        candidates = Studio.objects.filter(lat__gte=min_lat, lat__lte=max_lat,
+                                           long__gte=min_long, long__lte=max_long) \
+            .only(*StudioListSerializer.columns)
+        cells = grid_cells(min_lat, max_lat, min_long, max_long)
+        if cells is not None:
+            candidates = candidates.filter(grid_cell__in=cells)
+        return candidates
+
+    @staticmethod
+    def within(candidates, lat, long, search_radius):
+        studios = []
+        for studio in candidates:
+            studio.distance = great_circle_distance(lat, long, studio.lat, studio.long)
+            if studio.distance <= search_radius:
+                studios.append(studio)
+        return studios
+
+    @staticmethod
+    def found(studios, radius, k, search_radius):
+        return radius is not None or len(studios) >= k or search_radius >= math.pi * EARTH_RADIUS
+
+    @staticmethod
+    def nearest(studios, k):
+        studios.sort(key=lambda studio: studio.distance)
+        return studios[:k] if k is not None else studios
+
+
+class StudioDetails(StudioCacheMixin, ProfiledViewMixin, generics.RetrieveAPIView):
     serializer_class = StudioSerializer
     lookup_field = "pk"
-    queryset = Studio.objects.all()
+    queryset = Studio.objects.prefetch_related("images", "amenities", "classes__keywords")
+
 
+class ListInstances(StudioCacheMixin, generics.RetrieveAPIView):
+    time_dependent = True
 
-class ListInstances(generics.RetrieveAPIView):
     def retrieve(self, request, **kwargs):
         studio_obj = get_object_or_404(Studio, pk=kwargs["pk"])
         try:
@@ -98,24 +170,20 @@ class ListInstances(generics.RetrieveAPIView):
                                                                                          kwargs["pk"])},
                             status=status.HTTP_404_NOT_FOUND)
         data = get_all_instances(studio_obj, class_obj, request)
-        data = sorted(data, key=lambda i: (i["date"], i["start_time"]))
+        data = sorted(data, key=instance_key)
         paginator = ClassInstancePaginator(request)
-        return paginator.paginate_list(data)
+        return paginator.paginate(data)
 
 
-class StudioSchedule(generics.RetrieveAPIView):
+class StudioSchedule(StudioCacheMixin, generics.RetrieveAPIView):
     """View for retrieving future class instances across ALL classes at a studio.
     """
+    time_dependent = True
 
     def retrieve(self, request, *args, **kwargs):
         studio_obj = get_object_or_404(Studio, pk=kwargs["pk"])
-        classes = studio_obj.classes.all()
-        data = []
-        for class_obj in classes:
-            data.extend(get_all_instances(studio_obj, class_obj, request))
-        data = sorted(data, key=lambda i: (i["date"], i["start_time"]))
         paginator = ClassInstancePaginator(request)
-        return paginator.paginate_list(data)
+        return paginator.paginate(iter_class_instances(studio_obj.classes.all(), request, after=paginator.after))
 
 
 class ClassDetails(generics.RetrieveUpdateAPIView):
@@ -237,51 +305,40 @@ class InstanceDetails(generics.RetrieveUpdateAPIView):
         """
         if request.user.subscription is None:
             raise PermissionDenied(detail="User is not subscribed.")
-        try:
-            request.user.classes.get(pk=self.class_obj.pk)
-            # If we get to this point, then user must be enrolled in the parent course
-            try:
-                # Try to retrieve this instance from their dropped instances (if it fails, we go to except branch)
-                request.user.dropped_instances.get(pk=self.instance.pk)
-                if self.instance.enrolled >= self.instance.parent.capacity:
-                    # Instance is already at capacity
-                    raise PermissionDenied(detail="Instance is already at capacity ({}/{}).".format(
-                        self.instance.enrolled, self.instance.parent.capacity
-                    ))
-                # If we get here, then it's not at capacity, and we can un-drop (re-enroll)
-                request.user.dropped_instances.remove(self.instance)
-                self.instance.enrolled += 1
-                self.instance.save()
-            except ClassInstance.DoesNotExist:
-                # Retrieving instance failed (because they have not dropped), so we drop it
-                request.user.dropped_instances.add(self.instance)
-                self.instance.enrolled -= 1
-                self.instance.save()
-        except Class.DoesNotExist:
-            try:
-                # Try to retrieve this instance from their enrolled instances (if it fails, we go to except branch)
-                request.user.enrolled_instances.get(pk=self.instance.pk)
-                # Unenroll from instance
-                request.user.enrolled_instances.remove(self.instance)
-                self.instance.enrolled -= 1
-                self.instance.save()
-            except ClassInstance.DoesNotExist:
-                # Retrieving instance failed (because they were not enrolled), so we enroll them
-                if self.instance.enrolled >= self.instance.parent.capacity:
-                    # Instance is already at capacity
-                    raise PermissionDenied(detail="Instance is already at capacity ({}/{}).".format(
-                        self.instance.enrolled, self.instance.parent.capacity
-                    ))
-                request.user.enrolled_instances.add(self.instance)
-                self.instance.enrolled += 1
-                self.instance.save()
-
-        return Response(ClassInstanceSerializer(
-            self.instance,
-            context={"user_enrolled": self.request.user.classes.filter(pk=self.class_obj.id).exists()
-                                      and not self.request.user.dropped_instances.filter(pk=self.instance.id).exists()
-                                      or self.request.user.enrolled_instances.filter(pk=self.instance.id).exists()}
-        ).data)
+        with transaction.atomic():
+            if request.user.classes.filter(pk=self.class_obj.pk).exists():
+                # User is enrolled in the parent course
+                if request.user.dropped_instances.filter(pk=self.instance.pk).exists():
+                    # User has dropped this instance, so we un-drop (re-enroll) them if it's not at capacity
+                    self.reserve_seat()
+                    request.user.dropped_instances.remove(self.instance)
+                    user_enrolled = True
+                else:
+                    # User has not dropped this instance, so we drop it
+                    request.user.dropped_instances.add(self.instance)
+                    self.instance.release_seat()
+                    user_enrolled = False
+            else:
+                if request.user.enrolled_instances.filter(pk=self.instance.pk).exists():
+                    # Unenroll from instance
+                    request.user.enrolled_instances.remove(self.instance)
+                    self.instance.release_seat()
+                    user_enrolled = False
+                else:
+                    # User is not enrolled, so we enroll them if it's not at capacity
+                    self.reserve_seat()
+                    request.user.enrolled_instances.add(self.instance)
+                    user_enrolled = True
+            # Serialize inside the transaction, so that a failed request never leaves a partial toggle behind
+            data = ClassInstanceSerializer(self.instance, context={"user_enrolled": user_enrolled}).data
+        return Response(data)
+
+    def reserve_seat(self):
+        if not self.instance.reserve_seat():
+            # Instance is already at capacity
+            raise PermissionDenied(detail="Instance is already at capacity ({}/{}).".format(
+                self.instance.enrolled, self.class_obj.capacity
+            ))
 
 
 class HandleNonSpecial(generics.RetrieveUpdateAPIView):
@@ -308,12 +365,7 @@ class HandleNonSpecial(generics.RetrieveUpdateAPIView):
         except ClassInstance.DoesNotExist:
             # The instance doesn't exist, so we'll make it (as long as it matches the parent schedule)
             # Check if the instance matches occurrence rules
-            occurrences = list(class_obj.schedule.between(
-                datetime.datetime.combine(date, datetime.time(0)),
-                datetime.datetime.combine(date, datetime.time(23, 59, 59)),
-                inc=True
-            ))
-            if len(occurrences) == 0:
+            if not class_obj.is_scheduled(date):
                 # Does not fall on scheduled day
                 raise ParseError(detail="Date {} does not match class schedule.".format(date))
             self.instance = ClassInstance(
@@ -321,6 +373,8 @@ class HandleNonSpecial(generics.RetrieveUpdateAPIView):
                 start_time=class_obj.start_time,
                 end_time=class_obj.end_time,
                 special=False,
+                # Everyone enrolled in the class is enrolled in the new instance
+                enrolled=class_obj.enrolled,
                 parent=class_obj
             )
             self.instance.save()
@@ -334,35 +388,206 @@ class HandleNonSpecial(generics.RetrieveUpdateAPIView):
         return InstanceDetails.as_view()(request._request, *args, **kwargs)
 
 
-class SearchStudios(generics.ListAPIView):
-    serializer_class = StudioSerializer
-    pagination_class = LimitPageNumberPagination
+class BulkEnrollment(generics.GenericAPIView):
+    """View for enrolling in (or dropping) many class instances in one request.
 
-    def get_serializer_context(self):
-        context = super(SearchStudios, self).get_serializer_context()
-        context["exclude_fields"] = ["images", "directions", "lat", "long"]
-        return context
+    Items are either instance ids, or (class id, date) pairs for non-special instances, which are created
+    if they don't exist yet. All changes are made in one transaction, and a result is returned per item.
+    """
+    serializer_class = BulkEnrollmentSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        if request.user.subscription is None:
+            raise PermissionDenied(detail="User is not subscribed.")
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data["items"]
+        with transaction.atomic():
+            instances = self.get_instances(items)
+            if serializer.validated_data["action"] == "enroll":
+                results = self.enroll(instances)
+            else:
+                results = self.drop(instances)
+        return Response({"results": results})
+
+    @staticmethod
+    def get_instances(items):
+        """Get the instance for each item (or an error message, if there isn't one).
+        """
+        by_id = ClassInstance.objects.select_related("parent") \
+            .in_bulk([item["instance_id"] for item in items if "instance_id" in item])
+        classes = Class.objects.in_bulk([item["class_id"] for item in items if "instance_id" not in item])
+        dates = [item["date"] for item in items if "instance_id" not in item]
+        non_special = {
+            (instance.parent_id, instance.date): instance
+            for instance in ClassInstance.objects.select_related("parent").filter(
+                parent_id__in=classes.keys(), date__in=dates, special=False, cancelled=False
+            )
+        }
+        occurrences = set(Occurrence.objects.filter(parent_id__in=classes.keys(), date__in=dates)
+                          .values_list("parent_id", "date"))
+
+        instances = []
+        missing = []
+        for item in items:
+            if "instance_id" in item:
+                instance = by_id.get(item["instance_id"])
+                if instance is None:
+                    instance = "No ClassInstance with id {} exists.".format(item["instance_id"])
+                elif instance.cancelled:
+                    instance = "ClassInstance {} has been cancelled.".format(instance.id)
+                instances.append(instance)
+                continue
+            class_obj = classes.get(item["class_id"])
+            if class_obj is None:
+                instances.append("No Class with id {} exists.".format(item["class_id"]))
+                continue
+            key = (class_obj.id, item["date"])
+            if key not in non_special:
+                # The instance doesn't exist, so we'll make it (as long as it matches the parent schedule)
+                if class_obj.occurrences_cover(item["date"], item["date"]):
+                    scheduled = key in occurrences
+                else:
+                    scheduled = item["date"] in class_obj.get_occurrence_dates(item["date"], item["date"])
+                if not scheduled:
+                    instances.append("Date {} does not match class schedule.".format(item["date"]))
+                    continue
+                # Everyone enrolled in the parent class is enrolled in the new instance
+                non_special[key] = ClassInstance(date=item["date"], start_time=class_obj.start_time,
+                                                 end_time=class_obj.end_time, special=False,
+                                                 enrolled=class_obj.enrolled, parent=class_obj)
+                missing.append(non_special[key])
+            instances.append(non_special[key])
+
+        ClassInstance.objects.bulk_create(missing)
+        if missing and not connection.features.can_return_rows_from_bulk_insert:
+            # We need the primary keys of the new instances
+            pks = {
+                (parent_id, date): pk for pk, parent_id, date in ClassInstance.objects.filter(
+                    parent_id__in={instance.parent_id for instance in missing},
+                    date__in={instance.date for instance in missing}, special=False, cancelled=False
+                ).values_list("pk", "parent_id", "date")
+            }
+            for instance in missing:
+                instance.pk = pks[instance.parent_id, instance.date]
+        return instances
+
+    def enroll(self, instances):
+        user = self.request.user
+        enrolled_classes = set(user.classes.values_list("pk", flat=True))
+        dropped = set(user.dropped_instances.values_list("pk", flat=True))
+        enrolled = set(user.enrolled_instances.values_list("pk", flat=True))
+        undropped = []
+        added = []
+        results = []
+        for instance in instances:
+            if isinstance(instance, str):
+                results.append({"instance_id": None, "status": "error", "detail": instance})
+                continue
+            if instance.parent_id in enrolled_classes:
+                changed = instance.pk in dropped
+                changes = undropped
+            else:
+                changed = instance.pk not in enrolled
+                changes = added
+            if not changed:
+                results.append({"instance_id": instance.pk, "status": "unchanged"})
+            elif instance.reserve_seat():
+                # Only once the seat is reserved, so that a later duplicate item is retried if it wasn't
+                if changes is undropped:
+                    dropped.discard(instance.pk)
+                else:
+                    enrolled.add(instance.pk)
+                changes.append(instance)
+                results.append({"instance_id": instance.pk, "status": "enrolled"})
+            else:
+                # Instance is already at capacity
+                results.append({"instance_id": instance.pk, "status": "error",
+                                "detail": "Instance is already at capacity ({}/{}).".format(
+                                    instance.enrolled, instance.parent.capacity)})
+        user.dropped_instances.remove(*undropped)
+        user.enrolled_instances.add(*added)
+        return results
+
+    def drop(self, instances):
+        user = self.request.user
+        enrolled_classes = set(user.classes.values_list("pk", flat=True))
+        dropped = set(user.dropped_instances.values_list("pk", flat=True))
+        enrolled = set(user.enrolled_instances.values_list("pk", flat=True))
+        newly_dropped = []
+        removed = []
+        results = []
+        for instance in instances:
+            if isinstance(instance, str):
+                results.append({"instance_id": None, "status": "error", "detail": instance})
+                continue
+            if instance.parent_id in enrolled_classes:
+                changed = instance.pk not in dropped
+                changes = newly_dropped
+            else:
+                changed = instance.pk in enrolled
+                changes = removed
+            if changed:
+                if changes is newly_dropped:
+                    dropped.add(instance.pk)
+                else:
+                    enrolled.discard(instance.pk)
+                changes.append(instance)
+            results.append({"instance_id": instance.pk, "status": "dropped" if changed else "unchanged"})
+        user.dropped_instances.add(*newly_dropped)
+        user.enrolled_instances.remove(*removed)
+        ClassInstance.objects.filter(pk__in=[instance.pk for instance in newly_dropped + removed], enrolled__gt=0) \
+            .update(enrolled=F("enrolled") - 1)
+        return results
+
+
+def search_studios(query_params):
+    """The studios matching a search (see `SearchStudios`). Building the queryset doesn't query the database.
+    """
+    qs = Studio.objects.all()
+    ordering = ["name"]
+    if "q" in query_params:
+        # Search all fields, best matches first. Words are matched by prefix against the search index
+        # (see `studios.search`)
+        qs = search(qs, query_params.get("q"), list(WEIGHTS), rank=True)
+        ordering = ["-rank", "name"]
+    if "name" in query_params:
+        qs = qs.filter(name__icontains=query_params.get("name"))
+    # Exact (case-insensitive) filters use subqueries rather than joins, so that studios aren't duplicated
+    if "amenities" in query_params:
+        qs = qs.filter(pk__in=Amenity.objects.filter(
+            type__iin=query_params.getlist("amenities")).values("studio_id"))
+    if "classes" in query_params:
+        qs = qs.filter(pk__in=Class.objects.filter(
+            name__iin=query_params.getlist("classes")).values("studio_id"))
+    if "coaches" in query_params:
+        qs = qs.filter(pk__in=Class.objects.filter(
+            coach__iin=query_params.getlist("coaches")).values("studio_id"))
+    return qs.only(*StudioSearchSerializer.columns).order_by(*ordering)
+
+
+class SearchStudios(ProfiledViewMixin, generics.ListAPIView):
+    serializer_class = StudioSearchSerializer
+    pagination_class = LimitPageNumberPagination
 
     def get_queryset(self):
-        qs = Studio.objects.all()
-        if "name" in self.request.query_params:
-            qs = qs.filter(name__icontains=self.request.query_params.get("name"))
-        if "amenities" in self.request.query_params:
-            qs = qs.filter(amenities__type__iin=self.request.query_params.getlist("amenities"))
-        if "classes" in self.request.query_params:
-            qs = qs.filter(classes__name__iin=self.request.query_params.getlist("classes"))
-        if "coaches" in self.request.query_params:
-            qs = qs.filter(classes__coach__iin=self.request.query_params.getlist("coaches"))
-        return qs.order_by("name")
+        return search_studios(self.request.query_params)
 
 
 # TODO: Search class instances instead of classes? (it will be much harder)
-class SearchClasses(generics.ListAPIView):
+class SearchClasses(StudioCacheMixin, ProfiledViewMixin, generics.ListAPIView):
     serializer_class = ClassSerializer
     pagination_class = LimitPageNumberPagination
 
     def get_queryset(self):
-        qs = Class.objects.filter(studio=self.kwargs.get("pk"))
+        qs = Class.objects.filter(studio=self.kwargs.get("pk")).select_related("studio").prefetch_related("keywords")
+        ordering = ["name"]
+        if "q" in self.request.query_params:
+            qs = search(qs, self.request.query_params.get("q"),
+                        [SearchToken.CLASS_NAME, SearchToken.KEYWORD, SearchToken.COACH],
+                        key="related_class_id", rank=True)
+            ordering = ["-rank", "name"]
         if "name" in self.request.query_params:
             qs = qs.filter(name__icontains=self.request.query_params.get("name"))
         if "coach" in self.request.query_params:
@@ -379,4 +604,62 @@ class SearchClasses(generics.ListAPIView):
             except ValueError as err:
                 date = datetime.datetime.strptime("23:59", "%H:%M")
             qs = qs.filter(end_time__lte=date.time())
-        return qs.order_by("name")
+        return qs.order_by(*ordering)
+
+
+# Async variants of the read-heavy views, for ASGI servers (served under /async/, next to the sync views)
+
+
+class AsyncListStudios(AsyncListAPIView):
+    """`ListStudios`, without blocking a thread while a postal code is geocoded.
+    """
+    serializer_class = StudioListSerializer
+    pagination_class = LimitPageNumberPagination
+
+    async def aget_queryset(self):
+        location = ListStudios.parse_location(self.request)
+        if isinstance(location, str):
+            try:
+                location = ListStudios.check_location(await get_geocoder().ageocode(location))
+            except GeocoderUnavailable as err:
+                raise ParseError(detail=str(err))
+        lat, long = location
+
+        search = ListStudios.parse_search(self.request)
+        if "radius" in search or "k" in search:
+            return await self.get_nearby(lat, long, search.get("radius"), search.get("k"))
+        return ListStudios.by_distance(lat, long)
+
+    @staticmethod
+    async def get_nearby(lat, long, radius=None, k=None):
+        search_radius = radius if radius is not None else NEARBY_INITIAL_RADIUS
+        while True:
+            candidates = [studio async for studio in ListStudios.candidates(lat, long, search_radius)]
+            studios = ListStudios.within(candidates, lat, long, search_radius)
+            if ListStudios.found(studios, radius, k, search_radius):
+                break
+            search_radius *= 4
+        return ListStudios.nearest(studios, k)
+
+
+class AsyncSearchStudios(AsyncListAPIView):
+    serializer_class = StudioSearchSerializer
+    pagination_class = LimitPageNumberPagination
+
+    async def aget_queryset(self):
+        return search_studios(self.request.query_params)
+
+
+class AsyncStudioSchedule(AsyncStudioCacheMixin, AsyncRetrieveAPIView):
+    """`StudioSchedule`, with the instances of the studio's classes generated concurrently
+    (see `aiter_class_instances`).
+    """
+    time_dependent = True
+
+    async def retrieve(self, request, *args, **kwargs):
+        if not await Studio.objects.filter(pk=kwargs["pk"]).aexists():
+            raise NotFound()
+        classes = [class_obj async for class_obj in Class.objects.filter(studio_id=kwargs["pk"])]
+        paginator = ClassInstancePaginator(request)
+        return paginator.paginate(await aiter_class_instances(classes, request, after=paginator.after,
+                                                              limit=paginator.needed))
@@ -10,9 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from datetime import timedelta
 from pathlib import Path
 
+from utils.database import database_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -39,6 +42,7 @@ INSTALLED_APPS = [
     'accounts.apps.AccountsConfig',
     'classes.apps.ClassesConfig',
     'studios.apps.StudiosConfig',
+    'benchmarks.apps.BenchmarksConfig',
     'recurrence',
     'rest_framework',
     'corsheaders'
@@ -59,6 +63,7 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    'utils.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -99,13 +104,11 @@ WSGI_APPLICATION = 'tfc.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
+# SQLite (in WAL mode, with a busy timeout) by default, or PostgreSQL if DATABASE_URL is set, which also needs
+# psycopg2 (`pip install -r requirements-postgresql.txt`). Both keep connections open between requests (see
+# `utils.database` for the variables)
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+DATABASES = database_settings(BASE_DIR)
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -153,3 +156,80 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_ROOT = BASE_DIR / 'media/'
 
 MEDIA_URL = "media/"
+
+# Uploaded images are resized to fit within each of these widths (and heights), in each format, by a pool of
+# background workers (0 generates them synchronously, once the upload is committed)
+
+IMAGE_VARIANTS = {
+    "SIZES": {"thumbnail": 160, "card": 480, "large": 1280},
+    "FORMATS": ["webp", "jpeg"],
+    "QUALITY": 80,
+    "WORKERS": 2,
+}
+
+# Class schedules
+# Occurrences of recurring classes are materialized for this many days before and after today
+# (see `python manage.py refresh_occurrences`)
+
+OCCURRENCE_WINDOW_PAST_DAYS = 90
+
+OCCURRENCE_WINDOW_FUTURE_DAYS = 180
+
+# Geocoding
+# Postal codes are geocoded through an in-process LRU cache and the `PostalCodeLocation` table,
+# before falling back to this backend (see `utils.geocoding`). Without a `MAPBOX_API_KEY`, only the
+# postal codes already in the table (e.g. loaded with `python manage.py load_postal_codes`) are found
+
+if os.environ.get("MAPBOX_API_KEY"):
+    GEOCODER = {
+        "BACKEND": "utils.geocoding.MapBoxGeocoder",
+        "OPTIONS": {"api_key": os.environ["MAPBOX_API_KEY"]},
+        "LRU_SIZE": 1024,
+    }
+else:
+    GEOCODER = {
+        "BACKEND": "utils.geocoding.StaticGeocoder",
+        "LRU_SIZE": 1024,
+    }
+
+# Caching
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Uses a per-process cache by default. Set REDIS_URL to share the cache between processes.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    } if not os.environ.get("REDIS_URL") else {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["REDIS_URL"],
+    }
+}
+
+# Users' schedules are cached until they change (see `accounts.schedule_cache`)
+
+SCHEDULE_CACHE = {
+    "ALIAS": "default",
+    "TIMEOUT": 60 * 60,
+}
+
+# A sample of requests log their timings (total, database, recurrence expansion and serialization), and a smaller
+# sample is profiled with cProfile (see `utils.profiling`). The timings are also sent to clients in a Server-Timing
+# header if PROFILING_EXPOSE_HEADER=1 (off by default, even in DEBUG, since it reveals query counts and timings).
+
+PROFILING = {
+    "SAMPLE_RATE": float(os.environ.get("PROFILING_SAMPLE_RATE", 1 if DEBUG else 0.01)),
+    "PROFILE_SAMPLE_RATE": float(os.environ.get("PROFILING_PROFILE_SAMPLE_RATE", 0)),
+    "PROFILE_DIR": BASE_DIR / "profiles",
+    "EXPOSE_HEADER": os.environ.get("PROFILING_EXPOSE_HEADER") == "1",
+}
+
+# Studio details, schedules and classes are cached until the studio changes (see `studios.response_cache`).
+# Changes only invalidate the cache of the process that made them, so with the per-process default cache, other
+# workers (and commands such as reconcile_counters and run_billing) serve stale responses until the studio's
+# version expires. Set REDIS_URL to invalidate them everywhere at once.
+
+STUDIO_CACHE = {
+    "ALIAS": "default",
+    "TIMEOUT": 60 * 60,
+    "VERSION_TIMEOUT": 60 * 60 if os.environ.get("REDIS_URL") else 60,
+}
@@ -18,8 +18,16 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from accounts import urls as accounts_urls
+from studios import urls as studios_urls
+
 urlpatterns = [
                   path('admin/', admin.site.urls),
                   path("accounts/", include("accounts.urls")),
                   path("studios/", include("studios.urls")),
+                  # Async (ASGI-native) variants of the schedule and search views, with the same paths
+                  path("async/accounts/", include((accounts_urls.async_urlpatterns, "accounts"),
+                                                  namespace="async_accounts")),
+                  path("async/studios/", include((studios_urls.async_urlpatterns, "studios"),
+                                                 namespace="async_studios")),
               ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
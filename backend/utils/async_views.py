@@ -0,0 +1,71 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+class AsyncAPIView(APIView):
+    """DRF view whose handlers (`get()`, etc.) are coroutines, for ASGI servers.
+
+    Authentication, permission and throttling checks (which may query the database) run in a thread before
+    the handler, so `request.user` can be used without querying again. Errors are handled like in any DRF view.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            # (OPTIONS is handled synchronously by DRF)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncRetrieveAPIView(AsyncAPIView):
+    """Async equivalent of DRF's `RetrieveAPIView`: subclasses implement `retrieve()` as a coroutine.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        return await self.retrieve(request, *args, **kwargs)
+
+
+class AsyncListAPIView(AsyncAPIView):
+    """Async equivalent of DRF's `ListAPIView`, for serializers with an async `adata()`
+    (see `studios.serializers.ProjectionSerializer`).
+    """
+    serializer_class = None
+    pagination_class = None
+
+    def get_serializer_context(self):
+        return {"request": self.request, "format": self.format_kwarg, "view": self}
+
+    async def aget_queryset(self):
+        raise NotImplementedError
+
+    async def get(self, request, *args, **kwargs):
+        queryset = await self.aget_queryset()
+        page = None
+        if self.pagination_class is not None:
+            self.paginator = self.pagination_class()
+            page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+        if page is None:
+            objs = queryset if isinstance(queryset, list) else [obj async for obj in queryset]
+            return Response(await self.serializer_class(objs, many=True,
+                                                        context=self.get_serializer_context()).adata())
+        data = await self.serializer_class(page, many=True, context=self.get_serializer_context()).adata()
+        return self.paginator.get_paginated_response(data)
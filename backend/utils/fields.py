@@ -0,0 +1,57 @@
+from django.db import models
+from django.db.models.functions import Lower
+
+
+class LowercaseField(models.CharField):
+    """A stored lowercase copy of another field of the model (its `source`).
+
+    It is set on every save (and by `bulk_create`), but not by `QuerySet.update()` or `bulk_update()`, which
+    should set it themselves. Case-insensitive lookups (`iin`) use it on backends without expression indexes.
+    """
+
+    def __init__(self, source, *args, **kwargs):
+        self.source = source
+        kwargs.setdefault("max_length", 255)
+        kwargs["editable"] = False
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        del kwargs["editable"]
+        return name, path, [self.source, *args], kwargs
+
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super().contribute_to_class(cls, name, *args, **kwargs)
+        # Let lookups on the source field find this copy
+        if not cls._meta.abstract:
+            cls._meta.get_field(self.source).lowercase_field = self
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.source)
+        value = value.lower() if value is not None else None
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+class CaseInsensitiveIndex(models.Index):
+    """An index for case-insensitive lookups (`iin`) on a single field.
+
+    It indexes `LOWER(field)` on backends that support expression indexes, and the field's `LowercaseField`
+    otherwise, so that each backend only maintains the index its lookups use.
+    """
+
+    def __init__(self, *, fields, name):
+        if len(fields) != 1:
+            raise ValueError("CaseInsensitiveIndex.fields must contain a single field.")
+        super().__init__(fields=fields, name=name)
+
+    def get_index(self, model, schema_editor):
+        """The plain index that is actually created for this backend.
+        """
+        field = model._meta.get_field(self.fields[0])
+        if schema_editor.connection.features.supports_expression_indexes:
+            return models.Index(Lower(field.name), name=self.name)
+        return models.Index(fields=[field.lowercase_field.name], name=self.name)
+
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        return self.get_index(model, schema_editor).create_sql(model, schema_editor, using, **kwargs)
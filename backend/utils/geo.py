@@ -0,0 +1,56 @@
+import math
+
+# Mean radius of the Earth, in kilometres
+EARTH_RADIUS = 6371
+
+# Size of a grid cell, in degrees of latitude/longitude (about 5.5km north-south)
+GRID_CELL_SIZE = 0.05
+
+# Radius (in km) of the first bounding box tried by k-nearest searches
+NEARBY_INITIAL_RADIUS = 2
+
+# Bounding boxes covering more grid cells than this are only filtered by latitude/longitude
+MAX_GRID_CELLS = 64
+
+
+def grid_cell(lat, long):
+    """Returns the key of the grid cell containing the point (`lat`, `long`).
+    """
+    return "{}:{}".format(math.floor(float(lat) / GRID_CELL_SIZE), math.floor(float(long) / GRID_CELL_SIZE))
+
+
+def bounding_box(lat, long, radius):
+    """Returns the (min_lat, max_lat, min_long, max_long) box containing every point within `radius` km
+    of (`lat`, `long`).
+    """
+    lat, long = float(lat), float(long)
+    delta_lat = math.degrees(radius / EARTH_RADIUS)
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        # The box contains a pole, so every longitude is within range
+        return max(min_lat, -90), min(max_lat, 90), -180, 180
+    delta_long = math.degrees(math.asin(min(math.sin(radius / EARTH_RADIUS) / math.cos(math.radians(lat)), 1)))
+    if long - delta_long < -180 or long + delta_long > 180:
+        # The box crosses the antimeridian; don't bother splitting it in two
+        return min_lat, max_lat, -180, 180
+    return min_lat, max_lat, long - delta_long, long + delta_long
+
+
+def grid_cells(min_lat, max_lat, min_long, max_long):
+    """Returns the keys of all grid cells overlapping the given box, or None if there are more than
+    `MAX_GRID_CELLS` of them.
+    """
+    lat_range = range(math.floor(min_lat / GRID_CELL_SIZE), math.floor(max_lat / GRID_CELL_SIZE) + 1)
+    long_range = range(math.floor(min_long / GRID_CELL_SIZE), math.floor(max_long / GRID_CELL_SIZE) + 1)
+    if len(lat_range) * len(long_range) > MAX_GRID_CELLS:
+        return None
+    return ["{}:{}".format(i, j) for i in lat_range for j in long_range]
+
+
+def great_circle_distance(lat1, long1, lat2, long2):
+    """Returns the great circle distance between two points, in km.
+    """
+    lat1, long1, lat2, long2 = map(math.radians, map(float, (lat1, long1, lat2, long2)))
+    return EARTH_RADIUS * math.acos(min(max(
+        math.cos(lat1) * math.cos(lat2) * math.cos(long2 - long1) + math.sin(lat1) * math.sin(lat2),
+        -1), 1))
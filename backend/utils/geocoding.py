@@ -0,0 +1,190 @@
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from geopy import MapBox
+
+Location = namedtuple("Location", ["lat", "long"])
+
+
+class GeocoderUnavailable(Exception):
+    """Raised when the geocoding backend cannot be reached."""
+    pass
+
+
+def normalize_postal_code(postal_code):
+    return postal_code.replace(" ", "").upper()
+
+
+class Geocoder:
+    """Base class for geocoding backends, which turn a (normalized) postal code into a `Location`.
+    """
+
+    def geocode(self, postal_code):
+        """Returns the location of `postal_code`, or None if it could not be found.
+        """
+        raise NotImplementedError
+
+    async def ageocode(self, postal_code):
+        """Like `geocode()`, for async views. By default, `geocode()` runs in its own thread, so that the
+        network round trip doesn't hold up the thread that runs the (sync) database queries.
+        """
+        return await sync_to_async(self.geocode, thread_sensitive=False)(postal_code)
+
+
+class MapBoxGeocoder(Geocoder):
+    def __init__(self, api_key):
+        self.geolocator = MapBox(api_key=api_key)
+
+    def geocode(self, postal_code):
+        try:
+            loc = self.geolocator.geocode(query="{}, Canada".format(postal_code), exactly_one=True)
+        except Exception as err:
+            raise GeocoderUnavailable(str(err)) from err
+        return Location(loc.latitude, loc.longitude) if loc is not None else None
+
+
+class StaticGeocoder(Geocoder):
+    """Geocodes postal codes from a fixed mapping (of postal codes to (lat, long) pairs), without any
+    network access. Useful for tests, and for running offline (with an empty mapping) when the
+    location cache has been preloaded.
+    """
+
+    def __init__(self, locations=None):
+        self.locations = {normalize_postal_code(postal_code): Location(*location)
+                          for postal_code, location in (locations or {}).items()}
+
+    def geocode(self, postal_code):
+        return self.locations.get(postal_code)
+
+    async def ageocode(self, postal_code):
+        return self.geocode(postal_code)
+
+
+class CachedGeocoder(Geocoder):
+    """Geocodes postal codes through an in-process LRU cache and the persistent `PostalCodeLocation` table,
+    only falling back to `backend` when neither has the postal code.
+
+    If the backend can't find (or can't reach) a postal code, the location of its forward sortation area
+    (first 3 characters) is used if it has been preloaded.
+    """
+
+    def __init__(self, backend, size=1024):
+        self.backend = backend
+        self.size = size
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+
+    def geocode(self, postal_code):
+        postal_code = normalize_postal_code(postal_code)
+        hit, location = self.cached(postal_code)
+        if hit:
+            return location
+
+        location = self.lookup(postal_code)
+        if location is None:
+            try:
+                location = self.backend.geocode(postal_code)
+            except GeocoderUnavailable:
+                location = self.lookup(postal_code[:3])
+                if location is None:
+                    raise
+                # Don't cache the approximation, so that we retry the backend next time
+                return location
+            if location is not None:
+                self.store(postal_code, location)
+            else:
+                location = self.lookup(postal_code[:3])
+        self.remember(postal_code, location)
+        return location
+
+    async def ageocode(self, postal_code):
+        postal_code = normalize_postal_code(postal_code)
+        hit, location = self.cached(postal_code)
+        if hit:
+            return location
+
+        location = await self.alookup(postal_code)
+        if location is None:
+            try:
+                location = await self.backend.ageocode(postal_code)
+            except GeocoderUnavailable:
+                location = await self.alookup(postal_code[:3])
+                if location is None:
+                    raise
+                return location
+            if location is not None:
+                await self.astore(postal_code, location)
+            else:
+                location = await self.alookup(postal_code[:3])
+        self.remember(postal_code, location)
+        return location
+
+    def cached(self, postal_code):
+        """Returns whether `postal_code` is in the LRU cache, and its location.
+        """
+        with self.lock:
+            if postal_code in self.lru:
+                self.lru.move_to_end(postal_code)
+                return True, self.lru[postal_code]
+        return False, None
+
+    def remember(self, postal_code, location):
+        with self.lock:
+            self.lru[postal_code] = location
+            if len(self.lru) > self.size:
+                self.lru.popitem(last=False)
+
+    @staticmethod
+    def lookup(postal_code):
+        PostalCodeLocation = apps.get_model("studios", "PostalCodeLocation")
+        try:
+            obj = PostalCodeLocation.objects.get(pk=postal_code)
+        except PostalCodeLocation.DoesNotExist:
+            return None
+        return Location(float(obj.lat), float(obj.long))
+
+    @staticmethod
+    async def alookup(postal_code):
+        PostalCodeLocation = apps.get_model("studios", "PostalCodeLocation")
+        obj = await PostalCodeLocation.objects.filter(pk=postal_code).afirst()
+        return Location(float(obj.lat), float(obj.long)) if obj is not None else None
+
+    @staticmethod
+    def store(postal_code, location):
+        PostalCodeLocation = apps.get_model("studios", "PostalCodeLocation")
+        PostalCodeLocation.objects.update_or_create(
+            pk=postal_code, defaults={"lat": round(location.lat, 6), "long": round(location.long, 6)}
+        )
+
+    @staticmethod
+    async def astore(postal_code, location):
+        PostalCodeLocation = apps.get_model("studios", "PostalCodeLocation")
+        await PostalCodeLocation.objects.aupdate_or_create(
+            pk=postal_code, defaults={"lat": round(location.lat, 6), "long": round(location.long, 6)}
+        )
+
+    def clear(self):
+        with self.lock:
+            self.lru.clear()
+
+
+@lru_cache(maxsize=None)
+def get_geocoder():
+    """Returns the (shared) geocoder configured by the `GEOCODER` setting.
+    """
+    backend_class = import_string(settings.GEOCODER["BACKEND"])
+    backend = backend_class(**settings.GEOCODER.get("OPTIONS", {}))
+    return CachedGeocoder(backend, size=settings.GEOCODER.get("LRU_SIZE", 1024))
+
+
+@receiver(setting_changed)
+def reset_geocoder(setting, **kwargs):
+    if setting == "GEOCODER":
+        get_geocoder.cache_clear()
@@ -0,0 +1,174 @@
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Pillow format (and file extension) of each output format
+FORMATS = {"webp": ("WEBP", "webp"), "jpeg": ("JPEG", "jpg")}
+
+# Sent (with the model as sender, and the `pk` of the instance) once the variants of an image are ready
+variants_ready = Signal()
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANTS["WORKERS"],
+                                       thread_name_prefix="image-variants")
+    return _executor
+
+
+def variant_name(name, size, fmt):
+    """Where the variant of the image stored as `name` is stored, e.g. "variants/studios/gym_jpg_480.webp".
+    The extension of the image is kept, so that "gym.jpg" and "gym.png" have their own variants.
+    """
+    stem, ext = posixpath.splitext(name)
+    return "variants/{}{}_{}.{}".format(stem, ext.replace(".", "_").lower(), settings.IMAGE_VARIANTS["SIZES"][size],
+                                        FORMATS[fmt][1])
+
+
+def generate_variants(field_file):
+    """Resizes the image to fit within each of the configured sizes (without enlarging it), in each format,
+    and stores the results next to it. Returns the names of the variants, by size and format.
+    """
+    storage = field_file.storage
+    with storage.open(field_file.name) as f, Image.open(f) as image:
+        # Apply the camera orientation, since it is lost when converting to other formats
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        variants = {}
+        for size, width in settings.IMAGE_VARIANTS["SIZES"].items():
+            resized = image.copy()
+            resized.thumbnail((width, width), Image.Resampling.LANCZOS)
+            variants[size] = {}
+            for fmt in settings.IMAGE_VARIANTS["FORMATS"]:
+                buffer = io.BytesIO()
+                # JPEG has no alpha channel
+                (resized.convert("RGB") if fmt == "jpeg" else resized).save(
+                    buffer, FORMATS[fmt][0], quality=settings.IMAGE_VARIANTS["QUALITY"]
+                )
+                name = variant_name(field_file.name, size, fmt)
+                if storage.exists(name):
+                    storage.delete(name)
+                variants[size][fmt] = storage.save(name, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def delete_variants(storage, variants):
+    """Deletes the files of the variants of an image (as stored in its variants field).
+    """
+    for formats in variants.get("sizes", {}).values():
+        for name in formats.values():
+            storage.delete(name)
+
+
+def variant_urls(field_file, variants):
+    """The URLs of the variants of an image (as stored in its variants field), by size and format.
+
+    Variants are generated in the background, so until they are ready (or if they fail), the original is used.
+    So it is for the sizes and formats that were configured after the variants were generated.
+    """
+    if not field_file:
+        return None
+    url = field_file.url
+    generated = variants.get("sizes", {}) if variants.get("source") == field_file.name else {}
+    return {size: {fmt: field_file.storage.url(generated[size][fmt]) if fmt in generated.get(size, {}) else url
+                   for fmt in settings.IMAGE_VARIANTS["FORMATS"]}
+            for size in settings.IMAGE_VARIANTS["SIZES"]}
+
+
+def thumbnail_urls(field_file, variants):
+    """The URLs of the thumbnail of an image, by format: its "thumbnail" variant, or the smallest one if that
+    size isn't configured (or the original, if no sizes are).
+    """
+    if not field_file:
+        return None
+    sizes = settings.IMAGE_VARIANTS["SIZES"]
+    if not sizes:
+        return {fmt: field_file.url for fmt in settings.IMAGE_VARIANTS["FORMATS"]}
+    urls = variant_urls(field_file, variants)
+    return urls["thumbnail"] if "thumbnail" in urls else urls[min(sizes, key=sizes.get)]
+
+
+def update_variants(model, pk, image_field, variants_field):
+    """Generates the variants of an instance's image, and records them in its `variants_field`.
+    """
+    obj = model._base_manager.filter(pk=pk).only(image_field, variants_field).first()
+    field_file = getattr(obj, image_field, None)
+    if not field_file:
+        return
+    try:
+        variants = {"source": field_file.name, "sizes": generate_variants(field_file)}
+    except (OSError, Image.DecompressionBombError):
+        logger.exception("Could not generate the variants of %s.", field_file.name,
+                         extra={"model": model._meta.label, "pk": pk})
+        return
+    # Unless the image has changed in the meantime
+    if model._base_manager.filter(pk=pk, **{image_field: field_file.name}).update(**{variants_field: variants}):
+        previous = getattr(obj, variants_field)
+        if previous.get("source") != field_file.name:
+            # The variants of the image that was replaced
+            delete_variants(field_file.storage, previous)
+        variants_ready.send(sender=model, pk=pk)
+    else:
+        delete_variants(field_file.storage, variants)
+
+
+def _update_variants_in_worker(*args):
+    try:
+        update_variants(*args)
+    finally:
+        # Each worker thread has its own connection
+        connection.close()
+
+
+def schedule_variants(model, pk, image_field, variants_field):
+    """Generates the variants of an instance's image once the current transaction commits, in the worker pool
+    (or right away, if `WORKERS` is 0).
+    """
+    def submit():
+        if settings.IMAGE_VARIANTS["WORKERS"]:
+            get_executor().submit(_update_variants_in_worker, model, pk, image_field, variants_field)
+        else:
+            update_variants(model, pk, image_field, variants_field)
+    transaction.on_commit(submit)
+
+
+def register_variants(model, image_field, variants_field):
+    """Generates the variants of `model`'s `image_field` whenever a new image is saved, and records them
+    in its `variants_field` (a `JSONField`).
+    """
+    def image_saved(sender, instance, update_fields=None, **kwargs):
+        if update_fields is not None and image_field not in update_fields:
+            return
+        field_file = getattr(instance, image_field)
+        variants = getattr(instance, variants_field)
+        if field_file and variants.get("source") != field_file.name:
+            schedule_variants(model, instance.pk, image_field, variants_field)
+        elif not field_file and variants:
+            # The image was removed
+            model._base_manager.filter(pk=instance.pk).update(**{variants_field: {}})
+            setattr(instance, variants_field, {})
+            transaction.on_commit(lambda: delete_variants(field_file.storage, variants))
+
+    def image_deleted(sender, instance, **kwargs):
+        variants = getattr(instance, variants_field)
+        if variants:
+            storage = getattr(instance, image_field).storage
+            transaction.on_commit(lambda: delete_variants(storage, variants))
+
+    dispatch_uid = "{}.{}.variants".format(model._meta.label, image_field)
+    post_save.connect(image_saved, sender=model, weak=False, dispatch_uid=dispatch_uid)
+    post_delete.connect(image_deleted, sender=model, weak=False, dispatch_uid=dispatch_uid)
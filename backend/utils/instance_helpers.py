@@ -1,15 +1,28 @@
+import asyncio
+import base64
+import binascii
 import datetime
-from collections import OrderedDict
+import heapq
+import json
+from collections import OrderedDict, defaultdict
+from itertools import chain, islice
 
+from asgiref.sync import sync_to_async
 from django.core.paginator import Paginator
 from django.db.models import Q
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.response import Response
 
-from classes.models import ClassInstance
+from classes.models import ClassInstance, Occurrence
+from utils.profiling import timed
 
 
 def query_date_filter(days, when):
-    if when == -1:
+    if when is None:
+        # All instances within `days` of today
+        return Q(date__gte=datetime.date.today() - datetime.timedelta(days=days)) & \
+               Q(date__lte=datetime.date.today() + datetime.timedelta(days=days))
+    elif when == -1:
         # Past instances
         return Q(
             Q(date=datetime.date.today()) & Q(end_time__lt=datetime.datetime.now().time()) |
@@ -36,134 +49,437 @@ def query_date_filter(days, when):
         )
 
 
+def instance_date_filter(days, when):
+    """Returns a predicate on instance data, equivalent to `query_date_filter`.
+
+    Used to split an already-built list of instances, e.g. a cached schedule.
+    """
+    now = datetime.datetime.now()
+    today = now.date()
+    if when == -1:
+        return lambda i: today - datetime.timedelta(days=days) <= i["date"] < today \
+            or (i["date"] == today and i["end_time"] < now.time())
+    elif when == 0:
+        return lambda i: i["date"] == today and i["start_time"] <= now.time() <= i["end_time"]
+    else:
+        return lambda i: today < i["date"] <= today + datetime.timedelta(days=days) \
+            or (i["date"] == today and i["start_time"] > now.time())
+
+
+def recurrence_date_range(days, when):
+    """Returns the (first, last) dates that may contain an instance matching `days` and `when`.
+    """
+    if when is None:
+        return datetime.date.today() - datetime.timedelta(days=days), \
+            datetime.date.today() + datetime.timedelta(days=days)
+    elif when == -1:
+        return datetime.date.today() - datetime.timedelta(days=days), datetime.date.today()
+    elif when == 0:
+        return datetime.date.today(), datetime.date.today()
+    else:
+        return datetime.date.today(), datetime.date.today() + datetime.timedelta(days=days)
+
+
 def recurrence_date_filter(class_obj, days, when):
+    """Returns the dates of the scheduled (recurring) occurrences of `class_obj` matching `days` and `when`.
+    """
+    if class_obj.occurrences_cover(*recurrence_date_range(days, when)):
+        # Occurrences have been materialized for this range, so we can use them directly
+        return list(class_obj.occurrences.filter(query_date_filter(days, when))
+                    .order_by("date").values_list("date", flat=True))
+    with timed("rrule"):
+        if when is None:
+            return class_obj.get_occurrence_dates(*recurrence_date_range(days, when))
+        return [occurrence.date() for occurrence in expand_recurrence(class_obj, days, when)]
+
+
+def expand_recurrence(class_obj, days, when):
+    """Expands the recurrence rules of `class_obj` directly, for ranges that haven't been materialized.
+    """
     if when == -1:
         # Past instances
-        return class_obj.schedule.between(
+        return class_obj.expand_schedule(
             # `days` days ago
             datetime.datetime.now() - datetime.timedelta(days=days),
             # Now (note: if/else ensures that an instance w/ today's date is only included if
             # it has already past)
             datetime.datetime.combine(datetime.date.today(), datetime.time(0)) - datetime.timedelta(days=1)
             if datetime.datetime.now().time() <= class_obj.end_time
-            else datetime.datetime.now(),
-            inc=True
+            else datetime.datetime.now()
         )
     elif when == 0:
         # Current instances (in progress)
-        return class_obj.schedule.between(
+        return class_obj.expand_schedule(
             datetime.datetime.combine(datetime.date.today(), datetime.time(0)),
             datetime.datetime.combine(datetime.date.today(), datetime.time(23, 59, 59))
             # If in progress, then include occurrence on today's date
             if class_obj.start_time <= datetime.datetime.now().time() <= class_obj.end_time
             # Else, empty range (end date before start date)
-            else datetime.datetime.now() - datetime.timedelta(days=1),
-            inc=True
+            else datetime.datetime.now() - datetime.timedelta(days=1)
         )
     else:
-        return class_obj.schedule.between(
+        return class_obj.expand_schedule(
             # Now (note: if/else ensures that an instance w/ today's date is only included if
             # it has not yet started)
             datetime.datetime.combine(datetime.date.today(), datetime.time(0))
             if datetime.datetime.now().time() < class_obj.start_time
             else datetime.datetime.now(),
             # `days` days from now
-            datetime.datetime.now() + datetime.timedelta(days=days),
-            inc=True
+            datetime.datetime.now() + datetime.timedelta(days=days)
+        )
+
+
+def get_dropped_exceptions(user):
+    """Loads the instances that `user` has dropped (in a single query), grouped by parent class.
+
+    Returns a mapping of class ids to a pair of sets (pks of special instances, dates of non-special
+    instances), to be used as the `exceptions` of the instance builders below.
+    """
+    exceptions = defaultdict(lambda: (set(), set()))
+    for parent_id, pk, date, special in user.dropped_instances.values_list("parent_id", "pk", "date", "special"):
+        if special:
+            exceptions[parent_id][0].add(pk)
+        else:
+            exceptions[parent_id][1].add(date)
+    return exceptions
+
+
+async def aget_dropped_exceptions(user):
+    """Like `get_dropped_exceptions`, for async views.
+    """
+    exceptions = defaultdict(lambda: (set(), set()))
+    async for parent_id, pk, date, special in user.dropped_instances.values_list("parent_id", "pk", "date",
+                                                                                "special"):
+        if special:
+            exceptions[parent_id][0].add(pk)
+        else:
+            exceptions[parent_id][1].add(date)
+    return exceptions
+
+
+def non_special_instance_data(class_obj, date):
+    return {
+        "studio_id": class_obj.studio_id,
+        "class_id": class_obj.id,
+        "class_name": class_obj.name,
+        "coach": class_obj.coach,
+        "date": date,
+        "start_time": class_obj.start_time,
+        "end_time": class_obj.end_time,
+        "special": False,
+        "details": '/studios/{studio_id}/classes/{class_id}/ns/{date}/'.format(
+            studio_id=class_obj.studio_id,
+            class_id=class_obj.id,
+            date=date
         )
+    }
 
 
-def get_non_special_instances(studio_obj, class_obj, request, exceptions=ClassInstance.objects.none(), when=1):
+def special_instance_data(class_obj, instance):
+    return {
+        "studio_id": class_obj.studio_id,
+        "class_id": class_obj.id,
+        "class_name": class_obj.name,
+        "coach": class_obj.coach,
+        "date": instance.date,
+        "start_time": instance.start_time,
+        "end_time": instance.end_time,
+        "special": True,
+        "details": '/studios/{studio_id}/classes/{class_id}/{instance_id}/'.format(
+            studio_id=class_obj.studio_id,
+            class_id=class_obj.id,
+            instance_id=instance.id
+        )
+    }
+
+
+def get_non_special_instances(studio_obj, class_obj, request, exceptions=frozenset(), when=1):
     non_special_instances = [
-        {
-            "studio_id": class_obj.studio.id,
-            "class_id": class_obj.id,
-            "class_name": class_obj.name,
-            "coach": class_obj.coach,
-            "date": instance.date(),
-            "start_time": class_obj.start_time,
-            "end_time": class_obj.end_time,
-            "special": False,
-            "details": '/studios/{studio_id}/classes/{class_id}/ns/{date}/'.format(
-                studio_id=studio_obj.id,
-                class_id=class_obj.id,
-                date=instance.date()
-            )
-        }
-        for instance in recurrence_date_filter(class_obj, int(request.query_params.get("range", 14)), when)
-        # Include instance only if it is not in `exceptions`
-        if not exceptions.filter(date=instance.date()).exists()
+        non_special_instance_data(class_obj, date)
+        for date in recurrence_date_filter(class_obj, int(request.query_params.get("range", 14)), when)
+        # Include instance only if its date is not in `exceptions`
+        if date not in exceptions
     ]
     return non_special_instances
 
 
-def get_special_instances(studio_obj, class_obj, request, exceptions=ClassInstance.objects.none(), when=1):
+def get_special_instances(studio_obj, class_obj, request, exceptions=frozenset(), when=1):
     special_instances = [
-        {
-            "studio_id": class_obj.studio.id,
-            "class_id": class_obj.id,
-            "class_name": class_obj.name,
-            "coach": class_obj.coach,
-            "date": instance.date,
-            "start_time": instance.start_time,
-            "end_time": instance.end_time,
-            "special": True,
-            "details": '/studios/{studio_id}/classes/{class_id}/{instance_id}/'.format(
-                studio_id=studio_obj.id,
-                class_id=class_obj.id,
-                instance_id=instance.id
-            )
-        }
+        special_instance_data(class_obj, instance)
         for instance in class_obj.instances.filter(
             query_date_filter(int(request.query_params.get("range", 14)), when)
             & Q(cancelled=False) & Q(special=True)
         )
-        # Include instance only if it is not in `exceptions`
-        if not exceptions.filter(pk=instance.pk).exists()
+        # Include instance only if its pk is not in `exceptions`
+        if instance.pk not in exceptions
     ]
     return special_instances
 
 
-def get_all_instances(studio_obj, class_obj, request, special_exceptions=ClassInstance.objects.none(),
-                      nonspecial_exceptions=ClassInstance.objects.none(), when=1):
+def get_all_instances(studio_obj, class_obj, request, special_exceptions=frozenset(),
+                      nonspecial_exceptions=frozenset(), when=1):
     special_instances = get_special_instances(studio_obj, class_obj, request, special_exceptions, when)
     non_special_instances = get_non_special_instances(studio_obj, class_obj, request, nonspecial_exceptions, when)
     return special_instances + non_special_instances
 
 
-def get_exact_instances(instances, request, when=1):
-    instances = [
-        {
-            "studio_id": instance.parent.studio.id,
-            "class_id": instance.parent.id,
-            "class_name": instance.parent.name,
-            "coach": instance.parent.coach,
-            "date": instance.date,
-            "start_time": instance.start_time,
-            "end_time": instance.end_time,
-            "special": instance.special,
-            "details": '/studios/{studio_id}/classes/{class_id}/{instance_id}/'.format(
-                studio_id=instance.parent.studio.id,
-                class_id=instance.parent.id,
-                instance_id=instance.id
-            )
-        }
-        for instance in instances.filter(
-            query_date_filter(int(request.query_params.get("range", 14)), when)
-            & Q(cancelled=False)
+def instance_key(instance):
+    """The order of instances in a schedule, which is also used as the position of a pagination cursor.
+    """
+    return instance["date"], instance["start_time"], instance["class_id"]
+
+
+def history_key(instance):
+    return instance["date"], instance["end_time"], instance["class_id"]
+
+
+def keyset_filter(after, parent_field="parent_id"):
+    """Filters out rows that sort before `after` (a position returned by `instance_key`).
+    """
+    if after is None:
+        return Q()
+    date, start_time, class_id = after
+    return Q(date__gt=date) | Q(date=date, start_time__gt=start_time) | \
+        Q(date=date, start_time=start_time, **{parent_field + "__gte": class_id})
+
+
+def iter_class_instances(classes, request, exceptions=None, when=1, after=None):
+    """Yields the instances of all `classes`, ordered by `instance_key`.
+
+    Unlike calling `get_all_instances` for each class, the classes, their occurrences and their special
+    instances are fetched in a constant number of queries, and merged in a single pass.
+    `exceptions` optionally maps class ids to the (special, non-special) exceptions of that class,
+    as returned by `get_dropped_exceptions`. Instances are generated lazily, and if `after` is given,
+    the queries skip everything before that position, so a page of a cursor-paginated schedule only
+    reads as many rows as it needs.
+    """
+    days = int(request.query_params.get("range", 14))
+    date_range = recurrence_date_range(days, when)
+    exceptions = exceptions if exceptions is not None else {}
+    no_exceptions = (frozenset(), frozenset())
+    classes = {class_obj.id: class_obj for class_obj in classes}
+    materialized = [class_id for class_id, class_obj in classes.items() if class_obj.occurrences_cover(*date_range)]
+
+    occurrences = Occurrence.objects.filter(
+        Q(parent_id__in=materialized) & query_date_filter(days, when) & keyset_filter(after)
+    ).order_by("date", "start_time", "parent_id").values_list("parent_id", "date").iterator(chunk_size=100)
+    special_instances = ClassInstance.objects.filter(
+        Q(parent_id__in=classes.keys()) & query_date_filter(days, when) & Q(cancelled=False) & Q(special=True)
+        & keyset_filter(after)
+    ).order_by("date", "start_time", "parent_id", "pk").iterator(chunk_size=100)
+
+    streams = [
+        (
+            non_special_instance_data(classes[parent_id], date)
+            for parent_id, date in occurrences
+            if date not in exceptions.get(parent_id, no_exceptions)[1]
+        ),
+        (
+            special_instance_data(classes[instance.parent_id], instance)
+            for instance in special_instances
+            if instance.pk not in exceptions.get(instance.parent_id, no_exceptions)[0]
         )
     ]
-    return instances
+    # Classes without materialized occurrences for this range fall back to expanding their recurrence rules
+    for class_id, class_obj in classes.items():
+        if class_id not in materialized:
+            streams.append(get_non_special_instances(None, class_obj, request,
+                                                     exceptions.get(class_id, no_exceptions)[1], when))
+    return heapq.merge(*streams, key=instance_key)
+
+
+def exact_instance_data(instance):
+    return {
+        "studio_id": instance.parent.studio.id,
+        "class_id": instance.parent.id,
+        "class_name": instance.parent.name,
+        "coach": instance.parent.coach,
+        "date": instance.date,
+        "start_time": instance.start_time,
+        "end_time": instance.end_time,
+        "special": instance.special,
+        "details": '/studios/{studio_id}/classes/{class_id}/{instance_id}/'.format(
+            studio_id=instance.parent.studio.id,
+            class_id=instance.parent.id,
+            instance_id=instance.id
+        )
+    }
+
+
+def exact_instances_queryset(instances, request, when):
+    return instances.filter(
+        query_date_filter(int(request.query_params.get("range", 14)), when) & Q(cancelled=False)
+    ).select_related("parent__studio").order_by("date", "start_time", "parent_id", "pk")
+
+
+async def aiter_class_instances(classes, request, exceptions=None, when=1, after=None, limit=None):
+    """Like `iter_class_instances`, for async views, but returns a list.
+
+    The occurrences and the special instances are queried, and the recurrence rules of each class without
+    materialized occurrences are expanded (in a thread each), concurrently. If `limit` is given, only the first
+    `limit` instances (from `after`) are generated.
+    """
+    days = int(request.query_params.get("range", 14))
+    date_range = recurrence_date_range(days, when)
+    exceptions = exceptions if exceptions is not None else {}
+    no_exceptions = (frozenset(), frozenset())
+    classes = {class_obj.id: class_obj for class_obj in classes}
+    materialized = [class_id for class_id, class_obj in classes.items() if class_obj.occurrences_cover(*date_range)]
+
+    occurrences = Occurrence.objects.filter(
+        Q(parent_id__in=materialized) & query_date_filter(days, when) & keyset_filter(after)
+    ).order_by("date", "start_time", "parent_id").values_list("parent_id", "date")
+    special_instances = ClassInstance.objects.filter(
+        Q(parent_id__in=classes.keys()) & query_date_filter(days, when) & Q(cancelled=False) & Q(special=True)
+        & keyset_filter(after)
+    ).order_by("date", "start_time", "parent_id", "pk")
+    if limit is not None:
+        # Enough rows for `limit` instances, even if some of them are exceptions
+        occurrences = occurrences[:limit + sum(len(dates) for _, dates in exceptions.values())]
+        special_instances = special_instances[:limit + sum(len(pks) for pks, _ in exceptions.values())]
+
+    async def load_occurrences():
+        return [
+            non_special_instance_data(classes[parent_id], date)
+            async for parent_id, date in occurrences
+            if date not in exceptions.get(parent_id, no_exceptions)[1]
+        ]
+
+    async def load_special_instances():
+        return [
+            special_instance_data(classes[instance.parent_id], instance)
+            async for instance in special_instances
+            if instance.pk not in exceptions.get(instance.parent_id, no_exceptions)[0]
+        ]
+
+    def expand(class_obj):
+        instances = [
+            instance for instance in get_non_special_instances(None, class_obj, request,
+                                                               exceptions.get(class_obj.id, no_exceptions)[1], when)
+            if after is None or instance_key(instance) >= after
+        ]
+        return instances[:limit] if limit is not None else instances
+
+    streams = await asyncio.gather(
+        load_occurrences(), load_special_instances(),
+        # Classes without materialized occurrences for this range fall back to expanding their recurrence rules
+        *(sync_to_async(expand, thread_sensitive=False)(class_obj)
+          for class_id, class_obj in classes.items() if class_id not in materialized)
+    )
+    return list(islice(heapq.merge(*streams, key=instance_key), limit))
+
+
+def get_exact_instances(instances, request, when=1):
+    return [exact_instance_data(instance) for instance in exact_instances_queryset(instances, request, when)]
+
+
+async def aget_exact_instances(instances, request, when=1):
+    return [exact_instance_data(instance) async for instance in exact_instances_queryset(instances, request, when)]
 
 
 class ClassInstancePaginator:
-    def __init__(self, request):
+    """Paginates a list of instances by page number, or (if a `cursor` is requested) by position.
+
+    Cursor pagination takes an iterable of instances ordered by `key`, and only consumes it until the
+    page is full, so generating the instances lazily means that a page doesn't pay for the whole range.
+    An empty `cursor` requests the first page.
+    """
+    def __init__(self, request, key=instance_key, reverse=False):
         self.url_scheme = request.scheme
         self.host = request.get_host()
         self.path_info = request.path_info
         self.limit = request.query_params.get("limit", 20)
         self.page = request.query_params.get("page", 1)
         self.range = request.query_params.get("range", 14)
+        self.key = key
+        self.reverse = reverse
+        self.cursor = request.query_params.get("cursor")
+        self.position = None
+        self.offset = 0
+        if self.cursor:
+            self.position, self.offset = self.decode_cursor(self.cursor)
+
+    @property
+    def after(self):
+        """The position that the requested page starts at, to be passed to `iter_class_instances`.
+        """
+        return self.position if not self.reverse else None
+
+    @property
+    def needed(self):
+        """How many instances (from `after`) the requested page may read, or None if it needs all of them.
+        """
+        if self.cursor is None or self.reverse:
+            return None
+        try:
+            limit = int(self.limit)
+        except ValueError:
+            return None
+        # The instances skipped at the cursor's position, the page, and one to know if there is a next page
+        return self.offset + limit + 1 if limit > 0 else None
+
+    def decode_cursor(self, cursor):
+        try:
+            date, time, class_id, offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return (datetime.date.fromisoformat(date), datetime.time.fromisoformat(time), int(class_id)), \
+                int(offset)
+        except (binascii.Error, TypeError, ValueError):
+            raise NotFound(detail="Invalid cursor.")
+
+    @staticmethod
+    def encode_cursor(position, offset):
+        date, time, class_id = position
+        return base64.urlsafe_b64encode(
+            json.dumps([date.isoformat(), time.isoformat(), class_id, offset]).encode()
+        ).decode()
+
+    def paginate(self, data):
+        if self.cursor is not None:
+            return self.paginate_cursor(data)
+        return self.paginate_list(list(data))
+
+    def paginate_cursor(self, data):
+        try:
+            limit = int(self.limit)
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            raise ParseError(detail="Limit must be a positive integer.")
+
+        data = iter(data)
+        if self.position is not None:
+            # Skip everything up to the cursor (including the instances at that position on previous pages)
+            seen = 0
+            for instance in data:
+                position = self.key(instance)
+                if position == self.position:
+                    seen += 1
+                    if seen > self.offset:
+                        data = chain([instance], data)
+                        break
+                elif (position > self.position) != self.reverse:
+                    data = chain([instance], data)
+                    break
+        # One extra instance tells us whether there is a next page
+        results = list(islice(data, limit + 1))
+
+        next_url = None
+        if len(results) > limit:
+            results = results[:limit]
+            position = self.key(results[-1])
+            offset = sum(1 for instance in results if self.key(instance) == position)
+            if position == self.position:
+                offset += self.offset
+            if self.host and self.path_info:
+                next_url = '{}://{}{}?range={}&limit={}&cursor={}'.format(
+                    self.url_scheme, self.host, self.path_info, self.range, limit,
+                    self.encode_cursor(position, offset)
+                )
+
+        return Response(OrderedDict([
+            ('next', next_url),
+            ('results', results)
+        ]))
 
     def paginate_list(self, data):
         paginator = Paginator(data, self.limit)
@@ -1,5 +1,29 @@
+from django.core.paginator import InvalidPage
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 
 
 class LimitPageNumberPagination(PageNumberPagination):
     page_size_query_param = "limit"
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Like `paginate_queryset()`, for async views: the queryset is counted and the page is loaded
+        with the async ORM. `queryset` can also be a list.
+        """
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Set the (cached) count, so that the paginator doesn't count synchronously
+        paginator.count = len(queryset) if isinstance(queryset, list) else await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        if not isinstance(self.page.object_list, list):
+            self.page.object_list = [obj async for obj in self.page.object_list]
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return list(self.page)
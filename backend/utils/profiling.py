@@ -0,0 +1,195 @@
+import asyncio
+import cProfile
+import contextvars
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+# Metrics of the request being handled (None if it isn't sampled)
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        # Total time spent in each kind of work (in seconds)
+        self.timings = defaultdict(float)
+        # Kinds of work currently being timed, so that nested (e.g. recursive) calls aren't counted twice
+        self.active = set()
+
+
+def get_metrics():
+    """Returns the metrics of the current request, or None if it isn't being instrumented.
+    """
+    return _current.get()
+
+
+@contextmanager
+def timed(name):
+    """Adds the time spent in the block to the current request's `name` timing (if it is instrumented).
+    """
+    metrics = _current.get()
+    if metrics is None or name in metrics.active:
+        yield
+        return
+    metrics.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] += time.perf_counter() - start
+        metrics.active.discard(name)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper that counts the queries (and their time) of instrumented requests.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.timings["db"] += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# Record the queries of every new connection (including those of other threads, e.g. from `sync_to_async`)
+connection_created.connect(install_query_recorder, dispatch_uid="utils.profiling")
+
+
+class ProfilingMiddleware:
+    """Records the wall time, database queries and time, and other timings (see `timed`) of a sample
+    of requests, and reports them in a structured log entry (and, if `EXPOSE_HEADER`, a `Server-Timing` header).
+
+    An (even smaller) sample of requests can also be run under cProfile, and their profiles are dumped to
+    `PROFILE_DIR/<view name>/`. Requests that aren't sampled only pay for a call to `random()`.
+
+    The middleware supports both sync and async requests (so that async views aren't run in a thread under
+    ASGI). Profiles of async requests also include whatever else the event loop ran in the meantime.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the middleware as a coroutine function (like `MiddlewareMixin`)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if random.random() >= settings.PROFILING["SAMPLE_RATE"]:
+            return self.get_response(request)
+        metrics, token, profiler, start = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = self.stop(token, profiler, start)
+        return self.report(request, response, metrics, profiler, duration)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.PROFILING["SAMPLE_RATE"]:
+            return await self.get_response(request)
+        metrics, token, profiler, start = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            duration = self.stop(token, profiler, start)
+        return self.report(request, response, metrics, profiler, duration)
+
+    @staticmethod
+    def start():
+        # The connection of this thread may have been created before this module was loaded
+        install_query_recorder(connection)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        profiler = cProfile.Profile() if random.random() < settings.PROFILING["PROFILE_SAMPLE_RATE"] else None
+        if profiler is not None:
+            profiler.enable()
+        return metrics, token, profiler, time.perf_counter()
+
+    @staticmethod
+    def stop(token, profiler, start):
+        if profiler is not None:
+            profiler.disable()
+        duration = time.perf_counter() - start
+        _current.reset(token)
+        return duration
+
+    def report(self, request, response, metrics, profiler, duration):
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        db_time = metrics.timings.pop("db", 0.0)
+        if settings.PROFILING["EXPOSE_HEADER"]:
+            # Only when enabled, since timings and query counts tell clients about the internals of the server
+            response["Server-Timing"] = ", ".join(
+                ['total;dur={:.1f}'.format(duration * 1000),
+                 'db;dur={:.1f};desc="{} queries"'.format(db_time * 1000, metrics.queries)] +
+                ["{};dur={:.1f}".format(name, elapsed * 1000) for name, elapsed in metrics.timings.items()]
+            )
+        logger.info("%s %s %d in %.1fms (%d queries in %.1fms)", request.method, request.path,
+                    response.status_code, duration * 1000, metrics.queries, db_time * 1000, extra={
+                        "method": request.method, "path": request.path, "view": view_name,
+                        "status": response.status_code, "duration_ms": duration * 1000,
+                        "queries": metrics.queries, "db_ms": db_time * 1000,
+                        "timings_ms": {name: elapsed * 1000 for name, elapsed in metrics.timings.items()},
+                    })
+        if profiler is not None:
+            self.dump(profiler, view_name or "unresolved")
+        return response
+
+    @staticmethod
+    def dump(profiler, view_name):
+        directory = Path(settings.PROFILING["PROFILE_DIR"]) / view_name.replace(":", ".")
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / "{}-{}-{}.prof".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid(), id(profiler))
+        profiler.dump_stats(path)
+
+
+class TimedSerializerMixin:
+    """Serializer mixin that adds the time spent serializing to the request's `serialize` timing.
+    """
+
+    @property
+    def data(self):
+        with timed("serialize"):
+            return super().data
+
+    def to_representation(self, *args, **kwargs):
+        with timed("serialize"):
+            return super().to_representation(*args, **kwargs)
+
+
+_timed_serializers = {}
+
+
+class ProfiledViewMixin:
+    """DRF view mixin that times the serializers returned by `get_serializer()` (see `ProfilingMiddleware`).
+    """
+
+    def get_serializer_class(self):
+        serializer_class = super().get_serializer_class()
+        if get_metrics() is None:
+            # Not instrumented
+            return serializer_class
+        if serializer_class not in _timed_serializers:
+            _timed_serializers[serializer_class] = type(serializer_class.__name__,
+                                                        (TimedSerializerMixin, serializer_class), {})
+        return _timed_serializers[serializer_class]
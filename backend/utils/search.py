@@ -0,0 +1,48 @@
+import re
+import unicodedata
+
+# Longest token that is indexed (longer words are truncated, so they still match by prefix)
+MAX_TOKEN_LENGTH = 64
+
+
+def normalize(text):
+    """Lowercases `text` and strips accents, so that "Café" matches "cafe".
+    """
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Splits `text` into normalized words.
+    """
+    return [token[:MAX_TOKEN_LENGTH] for token in re.findall(r"\w+", normalize(text))]
+
+
+def prefix_range(prefix):
+    """Returns the (inclusive, exclusive) bounds of the strings starting with `prefix`, so that prefix matches
+    can be made with a range query (which, unlike LIKE, can always use an index).
+
+    The upper bound is the next prefix (e.g. "yoh" for "yog"), rather than `prefix` followed by the highest
+    code point, whose position depends on the collation (e.g. under PostgreSQL).
+    """
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def studio_tokens(studio):
+    """Yields the (kind, token, class id) of every searchable word of `studio`, its classes and its amenities.
+
+    Expects `classes__keywords` and `amenities` to have been prefetched.
+    """
+    for token in tokenize(studio.name):
+        yield "studio_name", token, None
+    for class_obj in studio.classes.all():
+        for token in tokenize(class_obj.name):
+            yield "class_name", token, class_obj.pk
+        for token in tokenize(class_obj.coach):
+            yield "coach", token, class_obj.pk
+        for keyword in class_obj.keywords.all():
+            for token in tokenize(keyword.name):
+                yield "keyword", token, class_obj.pk
+    for amenity in studio.amenities.all():
+        for token in tokenize(amenity.type):
+            yield "amenity", token, None
@@ -0,0 +1,28 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = {"DEFERRED", "IMMEDIATE", "EXCLUSIVE"}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Django's SQLite backend, with two more `OPTIONS` (see `utils.database`): `pragmas` to set on every new
+    connection, and the `transaction_mode` that transactions (e.g. atomic blocks) begin in.
+    """
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop("pragmas", None)
+        kwargs.pop("transaction_mode", None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma, value in self.settings_dict["OPTIONS"].get("pragmas", {}).items():
+            conn.execute("PRAGMA {} = {}".format(pragma, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict["OPTIONS"].get("transaction_mode", "DEFERRED")
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured("Unsupported SQLite transaction mode: {}".format(mode))
+        self.cursor().execute("BEGIN {}".format(mode))
@@ -0,0 +1,70 @@
+class DirtyFieldsMixin:
+    """Model mixin that remembers the values an instance was loaded (or last saved) with.
+
+    This lets `save()` tell which fields have changed (and only write those) without fetching the row again.
+    Values are compared in their database representation, so that fields holding mutable objects (like a
+    `RecurrenceField`) are seen as changed when the object is modified in place.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.reset_dirty_fields()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        self.reset_dirty_fields(fields)
+
+    def save(self, *args, **kwargs):
+        """Saves the instance, only writing the fields that have changed (unless `update_fields` is given).
+
+        Nothing is written (and no signals are sent) if no fields have changed.
+        """
+        if not self._state.adding and hasattr(self, "_loaded_values") \
+                and "update_fields" not in kwargs and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = self.get_dirty_fields()
+            if not kwargs["update_fields"]:
+                return
+        super().save(*args, **kwargs)
+        self.reset_dirty_fields(kwargs.get("update_fields"))
+
+    def _tracked_fields(self, field_names=None):
+        deferred = self.get_deferred_fields()
+        return [
+            field for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname not in deferred
+            and (field_names is None or field.name in field_names or field.attname in field_names)
+        ]
+
+    def reset_dirty_fields(self, field_names=None):
+        """Marks the given fields (or all of them) as matching the database.
+        """
+        if not hasattr(self, "_loaded_values"):
+            self._loaded_values = {}
+        for field in self._tracked_fields(field_names):
+            self._loaded_values[field.attname] = field.get_prep_value(getattr(self, field.attname))
+
+    def get_loaded_values(self):
+        """Returns the values of the fields (by attname) as they are in the database.
+        """
+        if not hasattr(self, "_loaded_values"):
+            # Not loaded from the database (e.g. constructed with an existing pk)
+            return type(self)._base_manager.get(pk=self.pk).get_loaded_values()
+        return self._loaded_values
+
+    def get_dirty_fields(self):
+        """Returns the names of the fields that have changed since the instance was loaded or saved.
+        """
+        if self.pk is None or not hasattr(self, "_loaded_values"):
+            return [field.name for field in self._tracked_fields()]
+        dirty = [
+            field.name for field in self._tracked_fields()
+            if field.attname not in self._loaded_values
+            or field.get_prep_value(getattr(self, field.attname)) != self._loaded_values[field.attname]
+        ]
+        # Fields derived from another field when saving (like a `LowercaseField`) change along with it
+        return dirty + [
+            field.name for field in self._tracked_fields()
+            if getattr(field, "source", None) in dirty and field.name not in dirty
+        ]
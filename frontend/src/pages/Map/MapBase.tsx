@@ -42,6 +42,7 @@ function MapBase({
           lat: mapLocation.lat.toFixed(6),
           long: mapLocation.lng.toFixed(6),
           limit: "20",
+          k: "20",
         },
       })
       .then((res) => {